@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Memory and time benchmarks for MERRA-2 processing steps
+
+Run as:
+
+  python -m data_downloading.merra2.benchmark
+
+Each benchmark compares the current implementation against the
+previous one on a representative field; an M2I3NPASM 3D variable for
+one day on a subset of pressure levels by default.
+
+"""
+import time
+import tracemalloc
+
+import numpy as np
+
+from .merra2downloader import prepareValues
+from ..utils.bufferPool import BufferPool
+from ..utils.decode import nativeByteOrder, scaleFillData
+from ..utils.interpLonLat import InterpLonLat
+
+SHAPE = (8, 6, 361, 576)                                                        # time, lev, lat, lon of a representative 3D field
+FILL  = np.float32(1.0e15)
+
+def legacyPrepareValues( values, fill, interp ):
+  """Copy of prepareValues before work buffers were used, for comparison"""
+
+  if isinstance(values, np.ma.core.MaskedArray):
+    fill   = values.fill_value
+    values = values.filled(np.nan)
+  elif fill is not None:
+    if 'float' not in values.dtype.name:
+      values = values.astype('float32')
+    values[ values == fill ] = np.nan
+
+  values = interp.interpolate( values )
+  if fill is not None:
+    values[ np.isnan(values) ] = fill
+  return values, fill
+
+def legacyScaleFillData( values, atts, fillValue = None ):
+  """Copy of byte swap and scaleFillData before the single-pass decode, for comparison"""
+
+  values = values.astype( values.dtype.newbyteorder('=') )
+  bad    = None
+  if '_FillValue' in atts:
+    bad = (values == atts['_FillValue'])
+  if 'missing_value' in atts:
+    if bad is None:
+      bad = (values == atts['missing_value'])
+    else:
+      bad = ((values == atts['missing_value']) | bad)
+  if 'scale_factor' in atts and 'add_offset' in atts:
+    values = values * atts['scale_factor'] + atts['add_offset']
+  if bad is not None:
+    if np.sum(bad) > 0:
+      if values.dtype.kind != 'f':
+        values = values.astype(np.float32)
+    values[bad] = np.nan if fillValue is None else fillValue
+  return values
+
+def currentScaleFillData( values, atts, fillValue = None ):
+  """Byte swap and decode as done by PyDAPDataset.getVar"""
+
+  values = nativeByteOrder( values, inplace = True )
+  return scaleFillData( values, atts, fillValue, inplace = True )
+
+def sampleField( shape = SHAPE, fill = FILL, fraction = 0.05, seed = 0 ):
+  """
+  Generate random field with a fraction of fill values
+
+  Arguments:
+    None.
+
+  Keyword arguments:
+    shape (tuple) : Shape of field
+    fill (float) : Fill value
+    fraction (float) : Fraction of points set to fill
+    seed (int) : Seed for random number generator
+
+  Returns:
+    tuple : Field, longitude, and latitude
+
+  """
+
+  rng    = np.random.default_rng( seed )
+  values = rng.standard_normal( shape, dtype = 'float32' )
+  values[ rng.random( shape ) < fraction ] = fill
+  lon    = np.linspace( -180.0, 180.0, shape[-1], endpoint = False )
+  lat    = np.linspace(  -90.0,  90.0, shape[-2] )
+  return values, lon, lat
+
+def measure( func, *args, repeat = 3 ):
+  """
+  Measure best wall time and peak traced memory of function call
+
+  Arguments:
+    func (callable) : Function to call
+    *args : Passed to func; arrays are copied before each call so that
+      in-place changes do not carry over
+
+  Keyword arguments:
+    repeat (int) : Number of calls; the best time is reported
+
+  Returns:
+    tuple : Best time, in seconds, and peak memory, in bytes, allocated
+      during the call
+
+  """
+
+  best = peak = 0
+  for i in range( repeat ):
+    callArgs = [arg.copy() if isinstance(arg, np.ndarray) else arg for arg in args]
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func( *callArgs )
+    dt = time.perf_counter() - t0
+    _, mem = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = dt if i == 0 else min(best, dt)
+    peak = max(peak, mem)
+  return best, peak
+
+def benchmarkPrepareValues( shape = SHAPE, dLon = None, dLat = None, repeat = 3 ):
+  """
+  Compare legacy and current prepareValues
+
+  Arguments:
+    None.
+
+  Keyword arguments:
+    shape (tuple) : Shape of field to process
+    dLon (float) : Longitude resolution to interpolate to
+    dLat (float) : Latitude resolution to interpolate to
+    repeat (int) : Number of calls to time
+
+  Returns:
+    dict : Time and peak memory for 'legacy' and 'current' versions
+
+  """
+
+  values, lon, lat = sampleField( shape )
+  interp = InterpLonLat( lon, lat )
+  interp.setLonLatRes( dLon, dLat )
+
+  buffers = BufferPool()
+  prepareValues( values.copy(), FILL, interp, buffers )                         # Warm buffers, as when processing many granules
+
+  results = {
+    'legacy'  : measure( legacyPrepareValues, values, FILL, interp, repeat = repeat ),
+    'current' : measure( prepareValues, values, FILL, interp, buffers, repeat = repeat ),
+  }
+  return results
+
+def benchmarkScaleFillData( shape = SHAPE, packed = False, repeat = 3 ):
+  """
+  Compare legacy and current decoding of big-endian values from server
+
+  Arguments:
+    None.
+
+  Keyword arguments:
+    shape (tuple) : Shape of field to decode
+    packed (bool) : If set, decode int16 values with scale_factor and
+      add_offset; otherwise float32 values with fill values only
+    repeat (int) : Number of calls to time
+
+  Returns:
+    dict : Time and peak memory for 'legacy' and 'current' versions
+
+  """
+
+  values, _, _ = sampleField( shape )
+  atts = {'_FillValue' : FILL, 'missing_value' : FILL}
+  if packed:
+    bad    = values == FILL
+    values = np.clip( values * 1000.0, -32000, 32000 ).astype( np.int16 )
+    values[bad] = -32767
+    atts   = {'_FillValue' : np.int16(-32767), 'missing_value' : np.int16(-32767),
+              'scale_factor' : np.float32(0.001), 'add_offset' : np.float32(0.0)}
+  values = values.astype( values.dtype.newbyteorder('>') )                      # As sent by server
+
+  expect = legacyScaleFillData( values.copy(), atts )
+  assert np.array_equal( expect, currentScaleFillData( values.copy(), atts ), equal_nan = True )
+
+  results = {
+    'legacy'  : measure( legacyScaleFillData, values, atts, repeat = repeat ),
+    'current' : measure( currentScaleFillData, values, atts, repeat = repeat ),
+  }
+  return results
+
+def report( name, results, nbytes ):
+  print( '{} ({:.1f} MB field)'.format( name, nbytes / 1.0e6 ) )
+  for key, (dt, peak) in results.items():
+    print( '  {:8s} : {:8.3f} s {:10.1f} MB peak'.format( key, dt, peak / 1.0e6 ) )
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser( description = 'Benchmark MERRA-2 processing' )
+  parser.add_argument( '--shape',  type = int, nargs = 4, default = SHAPE )
+  parser.add_argument( '--dLon',   type = float )
+  parser.add_argument( '--dLat',   type = float )
+  parser.add_argument( '--repeat', type = int, default = 3 )
+  args  = parser.parse_args()
+
+  shape = tuple( args.shape )
+  nbytes = int( np.prod( shape ) ) * 4
+  report( 'prepareValues',
+    benchmarkPrepareValues( shape, args.dLon, args.dLat, args.repeat ), nbytes )
+  report( 'scaleFillData',
+    benchmarkScaleFillData( shape, False, args.repeat ), nbytes )
+  report( 'scaleFillData (packed int16)',
+    benchmarkScaleFillData( shape, True, args.repeat ), nbytes // 2 )
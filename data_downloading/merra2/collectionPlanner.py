@@ -0,0 +1,304 @@
+"""
+Choose the cheapest MERRA-2 collection for a request
+
+The same quantity is often available from several collections; e.g.,
+monthly mean PRECTOT can be computed from the hourly M2T1NXFLX
+collection or downloaded directly from the monthly M2TMNXFLX
+collection, with 1/720th of the requests and data. The planner searches
+the known collections (utils.esdt) for ones containing all requested
+variables at, or finer than, the requested temporal aggregate, and
+ranks them by bytes transferred plus the cost of the requests made.
+
+Contents of collections are read from the metadata cache, which is
+filled the first time a granule of the collection is opened. If
+allowed, the DDS of collections not yet in the cache is downloaded.
+
+"""
+import logging
+
+import numpy as np
+
+from ..utils.esdt import EarthScienceDataType, ESDT2COLL, CODE2FREQ, CODE2GRUP, CODE2TIME
+from ..utils.metadataCache import MetadataCache
+from ..utils.requestPlan import REQUESTBYTES, sliceLen
+from .reductions import reductionOps
+
+VERSION     = '5.12.4'
+AGGREGATES  = {'hourly' : 1, '3-hourly' : 3, '6-hourly' : 6, 'daily' : 'D', 'monthly' : 'M'}
+HOURS       = {1 : 1, 3 : 3, 6 : 6, 'D' : 24, 'M' : 24 * 30}                    # Approximate length, in hours, of each frequency
+UNKNOWN     = 'contents unknown; not in metadata cache'
+METAREQUESTS = 3                                                                # DDS, DAS, and coordinate requests per granule
+
+def selectionShape( esdt, var, dims, shape, coords ):
+  """
+  Shape of the selection of a variable
+
+  Dimensions whose coordinate values are not known, or whose selection
+  is not a single range (e.g., boxes or lists), are counted in full, so
+  the shape is an upper bound.
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT of collection; gives coordinate
+      names
+    var (MERRA2Variable) : Variable selection
+    dims (tuple) : Dimension names of the remote variable
+    shape (tuple) : Shape of the remote variable
+    coords (dict) : Coordinate values keyed by dimension name; e.g.,
+      from the metadata cache
+
+  Returns:
+    tuple : Number of elements selected along each dimension
+
+  """
+
+  select = {esdt.lonVar : var.longitude, esdt.latVar  : var.latitude,
+            esdt.levVar : var.level,     esdt.timeVar : var.time}
+  out    = []
+  for dim, n in zip( dims, shape ):
+    ref  = select.get( dim, None )
+    data = coords.get( dim, None )
+    if ref is None or data is None or var.boxes is not None or isinstance(ref, (list, tuple)):
+      out.append( n )
+      continue
+    try:
+      out.append( sliceLen( var._countOffset( ref, data ) ) )
+    except Exception:
+      out.append( n )
+  return tuple( out )
+
+def describeCollection( esdt, date=None, remote=False ):
+  """
+  Variables and coordinates of a collection
+
+  Arguments:
+    esdt (EarthScienceDataType) : Collection to describe
+
+  Keyword arguments:
+    date (datetime) : Date of granule to open if collection is not in
+      the metadata cache
+    remote (bool) : If set, open a granule of the collection when it
+      is not in the metadata cache
+
+  Returns:
+    tuple : DDS dict, see MetadataCache.getDDS(), and dict of coordinate
+      values; (None, None) if not known
+
+  """
+
+  log   = logging.getLogger(__name__)
+  cache = MetadataCache( esdt.shortName, exclude = (esdt.timeVar,) )
+  if cache.getDDS() is None and remote and date is not None:
+    from ..utils.pydapData import PyDAPDataset
+    log.info( f'Getting contents of collection : {esdt.shortName}' )
+    try:
+      PyDAPDataset( esdt.getFullURL( date ), cache = cache ).close()
+    except Exception as err:
+      log.warning( f'Failed to describe collection {esdt.shortName} : {err}' )
+    cache.save()
+  dds = cache.getDDS()
+  if dds is None:
+    return None, None
+  coords = {}
+  for dim in (esdt.lonVar, esdt.latVar, esdt.levVar):
+    values = cache.getValues( dim )
+    if values is not None:
+      coords[dim] = values
+  return dds, coords
+
+class CollectionPlan():
+  """
+  Cost of answering a request with one collection
+
+  Attributes:
+    esdt (EarthScienceDataType) : Collection to download
+    granules (int) : Number of granules in the time range
+    requests (int) : Number of remote requests
+    nbytes (int) : Bytes of data transferred
+    reduce (tuple) : Reductions to compute while downloading; None if
+      collection is at the requested aggregate
+    period (str) : Period to combine reduced granules over; see
+      merra2downloader.download()
+    reason (str) : Why the collection can be used
+
+  """
+
+  def __init__(self, esdt, granules, requests, nbytes, reduce=None, period=None, reason=''):
+    self.esdt     = esdt
+    self.granules = granules
+    self.requests = requests
+    self.nbytes   = nbytes
+    self.reduce   = reduce
+    self.period   = period
+    self.reason   = reason
+    self.rejected = []                                                          # (shortName, reason) of collections not used; set by planCollection
+    self.others   = []                                                          # Usable plans that cost more; set by planCollection
+
+  def __repr__(self):
+    return f'< {self.__class__.__name__} : {self.esdt.shortName} >'
+
+  def __str__(self):
+    return self.explain()
+
+  @property
+  def cost(self):
+    """Bytes transferred plus cost of requests, in bytes"""
+
+    return self.nbytes + self.requests * REQUESTBYTES
+
+  @property
+  def downloadKwargs(self):
+    """Keyword arguments for merra2downloader.download()"""
+
+    kwargs = {}
+    if self.reduce:
+      kwargs['reduce'] = self.reduce
+    if self.period:
+      kwargs['period'] = self.period
+    return kwargs
+
+  def summary(self):
+    return '{:s} : {:d} granules, {:d} requests, {:.1f} MB'.format(
+      self.esdt.shortName, self.granules, self.requests, self.nbytes / 1.0e6 )
+
+  def explain(self):
+    """Description of the chosen collection and why others were not"""
+
+    lines   = [f'Use {self.summary()}', f'  {self.reason}']
+    unknown = []
+    for other in self.others:
+      lines.append( '  Not {} : {:.0f}x the cost'.format( other.summary(), other.cost / max(self.cost, 1) ) )
+    for shortName, reason in self.rejected:
+      if reason == UNKNOWN:
+        unknown.append( shortName )
+      else:
+        lines.append( f'  Not {shortName} : {reason}' )
+    if unknown:
+      lines.append( '  Not searched, {} : {}'.format( UNKNOWN, ', '.join( unknown ) ) )
+    return '\n'.join( lines )
+
+def candidates( version=VERSION ):
+  """ESDTs of all known collections that vary in time"""
+
+  out = []
+  for code in ESDT2COLL:
+    esdt = EarthScienceDataType()
+    try:
+      esdt.parseString( f'{code}.{version}' )
+    except Exception:                                                           # Codes not following the ESDT specification
+      continue
+    if esdt._T == 'C' or esdt._F in (0, 'U'): continue                          # Constants and monthly-diurnal means cannot answer time aggregates
+    out.append( esdt )
+  return out
+
+def evaluate( esdt, variables, aggregate, reduce, startDate, endDate, remote=False ):
+  """
+  Plan for answering request with one collection
+
+  Arguments:
+    esdt (EarthScienceDataType) : Collection to evaluate
+    variables (list) : MERRA2Variable instances requested
+    aggregate (str) : Temporal aggregate; key of AGGREGATES
+    reduce (str) : Reduction over time to reach aggregate
+    startDate (datetime) : Start of time range
+    endDate (datetime) : End of time range; exclusive
+
+  Keyword arguments:
+    remote (bool) : If set, collections not in the metadata cache are
+      described by opening a granule
+
+  Returns:
+    tuple : CollectionPlan, or None, and reason the collection cannot
+      be used
+
+  """
+
+  dds, coords = describeCollection( esdt, startDate, remote )
+  if dds is None:
+    return None, UNKNOWN
+  missing = [var.varname for var in variables if var.varname not in dds]
+  if missing:
+    return None, 'missing {}'.format( ', '.join( missing ) )
+
+  target = AGGREGATES[aggregate]
+  native = esdt._F
+  if HOURS[native] > HOURS[target]:
+    return None, 'coarser than {}'.format( aggregate )
+  if native == target:
+    if native == 'M' and reduce != 'mean':
+      return None, 'monthly means cannot give monthly {}'.format( reduce )
+    ops, period = None, None
+    reason = '{} collection is already at requested aggregate'.format( CODE2FREQ[native].lower() )
+  elif target == 'D' and native != 'M':
+    ops, period = reductionOps( reduce ), None
+    reason = 'daily {} of {} {} data'.format( reduce, CODE2FREQ[native].lower(), CODE2TIME[esdt._T].lower() )
+  elif target == 'M':
+    ops, period = reductionOps( reduce ), 'month'
+    reason = 'monthly {} of {} {} data'.format( reduce, CODE2FREQ[native].lower(), CODE2TIME[esdt._T].lower() )
+  else:
+    return None, 'cannot reduce {} data to {}'.format( CODE2FREQ[native].lower(), aggregate )
+
+  granules = len( list( esdt.getDates( startDate, endDate ) ) )
+  nbytes   = 0
+  for var in variables:
+    dims, shape, dtype = dds[ var.varname ]
+    nbytes += int( np.prod( selectionShape( esdt, var, dims, shape, coords ) ) ) * np.dtype(dtype).itemsize
+  plan = CollectionPlan( esdt, granules, granules * (1 + METAREQUESTS), granules * nbytes,
+                         reduce = ops, period = period,
+                         reason = '{}; {}'.format( CODE2GRUP[esdt._GGG].lower(), reason ) )
+  return plan, None
+
+def planCollection( variables, aggregate, startDate, endDate, reduce='mean',
+        version=VERSION, remote=False ):
+  """
+  Find the cheapest collection for a request
+
+  Arguments:
+    variables (list) : MERRA2Variable instances requested
+    aggregate (str) : Temporal aggregate wanted; one of 'hourly',
+      '3-hourly', '6-hourly', 'daily', 'monthly'
+    startDate (datetime) : Start of time range
+    endDate (datetime) : End of time range; exclusive
+
+  Keyword arguments:
+    reduce (str) : Reduction over time to reach the aggregate from finer
+      collections; see merra2downloader.download()
+    version (str) : Collection version
+    remote (bool) : If set, collections not in the metadata cache are
+      described by opening a granule; this makes one request per
+      collection searched
+
+  Returns:
+    CollectionPlan : Plan with lowest cost; other usable and rejected
+      collections are listed in its explanation. None if no known
+      collection can answer the request
+
+  Example:
+    >>> plan = planCollection( [MERRA2Variable('PRECTOT')], 'monthly',
+    ...                        datetime(1980, 1, 1), datetime(2020, 1, 1) )
+    >>> print( plan.explain() )
+    >>> download( plan.esdt, variables, start, end, outdir, **plan.downloadKwargs )
+
+  """
+
+  log = logging.getLogger(__name__)
+  if aggregate not in AGGREGATES:
+    raise ValueError( f'Unsupported aggregate : {aggregate}; must be one of {list(AGGREGATES)}' )
+
+  plans    = []
+  rejected = []
+  for esdt in candidates( version ):
+    plan, reason = evaluate( esdt, variables, aggregate, reduce, startDate, endDate, remote )
+    if plan is None:
+      rejected.append( (esdt.shortName, reason) )
+    else:
+      plans.append( plan )
+
+  if len(plans) == 0:
+    log.warning( 'No known collection has all variables at {} or finer'.format( aggregate ) )
+    return None
+  plans.sort( key = lambda plan: (plan.cost, plan.requests, plan.esdt._T != 'T') ) # Prefer time averages over instantaneous values when costs are equal
+  best          = plans[0]
+  best.others   = plans[1:]
+  best.rejected = [item for item in rejected if not item[1].startswith('missing')] # Collections without the variables are not worth listing
+  log.info( best.explain() )
+  return best
@@ -0,0 +1,325 @@
+"""
+Variables derived from MERRA-2 fields at download time
+
+A derived variable is requested like a MERRA2Variable, but is computed
+from one or more remote variables on each granule as it is downloaded;
+only the derived fields are written to the local file. For example,
+the 1000-850 hPa layer mean of U is written as a single 2D field rather
+than as one field per level.
+
+Pressure levels are assumed to be in hPa, as in the MERRA-2 Np
+collections.
+
+"""
+import numpy as np
+
+from .variables import MERRA2Variable
+
+GRAVITY = 9.80665                                                               # Standard gravity; m s-2
+PASCALS = 100.0                                                                 # Pa per hPa
+REMOVE  = ('long_name', 'standard_name', 'units', 'valid_range', 'vmin', 'vmax')# Attributes of inputs that do not apply to derived fields
+
+def pressureWeights( levels ):
+  """
+  Trapezoidal weights, in Pa, for integrating over pressure levels
+
+  Arguments:
+    levels (numpy.ndarray) : Pressure levels, in hPa, in any order
+
+  Returns:
+    numpy.ndarray : Weights, same size as levels
+
+  """
+
+  p = np.asarray( levels, dtype = np.float64 ) * PASCALS
+  if p.size < 2:
+    raise ValueError( 'At least two levels are needed to integrate over pressure' )
+  half = np.abs( np.diff( p ) ) / 2.0
+  w    = np.zeros( p.size )
+  w[:-1] += half
+  w[1:]  += half
+  return w
+
+def integrate( values, levels, axis ):
+  """
+  Pressure-weighted integral over levels, ignoring missing values
+
+  Arguments:
+    values (numpy.ndarray) : Values with NaN where missing; e.g., below
+      ground
+    levels (numpy.ndarray) : Pressure levels, in hPa
+    axis (int) : Level axis of values
+
+  Returns:
+    tuple : Integral, in units of values times Pa, and the total weight
+      of the valid values; both with the level axis removed
+
+  """
+
+  shape       = [1] * values.ndim
+  shape[axis] = -1
+  valid  = ~np.isnan( values )
+  w      = np.where( valid, pressureWeights( levels ).reshape( shape ), 0.0 )
+  total  = (np.where( valid, values, 0.0 ) * w).sum( axis = axis )
+  weight = w.sum( axis = axis )
+  with np.errstate( invalid = 'ignore' ):
+    total = np.where( weight > 0, total, np.nan )
+  return total, weight
+
+class DerivedVariable():
+  """
+  Base class for derived variables
+
+  Subclasses set the remote variables needed, as MERRA2Variable
+  instances, and define compute().
+
+  """
+
+  def __init__(self, name, inputs):
+    """
+    Arguments:
+      name (str) : Name of derived variable; names of local variables
+        written start with this
+      inputs (dict) : MERRA2Variable instances needed, keyed by the
+        names used in compute()
+
+    """
+
+    self.name   = name
+    self.inputs = inputs
+    for key, var in inputs.items():
+      var.name = f'{name}.{key}'                                                # Unique internal name; never written
+
+  def __repr__(self):
+    varnames = ', '.join( var.varname for var in self.inputs.values() )
+    return f'< {self.__class__.__name__} : {self.name} from {varnames} >'
+
+  @property
+  def outputs(self):
+    """Names of local variables written"""
+
+    return [self.name]
+
+  def spec(self):
+    """Dictionary describing the derived variable"""
+
+    return {'derived' : self.__class__.__name__,
+            'name'    : self.name,
+            'inputs'  : {key : var.spec() for key, var in self.inputs.items()}}
+
+  def compute(self, values, levels, axis):
+    """
+    Compute derived fields
+
+    Arguments:
+      values (dict) : Input values, as float with NaN where missing,
+        keyed as in inputs
+      levels (numpy.ndarray) : Pressure levels of inputs, in hPa
+      axis (int) : Level axis of values
+
+    Returns:
+      dict : (values, attributes) tuples keyed by local variable name
+
+    """
+
+    raise NotImplementedError
+
+  def evaluate(self, held, levVar, levels):
+    """
+    Compute derived fields from downloaded inputs
+
+    Arguments:
+      held (dict) : (values, fill, atts) tuples keyed by input name
+      levVar (str) : Name of level dimension
+      levels (numpy.ndarray) : Pressure levels of inputs, in hPa
+
+    Returns:
+      list : (name, values, fill, atts) tuples, one per local variable,
+        with fill values in place of NaN
+
+    """
+
+    arrays = {}
+    fill   = None
+    for key, var in self.inputs.items():
+      values, varFill, atts = held[ var.name ]
+      values = values.astype( np.float32 if values.dtype.itemsize < 8 else np.float64 )
+      if varFill is not None:
+        values[ values == varFill ] = np.nan
+        if fill is None: fill = varFill
+      arrays[key] = values
+    axis = atts['dimensions'].index( levVar )
+    dims = tuple( d for d in atts['dimensions'] if d != levVar )
+    base = {att : val for att, val in atts.items() if att not in REMOVE}
+    out  = []
+    for name, (values, newAtts) in self.compute( arrays, levels, axis ).items():
+      outAtts = dict( base, dimensions = dims, **newAtts )
+      values  = values.astype( np.float32 )
+      if fill is not None:
+        values[ np.isnan(values) ] = fill
+      out.append( (name, values, fill, outAtts) )
+    return out
+
+class LayerMean( DerivedVariable ):
+  """Pressure-weighted mean of a variable over a layer"""
+
+  def __init__(self, varname, level, name=None, **kwargs):
+    """
+    Arguments:
+      varname (str) : Name of variable on remote
+      level (slice,list) : Levels of the layer; e.g., slice(850, 1000)
+
+    Keyword arguments:
+      name (str) : Name of variable in local file. Default is
+        <varname>_mean_<top>_<bottom>
+      **kwargs : Other selections (longitude, latitude, time, boxes);
+        see MERRA2Variable
+
+    """
+
+    if name is None:
+      name = f'{varname}_mean_{layerName(level)}'
+    super().__init__( name, {'x' : MERRA2Variable( varname, level = level, **kwargs )} )
+
+  def compute(self, values, levels, axis):
+    total, weight = integrate( values['x'], levels, axis )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+      mean = total / weight
+    return {self.name : (mean, {'long_name' : f'pressure-weighted layer mean of {self.inputs["x"].varname}',
+                                'cell_methods' : 'pressure: mean'})}
+
+  def evaluate(self, held, levVar, levels):
+    units = held[ self.inputs['x'].name ][2].get( 'units', None )
+    out   = super().evaluate( held, levVar, levels )
+    if units is not None:                                                       # Layer mean has units of input
+      for _, _, _, atts in out:
+        atts['units'] = units
+    return out
+
+class VerticalIntegral( DerivedVariable ):
+  """Mass-weighted vertical integral, (1/g) * integral of x dp"""
+
+  def __init__(self, varname, level, name=None, **kwargs):
+    """
+    Arguments:
+      varname (str) : Name of variable on remote
+      level (slice,list) : Levels to integrate over
+
+    Keyword arguments:
+      name (str) : Name of variable in local file. Default is
+        <varname>_int_<top>_<bottom>
+      **kwargs : Other selections (longitude, latitude, time, boxes);
+        see MERRA2Variable
+
+    """
+
+    if name is None:
+      name = f'{varname}_int_{layerName(level)}'
+    super().__init__( name, {'x' : MERRA2Variable( varname, level = level, **kwargs )} )
+
+  def compute(self, values, levels, axis):
+    total, _ = integrate( values['x'], levels, axis )
+    return {self.name : (total / GRAVITY,
+                         {'long_name' : f'vertically integrated {self.inputs["x"].varname}',
+                          'cell_methods' : 'pressure: sum'})}
+
+  def evaluate(self, held, levVar, levels):
+    units = held[ self.inputs['x'].name ][2].get( 'units', None )
+    out   = super().evaluate( held, levVar, levels )
+    for _, _, _, atts in out:
+      atts['units'] = 'kg m-2' if units in (None, '1', 'kg kg-1') else f'{units} kg m-2'
+    return out
+
+class MoistureFlux( DerivedVariable ):
+  """
+  Vertically integrated moisture flux
+
+  The eastward and northward components, (1/g) * integral of q u dp and
+  (1/g) * integral of q v dp, are written as <name>_u and <name>_v.
+
+  """
+
+  def __init__(self, level, name='IVT', uName='U', vName='V', qName='QV', **kwargs):
+    """
+    Arguments:
+      level (slice,list) : Levels to integrate over
+
+    Keyword arguments:
+      name (str) : Prefix of variables in local file
+      uName (str) : Name of eastward wind on remote
+      vName (str) : Name of northward wind on remote
+      qName (str) : Name of specific humidity on remote
+      **kwargs : Other selections (longitude, latitude, time, boxes);
+        see MERRA2Variable
+
+    """
+
+    super().__init__( name, {
+      'u' : MERRA2Variable( uName, level = level, **kwargs ),
+      'v' : MERRA2Variable( vName, level = level, **kwargs ),
+      'q' : MERRA2Variable( qName, level = level, **kwargs )} )
+
+  @property
+  def outputs(self):
+    return [f'{self.name}_u', f'{self.name}_v']
+
+  def compute(self, values, levels, axis):
+    out = {}
+    for key, direction in zip( ('u', 'v'), ('eastward', 'northward') ):
+      total, _ = integrate( values['q'] * values[key], levels, axis )
+      out[f'{self.name}_{key}'] = (total / GRAVITY,
+          {'long_name' : f'vertically integrated {direction} moisture flux',
+           'units'     : 'kg m-1 s-1'})
+    return out
+
+def layerName( level ):
+  """Short description of levels for default variable names"""
+
+  if isinstance(level, slice):
+    return f'{level.start:g}_{level.stop:g}'
+  if isinstance(level, (list, tuple)):
+    return f'{min(level):g}_{max(level):g}'
+  return f'{level:g}'
+
+def expandDerived( variables ):
+  """
+  Replace derived variables by the remote variables they need
+
+  Arguments:
+    variables (list) : MERRA2Variable and DerivedVariable instances
+
+  Returns:
+    tuple : List of MERRA2Variable instances to download, and dict
+      mapping name of each input of a derived variable to the derived
+      variable
+
+  """
+
+  out    = []
+  owners = {}
+  for var in variables:
+    if isinstance(var, DerivedVariable):
+      for inp in var.inputs.values():
+        out.append( inp )
+        owners[ inp.name ] = var
+    else:
+      out.append( var )
+  return out, owners
+
+def localNames( variables, names ):
+  """
+  Names of all local variables written for variables
+
+  Arguments:
+    variables (list) : MERRA2Variable and DerivedVariable instances
+    names (list) : Local names of variables; see planner.outputNames()
+
+  Returns:
+    list : Local variable names
+
+  """
+
+  out = []
+  for var, name in zip( variables, names ):
+    out.extend( var.outputs if isinstance(var, DerivedVariable) else [name] )
+  return out
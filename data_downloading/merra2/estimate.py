@@ -0,0 +1,243 @@
+"""
+Estimate the cost of a MERRA-2 download before running it
+
+Shapes and data types of remote variables are taken from the metadata
+cache (see collectionPlanner.describeCollection) and the slices for
+each variable are computed exactly as downloader() does, so the bytes
+transferred, the number of requests, and the bytes written can be
+reported for each granule without downloading any data.
+
+"""
+import logging
+
+import numpy as np
+
+from ..utils.requestPlan import slabSize, sliceLen, planRequests, combinable
+from .derived import expandDerived
+from .collectionPlanner import METAREQUESTS, describeCollection
+from ..utils.pydapData import MAXREQUESTBYTES, splitHyperslab
+
+LATENCY   = 1.0                                                                 # Typical time, in seconds, for server to start responding to a request
+BANDWIDTH = 10.0e6                                                              # Typical transfer rate, in bytes per second, of one connection
+
+class DownloadEstimate():
+  """
+  Estimated cost of a download
+
+  Attributes:
+    esdt (EarthScienceDataType) : Collection to download
+    granules (list) : (date, path, requests, nbytes, stored) tuples for
+      each granule to download
+    workers (int) : Number of granules downloaded concurrently
+    latency (float) : Seconds per request
+    bandwidth (float) : Bytes per second per connection
+
+  """
+
+  def __init__(self, esdt, workers=1, latency=LATENCY, bandwidth=BANDWIDTH):
+    self.esdt      = esdt
+    self.granules  = []
+    self.workers   = max( 1, workers or 1 )
+    self.latency   = latency
+    self.bandwidth = bandwidth
+
+  def __repr__(self):
+    return f'< {self.__class__.__name__} : {self.esdt.shortName} >'
+
+  def __str__(self):
+    return self.report()
+
+  def add(self, date, path, requests, nbytes, stored):
+    self.granules.append( (date, path, requests, nbytes, stored) )
+
+  @property
+  def requests(self):
+    """Total number of remote requests"""
+
+    return sum( item[2] for item in self.granules )
+
+  @property
+  def nbytes(self):
+    """Total bytes transferred"""
+
+    return sum( item[3] for item in self.granules )
+
+  @property
+  def stored(self):
+    """Total bytes written to local files, before compression"""
+
+    return sum( item[4] for item in self.granules )
+
+  def granuleTime(self, requests, nbytes):
+    """Projected time, in seconds, to download one granule"""
+
+    return requests * self.latency + nbytes / self.bandwidth
+
+  @property
+  def wallTime(self):
+    """Projected wall time, in seconds, with workers granules in flight"""
+
+    total = sum( self.granuleTime( item[2], item[3] ) for item in self.granules )
+    return total / self.workers
+
+  def report(self, granules=False):
+    """
+    Summary of the estimate
+
+    Keyword arguments:
+      granules (bool) : If set, include one line per granule
+
+    Returns:
+      str
+
+    """
+
+    lines = []
+    if granules:
+      for date, path, requests, nbytes, stored in self.granules:
+        lines.append( '  {:%Y-%m-%d} : {:4d} requests, {:10.1f} MB transferred, {:10.1f} MB stored'.format(
+          date, requests, nbytes / 1.0e6, stored / 1.0e6 ) )
+    lines.append( '{} : {} granules, {} requests, {:.1f} MB transferred, {:.1f} MB stored'.format(
+      self.esdt.shortName, len(self.granules), self.requests, self.nbytes / 1.0e6, self.stored / 1.0e6 ) )
+    lines.append( 'Projected wall time with {} workers : {:.1f} h ({:.1f} s/request, {:.1f} MB/s per connection)'.format(
+      self.workers, self.wallTime / 3600.0, self.latency, self.bandwidth / 1.0e6 ) )
+    return '\n'.join( lines )
+
+def interpSize( n, res, span ):
+  """Number of points along lon (span=360) or lat (span=180) of output grid"""
+
+  if res is None:
+    return n
+  return np.arange( span / res ).size + (1 if span == 180 else 0)               # As in InterpLonLat.setLonRes/setLatRes
+
+def estimateGranule( esdt, variables, dds, coords, dLon=None, dLat=None, combine=True,
+        maxMemory=None, coarse=False, block=None, dLev=None, dTime=None, reduce=None,
+        maxRequestBytes=MAXREQUESTBYTES, **kwargs ):
+  """
+  Estimate cost of downloading one granule
+
+  Arguments:
+    esdt (EarthScienceDataType) : Collection to download
+    variables (list) : MERRA2Variable and DerivedVariable instances
+    dds (dict) : Description of remote variables; see
+      MetadataCache.getDDS()
+    coords (dict) : Longitude, latitude, and level values keyed by name
+
+  Keyword arguments:
+    See downloader(); others are ignored. Time values are not cached,
+    so they are assumed evenly spaced over one day, in minutes.
+
+  Returns:
+    tuple : Number of requests, bytes transferred, and bytes stored
+
+  """
+
+  from .merra2downloader import coarseResolution, tileSlices, TILECOPIES
+
+  fetched, owners = expandDerived( variables )
+  nTime  = dds[ esdt.timeVar ][1][0]
+  crd    = {'lonData'  : coords[esdt.lonVar],
+            'latData'  : coords[esdt.latVar],
+            'timeData' : np.arange( nTime ) * (1440.0 / nTime)}
+  if not esdt.is2D:
+    crd['levData'] = coords[esdt.levVar]
+  resolution = coarseResolution( coarse, dLon, dLat, dLev, dTime, block )
+  strides    = fetched[0].getStrides( **crd, **resolution ) if resolution else {}
+  if reduce:
+    maxMemory = None                                                            # Reductions need all times; see downloader()
+
+  requests   = METAREQUESTS
+  nbytes     = 0
+  stored     = 0
+  selections = []
+  written    = set()                                                            # Derived variables already counted
+  for var in fetched:
+    dims, shape, dtype = dds[ var.varname ]
+    itemsize = np.dtype( dtype ).itemsize
+    if esdt.is2D:
+      pieces = var.get2DPieces( **crd, **strides )
+      slices = var.get2DSlices( **crd, **strides )
+    else:
+      pieces = var.get3DPieces( **crd, **strides )
+      slices = var.get3DSlices( **crd, **strides )
+    if pieces is not None:                                                      # Stitched selections are requested one piece at a time
+      requests += sum( len( splitHyperslab( remote, itemsize, maxRequestBytes ) ) for remote, _ in pieces[0] )
+      nbytes   += sum( slabSize( remote ) for remote, _ in pieces[0] ) * itemsize
+      count     = [idx.size for idx in pieces[1]]
+    elif maxMemory is not None and var.name not in owners:                      # Tiles are requested one at a time
+      plane     = max( sliceLen(slices[-2]) * sliceLen(slices[-1]),
+                       interpSize( sliceLen(slices[-2]), dLat, 180 ) * interpSize( sliceLen(slices[-1]), dLon, 360 ) )
+      requests += sum( len( splitHyperslab( remote, itemsize, maxRequestBytes ) )
+                       for remote, _ in tileSlices( slices, plane * 8 * TILECOPIES, maxMemory ) )
+      nbytes   += slabSize( slices ) * itemsize
+      count     = [sliceLen(s) for s in slices]
+    else:
+      selections.append( (var.varname, slices, itemsize) )
+      count     = [sliceLen(s) for s in slices]
+
+    count[-2] = interpSize( count[-2], dLat, 180 )
+    count[-1] = interpSize( count[-1], dLon, 360 )
+    outputs   = 1
+    if var.name in owners:                                                      # Level dimension is integrated out
+      derived = owners[ var.name ]
+      if derived.name in written: continue
+      written.add( derived.name )
+      count   = [n for d, n in zip( dims, count ) if d != esdt.levVar]
+      outputs = len( derived.outputs )
+    if reduce:                                                                  # One time per granule for each reduction
+      count   = [1 if d == esdt.timeVar else n for d, n in zip( dims, count )]
+      outputs = outputs * len( reduce )
+    stored += int( np.prod( count ) ) * itemsize * outputs
+
+  if selections:
+    fetches   = planRequests( [item[:2] for item in selections] )
+    sizes     = {varName : itemsize for varName, _, itemsize in selections}
+    nbytes   += sum( slabSize( cover ) * sizes[varName] for varName, cover, _ in fetches )
+    combined  = combinable( fetches ) if combine else []
+    requests += 1 if combined else 0
+    for i, (varName, cover, _) in enumerate( fetches ):                        # Others are requested one at a time, split if too large
+      if i not in combined:
+        requests += len( splitHyperslab( cover, sizes[varName], maxRequestBytes ) )
+  return requests, nbytes, stored
+
+def estimateDownload( esdt, variables, granules, workers=None, latency=LATENCY,
+        bandwidth=BANDWIDTH, **kwargs ):
+  """
+  Estimate cost of downloading granules
+
+  The description of the collection is taken from the metadata cache;
+  if it is not there, the DDS of the first granule is downloaded.
+  Granules whose local file exists are skipped, as when downloading.
+
+  Arguments:
+    esdt (EarthScienceDataType) : Collection to download
+    variables (list) : MERRA2Variable and DerivedVariable instances
+    granules (list) : (date, localPath) tuples to download
+
+  Keyword arguments:
+    workers (int) : Number of granules downloaded concurrently
+    latency (float) : Seconds per request
+    bandwidth (float) : Bytes per second per connection
+    **kwargs : Download options; see estimateGranule()
+
+  Returns:
+    DownloadEstimate
+
+  """
+
+  import os
+
+  log      = logging.getLogger(__name__)
+  estimate = DownloadEstimate( esdt, workers, latency, bandwidth )
+  todo     = [(date, path) for date, path in granules if not os.path.isfile( path )]
+  if len(todo) == 0:
+    return estimate
+
+  dds, coords = describeCollection( esdt, todo[0][0], remote = True )
+  if dds is None:
+    raise Exception( f'Failed to get description of collection : {esdt.shortName}' )
+  requests, nbytes, stored = estimateGranule( esdt, variables, dds, coords, **kwargs )
+  for date, path in todo:                                                       # Shapes are the same for all granules of a collection
+    estimate.add( date, path, requests, nbytes, stored )
+    log.debug( 'Estimate for {:%Y-%m-%d} : {} requests, {} bytes'.format( date, requests, nbytes ) )
+  return estimate
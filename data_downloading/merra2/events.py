@@ -0,0 +1,194 @@
+"""
+Hooks run as granules of a download land
+
+merra2downloader.download() only calls its callback once every granule
+is done. A DownloadEvents instance passed as its events keyword instead
+calls a per-granule hook as soon as each granule is written, and a
+per-period hook as soon as all granules of a period (e.g., a month) are
+written, so post-processing such as fileCombine can overlap downloading
+of the following periods. Hooks can run in a pool of worker processes
+(or threads) so they do not hold up the downloads.
+
+Example:
+  >>> def combine( start, files ):
+  ...   fileCombine( monthlyName( start ), files )
+  >>> events = DownloadEvents( onPeriod = combine, period = 'month', workers = 2 )
+  >>> download( esdt, variables, start, end, outdir, events = events )
+
+"""
+import logging
+
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+PERIODS = ('day', 'month', 'year')
+
+def periodStart( date, period ):
+  """Start of the period containing date"""
+
+  if period == 'day':
+    return datetime( date.year, date.month, date.day )
+  if period == 'month':
+    return datetime( date.year, date.month, 1 )
+  if period == 'year':
+    return datetime( date.year, 1, 1 )
+  raise ValueError( f'Unsupported period : {period}; must be one of {PERIODS}' )
+
+class DownloadEvents():
+  """
+  Per-granule and per-period hooks for a download
+
+  Hooks are called in the order granules finish, which is not always
+  date order when granules are downloaded concurrently. Errors raised by
+  hooks are logged and raised again by wait(), which download() calls
+  before returning; if the download itself failed, its error is raised
+  instead.
+
+  """
+
+  def __init__(self, onGranule = None, onPeriod = None, period = 'month', workers = None, processes = True):
+    """
+    Keyword arguments:
+      onGranule (func) : Called as onGranule( date, path ) when a
+        granule has been written; path is the local file, or the store
+        when writing to a chunked array store
+      onPeriod (func) : Called as onPeriod( start, files ) when all
+        granules of a period have been written; start is the first date
+        of the period and files are all local files of the period, in
+        date order. With a reduction period (see download()), files is
+        the list with the combined file
+      period (str) : Period to group granules by; 'day', 'month', or
+        'year'
+      workers (int) : Number of workers to run hooks in. If None, hooks
+        run in the downloading process, between granules
+      processes (bool) : If set (default), workers are processes, so
+        hooks must be picklable (e.g., module-level functions);
+        otherwise threads
+
+    """
+
+    if period not in PERIODS:
+      raise ValueError( f'Unsupported period : {period}; must be one of {PERIODS}' )
+    self.log       = logging.getLogger(__name__)
+    self.onGranule = onGranule
+    self.onPeriod  = onPeriod
+    self.period    = period
+    self.workers   = workers
+    self.processes = processes
+    self._files    = {}                                                         # All files of each period, keyed by period start
+    self._pending  = {}                                                         # Granules still to land in each period
+    self._futures  = []
+    self._pool     = None
+
+  def __repr__(self):
+    return f'< {self.__class__.__name__} : {self.period} >'
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, *args):
+    self.wait( raiseErrors = excType is None )                                  # Do not replace error raised in the with block
+
+  def expect(self, granules, todo):
+    """
+    Set granules of the download
+
+    Arguments:
+      granules (list) : (date, path) tuples for all granules requested,
+        in date order
+      todo (list) : (date, path) tuples for granules to be downloaded;
+        periods with none of these have nothing new, so their hook is
+        not called
+
+    """
+
+    self._files   = {}
+    self._pending = {}
+    for date, path in granules:
+      self._files.setdefault( periodStart( date, self.period ), [] ).append( path )
+    for date, path in todo:
+      self._pending.setdefault( periodStart( date, self.period ), set() ).add( date )
+
+  def granuleDone(self, date, path):
+    """
+    Record that a granule has been written and run its hook
+
+    Arguments:
+      date (datetime) : Date of granule
+      path (str) : Local file, or store, the granule was written to
+
+    Returns:
+      list : (start, files) tuples of periods completed by this granule
+
+    """
+
+    self._dispatch( self.onGranule, date, path )
+    start   = periodStart( date, self.period )
+    pending = self._pending.get( start, None )
+    if pending is None or date not in pending:
+      return []
+    pending.discard( date )
+    if pending:
+      return []
+    del self._pending[start]
+    self.log.info( 'All granules written for {} starting : {:%Y-%m-%d}'.format( self.period, start ) )
+    return [(start, self._files[start])]
+
+  def remaining(self):
+    """
+    Periods not completed through granuleDone()
+
+    Used at the end of a download for periods whose last granules were
+    written by another process. The periods are cleared.
+
+    Returns:
+      list : (start, files) tuples, in date order
+
+    """
+
+    out = [(start, self._files[start]) for start in sorted( self._pending )]
+    self._pending = {}
+    return out
+
+  def periodDone(self, start, files):
+    """Run hook for completed period"""
+
+    self._dispatch( self.onPeriod, start, files )
+
+  def _dispatch(self, hook, *args):
+    if hook is None:
+      return
+    if not self.workers:
+      hook( *args )
+      return
+    if self._pool is None:
+      Executor   = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+      self._pool = Executor( max_workers = self.workers )
+    self._futures.append( self._pool.submit( hook, *args ) )
+
+  def wait(self, raiseErrors = True):
+    """
+    Wait for hooks running in workers to finish and shut down workers
+
+    Keyword arguments:
+      raiseErrors (bool) : If set (default), the first error raised by a
+        hook is raised again; otherwise errors are only logged, e.g.,
+        when another error is already being raised
+
+    Raises:
+      Exception : First error raised by a hook
+
+    """
+
+    error = None
+    for future in self._futures:
+      err = future.exception()
+      if err is not None:
+        self.log.error( f'Event hook failed : {err}' )
+        error = error or err
+    self._futures = []
+    if self._pool is not None:
+      self._pool.shutdown( wait = True )
+      self._pool = None
+    if error is not None and raiseErrors:
+      raise error
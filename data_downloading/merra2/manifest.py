@@ -0,0 +1,249 @@
+import logging
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+  url        TEXT,
+  collection TEXT,
+  date       TEXT,
+  path       TEXT,
+  signature  TEXT,
+  variables  TEXT,
+  slices     TEXT,
+  dlon       REAL,
+  dlat       REAL,
+  size       INTEGER,
+  checksum   TEXT,
+  status     TEXT,
+  updated    REAL,
+  PRIMARY KEY (url, path)
+);
+CREATE INDEX IF NOT EXISTS granules_date ON granules (collection, date);
+"""
+
+COMPLETE = 'complete'
+FAILED   = 'failed'
+
+def toJSON( obj ):
+  """
+  Convert object to JSON serializable type
+
+  Used as the default function for json.dumps so that slices and numpy
+  types in variable selections can be stored.
+
+  """
+
+  if isinstance(obj, slice):
+    return [obj.start, obj.stop, obj.step]
+  elif isinstance(obj, np.ndarray):
+    return obj.tolist()
+  elif isinstance(obj, np.generic):
+    return obj.item()
+  return repr(obj)
+
+def requestSignature( variables, dLon = None, dLat = None, options = None ):
+  """
+  Compute signature of a download request
+
+  Two requests with the same signature produce the same local file, so
+  a granule only needs to be downloaded again if its signature changes.
+
+  Arguments:
+    variables (list) : MERRA2Variable instances to download
+
+  Keyword arguments:
+    dLon (float) : Longitude resolution of output
+    dLat (float) : Latitude resolution of output
+    options (dict) : Other settings that change the local file; e.g.,
+      coarse fetch resolution
+
+  Returns:
+    str : Hex digest of the request
+
+  """
+
+  spec = [[var.spec() for var in variables], dLon, dLat]
+  if options:                                                                   # Only add when set so existing signatures do not change
+    spec.append( options )
+  spec = json.dumps( spec, default = toJSON, sort_keys = True )
+  return hashlib.sha1( spec.encode() ).hexdigest()
+
+def fileChecksum( path, blockSize = 2**20 ):
+  """Compute MD5 checksum of file"""
+
+  md5 = hashlib.md5()
+  with open(path, 'rb') as fid:
+    for block in iter( lambda: fid.read(blockSize), b'' ):
+      md5.update( block )
+  return md5.hexdigest()
+
+class DownloadManifest():
+  """
+  SQLite record of downloaded granules
+
+  Each granule is stored with its URL, local path, requested variables
+  and subset, output resolution, size, and checksum. This allows the
+  set of granules still to download over a date range to be found in
+  a single query, without checking for files on disk, and detects when
+  a changed request means a granule must be downloaded again.
+
+  Granules are keyed by URL and local path, so downloads of the same
+  granules to different files (e.g., other variables or output
+  directories) can share a manifest without replacing each other.
+
+  The database may be shared by many worker processes.
+
+  """
+
+  def __init__(self, path, timeout = 60.0):
+    """
+    Arguments:
+      path (str) : Path to SQLite database file; created if not exist
+
+    Keyword arguments:
+      timeout (float) : Seconds to wait for database lock held by
+        another process
+
+    """
+
+    self.log  = logging.getLogger(__name__)
+    self.path = path
+    os.makedirs( os.path.dirname( os.path.abspath(path) ), exist_ok = True )
+    self._conn = sqlite3.connect( path, timeout = timeout )
+    self._conn.executescript( SCHEMA )
+    self._conn.commit()
+    self._migrate()
+
+  def __enter__(self):
+    return self
+
+  def _migrate(self):
+    """Key rows of manifests created before paths were part of the key by URL and path"""
+
+    def urlKeyed():
+      return [row[1] for row in self._conn.execute( 'PRAGMA table_info(granules)' ) if row[5]] == ['url']
+
+    if not urlKeyed():
+      return
+    self._conn.execute( 'BEGIN IMMEDIATE' )                                     # Another process may be migrating too
+    try:
+      if urlKeyed():
+        self.log.info( f'Updating manifest to key granules by URL and path : {self.path}' )
+        self._conn.execute( 'ALTER TABLE granules RENAME TO granules_old' )
+        self._conn.execute( 'DROP INDEX IF EXISTS granules_date' )
+        for sql in SCHEMA.split( ';' ):
+          if sql.strip(): self._conn.execute( sql )
+        self._conn.execute( 'INSERT INTO granules SELECT * FROM granules_old' )
+        self._conn.execute( 'DROP TABLE granules_old' )
+    except Exception:
+      self._conn.rollback()
+      raise
+    self._conn.commit()
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    """Close connection to database"""
+
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def record(self, esdt, date, url, path, variables, slices = None,
+        dLon = None, dLat = None, options = None, status = COMPLETE, checksum = True):
+    """
+    Record a granule in the manifest
+
+    Arguments:
+      esdt (EarthScienceDataType) : ESDT of granule
+      date (datetime) : Date of granule
+      url (str) : Remote URL of granule
+      path (str) : Local file path of granule, or chunked array store
+        written to; stored as an absolute path
+      variables (list) : MERRA2Variable instances downloaded
+
+    Keyword arguments:
+      slices (dict) : Slices used for each variable, keyed by name
+      dLon (float) : Longitude resolution of output
+      dLat (float) : Latitude resolution of output
+      options (dict) : Other request settings; see requestSignature()
+      status (str) : Status of granule; COMPLETE or FAILED
+      checksum (bool) : If set, compute checksum of local file
+
+    Returns:
+      None.
+
+    """
+
+    path = os.path.abspath( path )
+    size = csum = None
+    if status == COMPLETE and os.path.isfile( path ):
+      size = os.path.getsize( path )
+      if checksum: csum = fileChecksum( path )
+
+    row = ( url, esdt.shortName, date.isoformat(), path,
+            requestSignature( variables, dLon, dLat, options ),
+            json.dumps( [var.spec() for var in variables], default = toJSON ),
+            json.dumps( slices, default = toJSON ),
+            dLon, dLat, size, csum, status, time.time() )
+    with self._conn:
+      self._conn.execute(
+        'INSERT OR REPLACE INTO granules VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', row )
+
+  def completed(self, esdt, startDate, endDate, signature):
+    """
+    Get granules already completed with given request signature
+
+    Arguments:
+      esdt (EarthScienceDataType) : ESDT of granules
+      startDate (datetime) : First date to check; inclusive
+      endDate (datetime) : Last date to check; inclusive
+      signature (str) : Request signature from requestSignature()
+
+    Returns:
+      tuple : Set of (url, path) tuples that are complete with matching
+        signature and set of (url, path) tuples that are complete, but
+        with a different signature; paths are absolute
+
+    """
+
+    rows = self._conn.execute(
+      'SELECT url, path, signature FROM granules WHERE collection = ? AND '
+      'date >= ? AND date <= ? AND status = ?',
+      (esdt.shortName, startDate.isoformat(), endDate.isoformat(), COMPLETE) )
+    done  = set()
+    stale = set()
+    for url, path, sig in rows:
+      if sig == signature:
+        done.add( (url, path) )
+      else:
+        stale.add( (url, path) )
+    return done, stale
+
+  def status(self, esdt = None):
+    """
+    Summarize manifest contents
+
+    Keyword arguments:
+      esdt (EarthScienceDataType) : If set, only summarize this ESDT
+
+    Returns:
+      dict : Number of granules and total bytes, keyed by status
+
+    """
+
+    sql  = 'SELECT status, COUNT(*), SUM(size) FROM granules'
+    args = ()
+    if esdt is not None:
+      sql += ' WHERE collection = ?'
+      args = (esdt.shortName,)
+    sql += ' GROUP BY status'
+    return {status : {'granules' : n, 'bytes' : size or 0}
+              for status, n, size in self._conn.execute( sql, args )}
@@ -21,17 +21,45 @@ PRECTOT
 import logging
 
 import os
+import json
 import time
+import warnings
+
+from datetime import datetime
+from urllib.parse import urlparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import numpy as np
 
-from ../utils import pydapData
+from ..utils import pydapData
+from ..utils.metadataCache import MetadataCache
+from ..utils.bufferPool import BufferPool
+from ..utils.chunkStore import ChunkStore, StoreGranule
+from ..utils.dateutils import next_month
+from ..utils.granuleLock import GranuleLock, LOCKSUFFIX, WAIT, SKIP
+
+from .manifest import DownloadManifest, requestSignature, COMPLETE, FAILED
+from .planner import outputNames
+from ..utils.requestPlan import sliceLen, planRequests, combinable
+from .reductions import reductionOps, reduceVariable, combineReduced
+from .derived import expandDerived, localNames
+from ..utils.interpLonLat import InterpLonLat
 
-from .utils.interpLonLat import InterpLonLat
+PARTIAL    = '.part'                                                            # Suffix for files being downloaded
+STOREJOURNALS = '.journals'                                                     # Directory in chunk store for journals of granules being written
+JOURNAL    = '.journal'                                                         # Suffix for journal of completed variables
+SKIPPED    = 'skipped'                                                        # Returned by downloader() when granule is locked by another worker
+EXISTS     = 'exists'                                                           # Returned by downloader() when granule was already downloaded
+TILECOPIES = 4                                                                  # Approximate number of full-size copies of a tile made while processing
+
+BUFFERS    = BufferPool()                                                       # Work buffers reused across variables and granules by prepareValues
 
 
 def download( esdt, variables, startDate, endDate, outdir, 
-        endpoint=False, prefix='', postfix='', callback=None, **kwargs ):
+        endpoint=False, prefix='', postfix='', callback=None,
+        workers=None, per_host=None, manifest=None, backend='pydap', store=None, 
+        reduce=None, period=None, dry_run=False, busy=SKIP, events=None, **kwargs ):
   """
   Download data to given directory over given timespan
 
@@ -45,7 +73,11 @@ def download( esdt, variables, startDate, endDate, outdir,
   Arguments:
     esdt (EarthScienceDataType) : ESDT object containg information about
       dataset to download.
-    variables (list) : List of MERRA2Variable instances to download.
+    variables (list) : List of MERRA2Variable instances to download. May
+      also include derived.DerivedVariable instances (e.g., LayerMean,
+      VerticalIntegral, MoistureFlux), which are computed from the
+      variables they need as each granule is downloaded; only the
+      derived fields are written.
     startDate (datetime) : First date to download; inclusive
     endDate   (datetime) : Last date to download; inclusivity set by endpoint keyword
     outdir (str) : Top-level directory to store data in; remote directory
@@ -56,41 +88,650 @@ def download( esdt, variables, startDate, endDate, outdir,
     prefix   (str)  : Custom prefix to add to downloaded data files
     postfix  (str)  : Custom postfix to add to downloaded data files
     callback (func) : Function to run after downloading completes.
-      This function will be passed a list of all downloaded file paths
+      This function will be passed a list of all downloaded file paths,
+      in date order
+    workers (int) : Number of processes to download granules with. If
+      None or less than two (2), granules are downloaded serially
+    per_host (int) : Maximum number of granules to request from any
+      one remote host at a time. Default is same as workers
+    manifest (str) : Path to SQLite download manifest. If set, granules
+      recorded as complete for the same request are skipped without
+      checking the local file system, and granules recorded for a
+      different request (e.g., changed variables) are downloaded again.
+    backend (str) : Client to download with; 'pydap' (default) or
+      'async'. The 'async' backend uses utils.asyncDAP to keep workers
+      granules in flight from a single process instead of a pool of
+      processes; requires aiohttp. The 'https' backend reads the
+      chunks of the HDF5 granules directly with HTTP Range requests
+      instead of going through OPeNDAP; requires h5py. See
+      utils.httpsGranule.
+    store (str) : Path to chunked array store (Zarr layout). If set,
+      all granules are written into this single store, indexed by
+      time, instead of one netCDF file per granule; the store can be
+      appended to by later calls and read lazily, so no combine step
+      is needed. The callback is passed a list with the store path.
+    reduce (str,list) : Temporal reduction(s) to compute over the times
+      in each granule as it is downloaded; any of 'mean', 'sum', 'min',
+      'max', and 'count'. Only the reduced fields, named
+      <name>_<reduction>, are written, along with the count of valid
+      values (<name>_count), with a time dimension of length one (1).
+    period (str) : If 'month', the reduced granules are combined into
+      one file per month, named as the granule files but with the day
+      removed from the date, once all granules for the month are done.
+      The callback is passed the monthly files. Requires reduce.
+    dry_run (bool) : If set, nothing is downloaded; the bytes to
+      transfer and store, the number of requests, and the projected wall
+      time for the granules still to do are logged and returned as an
+      estimate.DownloadEstimate. Shapes are taken from the metadata
+      cache, so at most one granule description is downloaded.
+    busy (str) : What to do with a granule that another process, on
+      this or another host sharing outdir, is downloading. If 'skip'
+      (default), other granules are downloaded first and the busy
+      granule is waited for at the end; if 'wait', wait for it right
+      away. If None, granules are not locked.
+    events (DownloadEvents) : Hooks to run as soon as each granule, and
+      each period (e.g., month) of granules, is written, instead of
+      waiting for the whole download; see events.DownloadEvents. With
+      a reduction period, the period of events must be the same and
+      the period hook is passed the combined file.
     **kwargs : Any extra arguments are passed directly to netCDF4.Dataset
 
   Returns:
-    bool : True if downloads finished successfully, False otherwise
+    bool : True once all granules are downloaded; an exception is raised
+      if any granule fails. DownloadEstimate if dry_run is set
 
   """
 
-  log = logging.getLogger(__name__)
-  files = []
+  log      = logging.getLogger(__name__)
+  t0       = time.time()
+  granules = []
   for date in esdt.getDates( startDate, endDate, endpoint=endpoint ):
+    granules.append( (date, localPath(esdt, date, outdir, prefix, postfix)) )
+  files    = [path for _, path in granules]                                     # All files, in date order, for the callback
+  requested = list( granules )                                                  # All granules, for period events
+
+  if reduce is not None:
+    kwargs['reduce'] = reduce = reductionOps( reduce )
+  if period is not None:
+    if period != 'month':
+      raise ValueError( f'Unsupported reduction period : {period}' )
+    if reduce is None or store is not None:
+      raise ValueError( 'Monthly output requires reduce and cannot be used with store' )
+    months   = monthlyGroups( esdt, granules, outdir, prefix, postfix )
+    files    = list( months.keys() )
+    granules = [granule for outfile, group in months.items() 
+                  if not os.path.isfile( outfile ) for granule in group]        # Granules of months already combined are not needed
+
+  if store is not None and len(granules) > 0:                                   # Skip granules already in store
+    granules = openStore( store, granules[0][0], granules )
+    files    = [store]
+    kwargs['store'] = store
+
+  if manifest is not None and len(granules) > 0:                                # If using manifest, remove completed granules from the to-do list
+    granules = planFromManifest( manifest, esdt, variables, granules, **kwargs )
+    kwargs['manifest'] = manifest
+
+  if dry_run:
+    from .estimate import estimateDownload
+    estimate = estimateDownload( esdt, variables, granules,
+                                 workers = (workers or 8) if backend == 'async' else workers, **kwargs )
+    log.info( estimate.report() )
+    return estimate
+
+  if busy not in (WAIT, SKIP, None):
+    raise ValueError( f'Unsupported busy action : {busy}' )
+  if events is not None and period is not None and events.period != period:
+    raise ValueError( f'Period of events ({events.period}) must match reduction period ({period})' )
+  names = localNames( variables, outputNames( variables ) ) if period is not None else None
+
+  def periodDone( start, group ):                                               # Run hook for period whose granules are all written
+    if store is not None:
+      group = [store]
+    elif period is not None:                                                    # Combine month now, rather than after all downloads
+      outfile = monthlyPath( esdt, start, outdir, prefix, postfix )
+      if not os.path.isfile( outfile ):
+        combineReduced( [path for _, path in months[outfile]], outfile, names, reduce, esdt.timeVar )
+      group = [outfile]
+    events.periodDone( start, group )
+
+  def landed( date, path ):                                                     # Run hooks for granule and any period it completes
+    if events is None: return
+    for start, group in events.granuleDone( date, path if store is None else store ):
+      periodDone( start, group )
+
+  if events is not None:
+    events.expect( requested, granules )
+
+  kwargs['busy'] = busy
+  if backend == 'https':
+    kwargs['backend'] = backend
+  try:
+    if backend == 'async':
+      done = _asyncDownloads( esdt, variables, granules, workers or 8, per_host, onDone=landed, **kwargs )
+    elif workers is None or workers < 2:
+      done = _serialDownloads( esdt, variables, granules, onDone=landed, **kwargs )
+    else:
+      done = _scheduleDownloads( esdt, variables, granules, workers, per_host, onDone=landed, **kwargs )
+
+    logThroughput( done, time.time() - t0 )
+
+    if events is not None:                                                      # Periods finished by other processes
+      for start, group in events.remaining():
+        periodDone( start, group )
+    if period is not None:                                                      # Months not combined as granules landed; e.g., all granules already done
+      for outfile, group in months.items():
+        if os.path.isfile( outfile ): continue
+        combineReduced( [path for _, path in group], outfile, names, reduce, esdt.timeVar )
+  except BaseException:
+    if events is not None: events.wait( raiseErrors=False )                     # Hooks must finish, but their errors must not replace this one
+    raise
+  if events is not None: events.wait()                                          # Hooks running in workers must finish before returning
+
+  if callback: callback( files )
+
+  return True
+
+
+def localPath( esdt, date, outdir, prefix='', postfix='' ):
+  """
+  Build local file path for remote granule
+
+  The remote directory structure is preserved under outdir. The
+  directory is not created; that is done by downloader() when the
+  granule is actually downloaded.
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    date (datetime) : Date of the granule
+    outdir (str) : Top-level directory to store data in
+
+  Keyword arguments:
+    prefix   (str)  : Custom prefix to add to file name
+    postfix  (str)  : Custom postfix to add to file name
+
+  Returns:
+    str : Full path to local file
+
+  """
+
+  remoteDir  = esdt.getDirName(date)                                            # Get path to data file on remote server
+  remoteFile = esdt.getFileName(date)                                           # Get remote file name
+
+  localDir   = os.path.join( outdir, *remoteDir.split('/') )                    # Build path to local file; split the URL path so that os can join properly for whatever system code is run on
+  fname, ext = os.path.splitext( remoteFile )
+  localFile  = prefix + fname + postfix + ext
+  return os.path.join( localDir, localFile )
+
+
+def monthlyPath( esdt, date, outdir, prefix='', postfix='' ):
+  """
+  Build local file path for monthly file
+
+  The path is that of the first granule of the month with the day
+  removed from the date in the file name.
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    date (datetime) : Any date in the month
+    outdir (str) : Top-level directory to store data in
+
+  Keyword arguments:
+    prefix   (str)  : Custom prefix to add to file name
+    postfix  (str)  : Custom postfix to add to file name
+
+  Returns:
+    str : Full path to local file
+
+  """
+
+  date  = datetime( date.year, date.month, 1 )
+  path  = localPath( esdt, date, outdir, prefix, postfix )
+  fname = os.path.basename( path ).replace( date.strftime('%Y%m%d'), date.strftime('%Y%m') )
+  return os.path.join( os.path.dirname(path), fname )
+
+def monthlyGroups( esdt, granules, outdir, prefix='', postfix='' ):
+  """
+  Group granules by month
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    granules (list) : List of (date, localPath) tuples, in date order
+    outdir (str) : Top-level directory to store data in
+
+  Keyword arguments:
+    prefix   (str)  : Custom prefix to add to file name
+    postfix  (str)  : Custom postfix to add to file name
+
+  Returns:
+    dict : Lists of (date, localPath) tuples keyed by monthly file path
+
+  """
+
+  log    = logging.getLogger(__name__)
+  groups = {}
+  for date, path in granules:
+    outfile = monthlyPath( esdt, date, outdir, prefix, postfix )
+    groups.setdefault( outfile, [] ).append( (date, path) )
+  for outfile, group in groups.items():
+    start = datetime( group[0][0].year, group[0][0].month, 1 )
+    if len(group) < len( list( esdt.getDates( start, next_month(start) ) ) ):
+      log.warning( f'Only {len(group)} granules requested for month : {outfile}' )
+  return groups
+
+def openStore( store, origin, granules ):
+  """
+  Create chunked array store, if needed, and find granules to write
+
+  The time origin of the store is set to the first date of the first
+  request that writes to it; later requests can only append after it.
+
+  Arguments:
+    store (str) : Path to chunked array store
+    origin (datetime) : Date of first granule requested
+    granules (list) : List of (date, localPath) tuples
+
+  Returns:
+    list : (date, localPath) tuples not yet in the store
+
+  """
+
+  log   = logging.getLogger(__name__)
+  cs    = ChunkStore( store )
+  with cs.lock():
+    atts = cs._readJSON( '.zattrs', default = {} )
+    if 'time_origin' not in atts:
+      atts['time_origin'] = origin.isoformat()
+      cs._writeJSON( '.zattrs', atts )
+  if origin < datetime.fromisoformat( atts['time_origin'] ):
+    raise Exception( f'Cannot write granules before start of store : {atts["time_origin"]}' )
+
+  written = atts.get( 'granules', {} )
+  todo    = [(date, path) for date, path in granules if date.isoformat() not in written]
+  log.info( '{} of {} granules to write to store'.format( len(todo), len(granules) ) )
+  return todo
+
+def granuleLock( localfile, store=None ):
+  """
+  Lock for granule being downloaded
+
+  The lock file is next to the local file or, when writing to a chunked
+  array store, with the granule journals in the store.
+
+  Arguments:
+    localfile (str) : Local file path of granule
+
+  Keyword arguments:
+    store (str) : Path to chunked array store, if any
+
+  Returns:
+    GranuleLock
+
+  """
+
+  if store is not None:
+    return GranuleLock( os.path.join( store, STOREJOURNALS, os.path.basename(localfile) + LOCKSUFFIX ) )
+  return GranuleLock( localfile + LOCKSUFFIX )
+
+def openStoreGranule( store, esdt, date, nTime, timeAtts, localfile ):
+  """
+  Open view of granule in chunked array store
+
+  Arguments:
+    store (ChunkStore) : Store to write to
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    date (datetime) : Date of granule
+    nTime (int) : Number of times in granule
+    timeAtts (dict) : Attributes of remote time variable
+    localfile (str) : Local file path of granule; used to name journal
+
+  Returns:
+    tuple : StoreGranule, list of completed variable names, and path
+      to journal
+
+  """
+
+  from netCDF4 import num2date, date2num
+
+  origin = datetime.fromisoformat( store.attrs['time_origin'] )
+  if date < origin:
+    raise Exception( f'Cannot write granule before start of store : {origin}' )
+  offset = len( list( esdt.getDates( origin, date ) ) ) * nTime                  # Index of granule along time; all granules have same number of times
+  units  = '{} since {:%Y-%m-%d %H:%M:%S}'.format(
+              timeAtts.get('units', 'minutes').split()[0], origin )
+
+  def convert( values, granuleUnits ):
+    if granuleUnits is None: return values
+    return date2num( num2date( values, granuleUnits ), units )
+
+  local   = StoreGranule( store, esdt.timeVar, offset, units = units, convert = convert )
+  journal = os.path.join( store.path, STOREJOURNALS, os.path.basename(localfile) + JOURNAL )
+  done    = []
+  if os.path.isfile( journal ):
+    with open(journal, 'r') as fid:
+      done = json.load( fid )['variables']
+  else:
+    os.makedirs( os.path.dirname(journal), exist_ok = True )
+    with open(journal, 'w') as fid:
+      json.dump( {'variables' : []}, fid )
+  return local, done, journal
+
+def markStoreGranule( store, date, offset, count ):
+  """Record granule as complete in store and consolidate metadata"""
+
+  with store.lock():
+    atts = store._readJSON( '.zattrs', default = {} )
+    atts.setdefault( 'granules', {} )[ date.isoformat() ] = [offset, count]
+    store._writeJSON( '.zattrs', atts )
+  store.consolidate()
+
+def planFromManifest( manifest, esdt, variables, granules, dLon=None, dLat=None, **kwargs ):
+  """
+  Determine which granules still need downloading using the manifest
+
+  Granules recorded as complete for the same request are dropped in a
+  single query. Local files for granules recorded with a different
+  request are deleted so that they are downloaded again. Only records
+  for the same local file (or store) as the granule are used, so other
+  downloads sharing the manifest are never taken for this one.
+
+  Arguments:
+    manifest (str) : Path to SQLite download manifest
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    variables (list) : List of MERRA2Variable instances to download.
+    granules (list) : List of (date, localPath) tuples
+
+  Keyword arguments:
+    dLon (float) : Longitude resolution of output
+    dLat (float) : Latitude resolution of output
+    **kwargs : Coarse fetch settings (coarse, block, dLev, dTime) and
+      reductions (reduce) are part of the request; see downloader().
+      If store is set, granules are recorded against the store. Others
+      are ignored
+
+  Returns:
+    list : (date, localPath) tuples still to download
+
+  """
+
+  log       = logging.getLogger(__name__)
+  options   = requestOptions( dLon=dLon, dLat=dLat,
+                **{key : kwargs.get(key, None) for key in ('coarse', 'block', 'dLev', 'dTime', 'reduce')} )
+  signature = requestSignature( variables, dLon, dLat, options )
+  with DownloadManifest( manifest ) as db:
+    done, stale = db.completed( esdt, granules[0][0], granules[-1][0], signature )
+
+  store = kwargs.get( 'store', None )
+  todo  = []
+  for date, path in granules:
+    key = (esdt.getFullURL( date ), os.path.abspath( store or path ))           # Same as recorded by downloader()
+    if key in done: continue
+    if key in stale and os.path.isfile( path ):
+      log.info( 'Request changed, downloading again : {}'.format( path ) )
+      os.remove( path )
+    todo.append( (date, path) )
+  log.info( '{} of {} granules to download'.format( len(todo), len(granules) ) )
+  return todo
+
+
+def _serialDownloads( esdt, variables, granules, onDone=None, **kwargs ):
+  """
+  Download granules one at a time, in date order
+
+  Granules skipped because another process is downloading them are
+  downloaded again at the end, waiting for them.
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    variables (list) : List of MERRA2Variable instances to download.
+    granules (list) : List of (date, localPath) tuples to download
+
+  Keyword arguments:
+    onDone (func) : Called with date and local file path of each
+      granule as it finishes
+    **kwargs : Passed to downloader()
+
+  Returns:
+    list : Local file paths downloaded in this run, in the order they
+      finished; granules that already existed are not included
+
+  """
+
+  log      = logging.getLogger(__name__)
+  done     = []
+  deferred = []                                                                 # Granules locked by other workers; done last
+  for date, path in granules:
+    log.info( 'Getting data for : {}'.format( date ) )
+    status = downloader( esdt, date, variables, path, **kwargs )
+    if not status:
+      raise Exception( "Downloading failed" )
+    if status == SKIPPED:
+      deferred.append( (date, path) )
+      continue
+    if status != EXISTS: done.append( path )
+    if onDone is not None: onDone( date, path )
+  for date, path in deferred:
     log.info( 'Getting data for : {}'.format( date ) )
-    remoteDir  = esdt.getDirName(date)                                             # Get path to data file on remote server
-    remoteFile = esdt.getFileName(date)                                         # Get remote file name
+    status = downloader( esdt, date, variables, path, **dict(kwargs, busy=WAIT) )
+    if not status:
+      raise Exception( "Downloading failed" )
+    if status != EXISTS: done.append( path )                                    # Other process may have finished it while we waited
+    if onDone is not None: onDone( date, path )
+  return done
+
+def _scheduleDownloads( esdt, variables, granules, workers, per_host=None, onDone=None, **kwargs ):
+  """
+  Download granules concurrently using a process pool
+
+  Granules are submitted to a pool of worker processes in date order,
+  with no more than per_host granules in flight for any one remote
+  host at a time. Granules skipped because another process is
+  downloading them are submitted again at the end, to wait for them.
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    variables (list) : List of MERRA2Variable instances to download.
+    granules (list) : List of (date, localPath) tuples to download
+    workers (int) : Number of worker processes
 
-    localDir   = os.path.join( outdir, *remoteDir.split('/') )                   # Build path to local file; split the URL path so that os can join properly for whatever system code is run on
-    os.makedirs( localDir, exist_ok=True )                                      # Create directory if not exist
-    fname, ext = os.path.splitext( remoteFile )
-    localFile  = prefix + fname + postfix + ext
-    localPath  = os.path.join( localDir, localFile )
+  Keyword arguments:
+    per_host (int) : Maximum number of concurrent granules per host
+    onDone (func) : Called with date and local file path of each
+      granule as it finishes
+    **kwargs : Passed to downloader()
+
+  Returns:
+    list : Local file paths downloaded in this run, in date order;
+      granules that already existed are not included
+
+  """
+
+  log      = logging.getLogger(__name__)
+  per_host = per_host or workers
+  pending  = list( enumerate( granules ) )                                      # Granules not yet submitted, with index to keep date order
+  inflight = {}                                                                 # Futures currently running; values are (index, host)
+  nHost    = {}                                                                 # Number of futures running per host
+  files    = [None] * len(granules)
+  waitFor  = set()                                                              # Indices of granules skipped once; wait for lock next time
+
+  with ProcessPoolExecutor( max_workers = workers ) as pool:
+    while pending or inflight:
+      i = 0
+      while i < len(pending) and len(inflight) < workers:                       # Submit as many granules as allowed
+        index, (date, path) = pending[i]
+        host = urlparse( esdt.getFullURL( date ) ).netloc
+        if nHost.get(host, 0) >= per_host:                                      # If host is at its limit, try next granule
+          i += 1
+          continue
+        log.info( 'Getting data for : {}'.format( date ) )
+        future = pool.submit( downloader, esdt, date, variables, path,
+                              **(dict(kwargs, busy=WAIT) if index in waitFor else kwargs) )
+        inflight[future] = (index, host)
+        nHost[host]      = nHost.get(host, 0) + 1
+        pending.pop(i)
+
+      done, _ = wait( inflight, return_when = FIRST_COMPLETED )                 # Wait for at least one granule to finish
+      for future in done:
+        index, host  = inflight.pop( future )
+        nHost[host] -= 1
+        status = future.result()
+        if not status:
+          for future in inflight: future.cancel()
+          raise Exception( "Downloading failed" )
+        if status == SKIPPED:
+          waitFor.add( index )
+          pending.append( (index, granules[index]) )
+          continue
+        if status != EXISTS: files[index] = granules[index][1]
+        if onDone: onDone( *granules[index] )
 
-    if not downloader( esdt, date, variables, localPath, **kwargs ):
+  return [path for path in files if path is not None]
+
+
+def _asyncDownloads( esdt, variables, granules, workers, per_host=None, onDone=None, **kwargs ):
+  """
+  Download granules using the asynchronous DAP client
+
+  Up to workers granules are prefetched concurrently over a shared
+  connection pool. Prefetched granules are then written, in date
+  order, by downloader(). Each granule is locked before it is
+  prefetched, so no data are requested for granules that another
+  process is downloading; see lockedGranules().
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT object for the data set
+    variables (list) : List of MERRA2Variable instances to download.
+    granules (list) : List of (date, localPath) tuples to download
+    workers (int) : Number of granules to have in flight
+
+  Keyword arguments:
+    per_host (int) : Maximum number of concurrent connections per host
+    onDone (func) : Called with date and local file path of each
+      granule as it is written
+    **kwargs : Passed to downloader()
+
+  Returns:
+    list : Local file paths downloaded in this run, in date order;
+      granules that already existed are not included
+
+  """
+
+  from ..utils.asyncDAP import AsyncDAPClient
+
+  resolution = coarseResolution(
+    **{key : kwargs.get(key, None) for key in ('coarse', 'dLon', 'dLat', 'dLev', 'dTime', 'block')} )
+  fetched, _ = expandDerived( variables )                                       # Remote variables needed, including inputs of derived variables
+  busy    = kwargs.pop( 'busy', WAIT )
+  files   = []
+  pending = deque()                                                             # Prefetches in flight, in date order
+  todo    = [(d, p) for d, p in granules if not os.path.isfile(p)]              # No need to prefetch granules that exist
+  if onDone:
+    for date, path in granules:
+      if os.path.isfile( path ): onDone( date, path )
+  with AsyncDAPClient( limit = workers, limit_per_host = per_host or workers ) as client:
+    try:
+      for date, path, lock in lockedGranules( todo, busy, kwargs.get('store', None) ):
+        pending.append( (date, path, lock, client.submit( client.prefetch( esdt, date, fetched, resolution ) )) )
+        if len(pending) < workers: continue
+        files.append( _writePrefetched( esdt, variables, *pending.popleft(), onDone=onDone, **kwargs ) )
+      while pending:
+        files.append( _writePrefetched( esdt, variables, *pending.popleft(), onDone=onDone, **kwargs ) )
+    finally:
+      for _, _, lock, _ in pending:                                             # Release locks of granules not written
+        if lock is not None: lock.release()
+  return [path for path in files if path is not None]
+
+def lockedGranules( granules, busy, store=None ):
+  """
+  Lock granules for download, one at a time
+
+  Arguments:
+    granules (list) : List of (date, localPath) tuples
+    busy (str) : Action for granules locked by other processes; see
+      download()
+
+  Keyword arguments:
+    store (str) : Path to chunked array store, if any
+
+  Returns:
+    generator : (date, localPath, GranuleLock) tuples for granules this
+      process now holds the lock on, in date order except that skipped
+      granules come last; lock is None if busy is None
+
+  """
+
+  log      = logging.getLogger(__name__)
+  deferred = []
+  for date, path in granules:
+    if busy is None:
+      yield date, path, None
+      continue
+    lock = granuleLock( path, store )
+    if lock.acquire( blocking = busy == WAIT ):
+      yield date, path, lock
+    else:
+      log.info( 'Granule being downloaded by another process, skipping for now : {}'.format( date ) )
+      deferred.append( (date, path, lock) )
+  for date, path, lock in deferred:
+    lock.acquire( blocking = True )
+    if store is None and os.path.isfile( path ):                                # Other process finished it while we waited
+      lock.release()
+      continue
+    yield date, path, lock
+
+def _writePrefetched( esdt, variables, date, path, lock, future, onDone=None, **kwargs ):
+  """Wait for prefetched granule and write it; returns path, or None if it already existed"""
+
+  log = logging.getLogger(__name__)
+  log.info( 'Getting data for : {}'.format( date ) )
+  try:
+    try:
+      remote = future.result()
+    except Exception as err:
+      log.error( f'Failed to prefetch granule : {err}' )
       raise Exception( "Downloading failed" )
-    files.append( localPath)
+    status = downloader( esdt, date, variables, path, remote=remote, busy=None, **kwargs )
+    if not status:
+      raise Exception( "Downloading failed" )
+  finally:
+    if lock is not None: lock.release()
+  if onDone: onDone( date, path )
+  return None if status == EXISTS else path
 
-  if callback: callback( files )
+def logThroughput( files, elapsed ):
+  """
+  Log aggregate throughput for a set of downloaded files
 
-  return
+  Arguments:
+    files (list) : Local file paths that were downloaded
+    elapsed (float) : Wall time, in seconds, the downloads took
 
+  Returns:
+    None.
 
-def downloader( esdt, date, variables, localfile, dLon=None, dLat=None, **kwargs ):
+  """
+
+  log    = logging.getLogger(__name__)
+  nbytes = sum( os.path.getsize(f) for f in files if os.path.isfile(f) )
+  rate   = elapsed / 60.0
+  rate   = len(files) / rate if rate > 0 else float('nan')
+  log.info(
+    'Downloaded {} granules ({:.1f} MB) in {:.1f} s : {:.2f} granules/min, {:.2f} MB/s'.format(
+      len(files), nbytes / 1.0e6, elapsed, rate, nbytes / 1.0e6 / max(elapsed, 1.0e-6) )
+  )
+
+
+def downloader( esdt, date, variables, localfile, dLon=None, dLat=None, cache=True, 
+        combine=True, maxMemory=None, manifest=None, remote=None,
+        coarse=False, block=None, dLev=None, dTime=None, store=None, reduce=None,
+        maxRequestBytes=pydapData.MAXREQUESTBYTES, busy=WAIT, backend='pydap', **kwargs ):
   """
   Download data from URL
 
-  This function actually does downloading
+  This function actually does downloading. Data are written to a
+  partial file that is renamed to localfile once all variables are
+  downloaded. Completed variables are recorded in a journal so that,
+  if the download fails or is interrupted, a later call only downloads
+  the variables that are missing.
 
   Arguments:
     URL (str) : URL of remote date file
@@ -100,7 +741,8 @@ def downloader( esdt, date, variables, localfile, dLon=None, dLat=None, **kwargs
       or tuple data. To download all levels in a give range, use a slice()
       object to define the range of levels. For slices, ensure values are
       ascending; i.e., start > stop values. So, to get all data between
-      1000 hPa and 850 hPa, use slice(850, 1000).
+      1000 hPa and 850 hPa, use slice(850, 1000). Derived variables are
+      computed from their inputs before writing; see download().
     localfile (str) : Full path of local file to download data to
 
   Keyword arguments:
@@ -108,11 +750,54 @@ def downloader( esdt, date, variables, localfile, dLon=None, dLat=None, **kwargs
       resolution before writing to file
     dLat (float) : If set, will interpolate data to given latitude
       resolution before writing to file
+    cache (bool,MetadataCache) : If set, coordinates, attributes, and
+      shapes that are the same for all granules in the collection are
+      read from/written to a disk cache instead of downloaded for every
+      granule. Can also be a MetadataCache instance to use.
+    combine (bool) : If set, data for all variables, and their
+      coordinates, are requested from the server in a single request.
+      If that request fails, falls back to one request per variable.
+    maxMemory (int) : If set, data are downloaded and written in tiles
+      along the time (and, if needed, level) dimension(s) so that no
+      more than approximately this many bytes are held in memory for
+      any one variable. Disables the combine option.
+    manifest (str) : Path to SQLite download manifest to record the
+      granule in once download finishes
+    remote (object) : Remote dataset to download from, such as a
+      prefetched utils.asyncDAP.DAPGranule. If None, a PyDAPDataset is
+      opened for the granule URL.
+    coarse (bool) : If set, data are subsampled on the server to about
+      the dLon/dLat (and dLev/dTime) resolution by applying strides in
+      the remote request, rather than downloaded at full resolution and
+      interpolated locally. Data are still interpolated to the exact
+      dLon/dLat grid after download.
+    block (int) : For coarse fetch; if set, strides are reduced by this
+      factor and block x block boxes are averaged locally to reduce
+      aliasing. Requires both dLon and dLat.
+    dLev (float) : For coarse fetch; level spacing, in units of the
+      level coordinate, to subsample to
+    dTime (float) : For coarse fetch; time spacing, in units of the time
+      coordinate, to subsample to
+    store (str) : Path to chunked array store to write granule into
+      instead of localfile; see download()
+    reduce (tuple) : Temporal reductions to compute over the granule
+      instead of writing all times; see download(). Disables the
+      maxMemory option.
+    maxRequestBytes (int) : Requests for one variable larger than this
+      many bytes are split along time or level into pieces that are
+      fetched concurrently; see pydapData.PyDAPDataset.getValues()
+    busy (str) : If 'wait' (default), wait while another process holds
+      the lock on the granule; if 'skip', return SKIPPED instead. The
+      granule is not locked if None.
+    backend (str) : Client to open the remote granule with when remote
+      is None; 'pydap' (default) or 'https'; see download()
 
     **kwargs : Any arguments accepted by netCDF4.Dataset
 
   Returns:
-    bool : True if downloads finished successfully, False otherwise
+    bool : True if downloads finished successfully, False otherwise.
+      SKIPPED if busy is 'skip' and the granule is locked; EXISTS if the
+      granule was already downloaded
 
   """
 
@@ -120,83 +805,945 @@ def downloader( esdt, date, variables, localfile, dLon=None, dLat=None, **kwargs
 
   log = logging.getLogger(__name__)                                             # Get logger
  
+  if busy is not None:                                                          # Hold lock on granule for whole download; existence checked once locked
+    with granuleLock( localfile, store ) as lock:
+      if not lock.acquire( blocking = busy == WAIT ):
+        log.info( 'Granule being downloaded by another process, skipping : {}'.format( localfile ) )
+        return SKIPPED
+      return downloader( esdt, date, variables, localfile, dLon=dLon, dLat=dLat, cache=cache,
+          combine=combine, maxMemory=maxMemory, manifest=manifest, remote=remote,
+          coarse=coarse, block=block, dLev=dLev, dTime=dTime, store=store, reduce=reduce,
+          maxRequestBytes=maxRequestBytes, busy=None, backend=backend, **kwargs )
   
-  URL    = esdt.getFullURL( date )
-  if os.path.isfile( localfile ):
+  URL     = esdt.getFullURL( date )
+  options = requestOptions( coarse, dLon, dLat, dLev, dTime, block, reduce )
+  if store is not None:                                                         # Writing to chunked array store
+    store    = ChunkStore( store )
+    outpath  = store.path
+    exists   = date.isoformat() in store.attrs.get( 'granules', {} )
+  else:
+    outpath  = localfile
+    exists   = os.path.isfile( localfile )
+  if exists:
     log.info('Local file exists, skipping download : {}'.format(localfile) )
-    return True
+    recordGranule( manifest, esdt, date, URL, outpath, variables, dLon=dLon, dLat=dLat, options=options )
+    return EXISTS
+
+  if store is None:
+    os.makedirs( os.path.dirname(localfile), exist_ok=True )                    # Create directory if not exist
 
   log.info('Local file  : {}'.format(localfile))
   log.info('Remote file : {}'.format(URL  ))
-  
-  remote = pydapData.PyDAPDataset( URL, **kwargs )                                        # Open remote file
 
-  if remote is None:
-    raise Exception( f'Failed to open remote file : {URL}' )
+  remote, cache = openRemote( URL, esdt, remote=remote, cache=cache, backend=backend,
+                              maxRequestBytes=maxRequestBytes, **kwargs )
 
-  lon, _  = remote.getVar( esdt.lonVar )                       # Use the downloadVariable function for exception handling
-  lat, _  = remote.getVar( esdt.latVar )
-  if not esdt.is2D: lev, _ = remote.getVar( esdt.levVar )
-  time, _ = remote.getVar( esdt.timeVar )
+  requested         = variables                                                 # Recorded in manifest
+  variables, owners = expandDerived( variables )                                # Inputs of derived variables are downloaded, but not written
+  held              = {}                                                        # Inputs of derived variables waiting for the others
 
-  interp = InterpLonLat( lon, lat )
-  interp.setLonLatRes( dLon, dLat )
- 
-  status = True
-  log.info( 'Initializing new local file...' );
-  local = Dataset(localfile, 'w', **kwargs)
-  for var in variables:                                                         # Iterate over variables
-    log.info('Working on variable: {}'.format(var.varname) )                    # Log
-    if esdt.is2D:                                                               # If 2D data
-      slices = var.get2DSlices(lonData=lon, latData=lat, timeData=time)         # Get slices for 2D data
-    else:                                                                       # Else
-      slices = var.get3DSlices(lonData=lon, latData=lat, levData=lev, timeData=time)    # Slices for 3d
+  fullCoords, timeAtts = granuleCoords( remote, esdt )                          # Full coordinates; also used for stitched selections and dimensions
+  time       = fullCoords[esdt.timeVar]
+  resolution = coarseResolution( coarse, dLon, dLat, dLev, dTime, block )
+  strides    = {}
+  if resolution:                                                                # Strides for coarse fetch; same for all variables
+    strides = variables[0].getStrides( **coordKeywords( esdt, fullCoords ), **resolution )
+  block  = resolution.get('block', None) or 1
+  interp = gridInterpolator( esdt, fullCoords, strides, block, dLon, dLat )     # Output grid is the same whether or not coarse fetch is used
+
+  status   = True
+  keepDims = ()                                                                 # Dimensions never dropped, even if length one (1)
+  if reduce:
+    keepDims = (esdt.timeVar,)                                                  # Reduced granules are combined along time
+    if maxMemory is not None:
+      log.warning( 'Reductions need all times of a variable, ignoring maxMemory' )
+      maxMemory = None
+  if store is not None:
+    nTime    = 1 if reduce else time.size
+    local, done, journal = openStoreGranule( store, esdt, date, nTime, timeAtts, localfile )
+    keepDims = (esdt.timeVar,)                                                  # Granules are appended along time
+  else:
+    tmpfile = localfile + PARTIAL                                               # Data written here and renamed on success
+    journal = localfile + JOURNAL                                               # Names of variables already complete in tmpfile
+    local, done = openPartial( tmpfile, journal, **kwargs )
+
+  names               = outputNames( variables )                                # Local names; unique even if a remote variable is requested twice
+  varSlices, stitched = variableSlices( esdt, variables, names, fullCoords, strides )
+  allSlices           = {name : slices for name, _, slices in varSlices}
+  todo                = []
+  for name, var, slices in varSlices:
+    outName = owners[name].name if name in owners else name                     # Derived variables are recorded in journal by their own name
+    if outName in done:                                                         # If variable already complete from previous run
+      log.info('Variable already downloaded, skipping: {}'.format(name) )
+      continue
+    todo.append( (name, var, slices) )
+
+  dimkwargs = {}                                                                # Keywords to override longitude and latitude data written to file
+  if dLon is not None: dimkwargs[esdt.lonVar] = interp.newLon                   # Only override when interpolating; otherwise the downloaded subset is correct
+  if dLat is not None: dimkwargs[esdt.latVar] = interp.newLat
 
-    values, atts = remote.getVar( var.varname, slices=slices ) # Download the data
+  tiled    = lambda name: maxMemory is not None and name not in stitched and name not in owners
+  requests = PlannedRequests( [(name, var.varname, slices) for name, var, slices in todo
+                                 if name not in stitched and not tiled( name )] )
+  if combine:                                                                   # If combine set, try to get all variables in one request
+    requests.fetchCombined( remote )
+
+  for name, var, slices in todo:                                                # Iterate over variables
+    log.info('Working on variable: {}'.format(name) )                           # Log
+    if tiled( name ):                                                           # If memory limit set, download/write in tiles
+      if not writeTiled( remote, local, var.varname, slices, interp, maxMemory, dimkwargs, 
+                         block=block, outName=name, keepDims=keepDims, fullCoords=fullCoords, **kwargs ):
+        log.error('Failed to download: {}'.format(name))
+        status = False
+        break
+      markComplete( local, journal, done, name )
+      continue
+
+    if name in stitched:                                                        # Download pieces and stitch together
+      values, atts, coords = getStitched( remote, var.varname, *stitched[name],
+                                          fullCoords, lonVar=esdt.lonVar )
+    else:
+      values, atts, coords = requests.get( remote, name )
     if values is None:                                                          # If None
-      log.error('Failed to download: {}'.format(var.varname))                           # Log error
+      log.error('Failed to download: {}'.format(name))                          # Log error
       status = False
       break
 
-    # Process/interpolate data so is correct size for writing
-    # Because we use the shape of this data to define the size of variable
-    # Dimensions, values muse be final shape of data before dimensions are
-    # defined.
     fill = atts.pop('_FillValue', None) 
-    if isinstance(values, np.ma.core.MaskedArray):                              # If data are masked array  
-      fill   = values.fill_value                                                             # Ensure fill is set
-      values = values.filled(np.nan)                                            # Fill with NaN
-    elif fill is not None:                                                      # Else, if fill is valud
-      if 'float' not in values.dtype.name:                                      # Ensure data is float type
-        values = values.astype('float32')
-      values[ values == fill ] = np.nan
-
-    values = interp.interpolate( values )                                       # Interpolate data
-    if fill is not None:                                                        # If fill is set to something
-      values[ np.isnan(values) ] = fill                                         # Replace any nan values with original fill value
-
-    dimkwargs = {esdt.lonVar : interp.newLon, esdt.latVar : interp.newLat}      # Keywords to override longitude and latitude data written to file
-    atts['dimensions'] = addDimensions(remote, local, values.shape, slices, atts, **dimkwargs)
-    values = values.squeeze()                                                   # Squeeze data to remove any dimensions that are only one (1) element wide
-
-    vid  = local.createVariable( var.varname, values.dtype, atts['dimensions'],
-                fill_value = fill, **kwargs )                                   # Create variable in local file
-    for attName, attVal in atts.items():                                        # Iterate over attributes
-      if attName != 'dimensions':                                               # If not the dimensions attribute
-        vid.setncattr( attName, attVal )                                        # Copy the attribute
-    vid[:] = values                                                             # Write the data
+    values, fill = prepareValues( values, fill, interp, block=block )           # Values must be final shape before dimensions are defined
+
+    if name in owners:                                                          # Input of derived variable
+      if BUFFERS.owns( values ):                                                # Work buffers are reused for the next variable, so hold a copy
+        values = np.array( values, copy=True )
+      held[name] = (values, fill, atts)
+      del values
+      derived    = owners[name]
+      if any( var.name not in held for var in derived.inputs.values() ):        # Wait for other inputs
+        continue
+      outputs, slices = evaluateDerived( derived, held, atts, coords, slices, fullCoords, esdt.levVar )
+      name            = derived.name
+    else:
+      outputs = [(name, values, fill, atts)]
+      del values
+
+    outkwargs = dimkwargs
+    if reduce:                                                                  # Only reductions over time are written
+      outputs, outkwargs = reduceOutputs( outputs, reduce, slices, time, esdt.timeVar, dimkwargs )
+
+    writeOutputs( remote, local, outputs, slices, coords=coords, fullCoords=fullCoords,
+                  keepDims=keepDims, dimkwargs=outkwargs, **kwargs )
+    del outputs
+    markComplete( local, journal, done, name )
 
   local.close()                                                                 # Close local file
   remote.close()
+  if cache is not None:
+    cache.save()
 
   if status is False:
-    log.error('Download failed, deleting : {}'.format( localfile ) )
-    os.remove( localfile )
+    log.error('Download failed, keeping partial data for resume : {}'.format( journal ) )
+  else:
+    if store is not None:
+      markStoreGranule( store, date, local.offset, nTime )                      # Granule now visible to readers of the store
+    else:
+      os.replace( tmpfile, localfile )                                          # Move complete file into place
+    if os.path.isfile( journal ):
+      os.remove( journal )
+
+  recordGranule( manifest, esdt, date, URL, outpath, requested, slices=allSlices, 
+      dLon=dLon, dLat=dLat, options=options, status = COMPLETE if status else FAILED )
+
+  return status
+
+def recordGranule( manifest, esdt, date, URL, outpath, variables, **kwargs ):
+  """
+  Record granule in download manifest, if any
+
+  Arguments:
+    manifest (str) : Path to SQLite download manifest; nothing is done
+      if None
+    See DownloadManifest.record() for the others
+
+  Keyword arguments:
+    **kwargs : Passed to DownloadManifest.record()
+
+  Returns:
+    None.
+
+  """
+
+  if manifest is None:
+    return
+  with DownloadManifest( manifest ) as db:
+    db.record( esdt, date, URL, outpath, variables, **kwargs )
+
+def openRemote( URL, esdt, remote=None, cache=True, backend='pydap',
+        maxRequestBytes=pydapData.MAXREQUESTBYTES, **kwargs ):
+  """
+  Open remote granule, and the metadata cache of its collection
+
+  Arguments:
+    URL (str) : URL of remote granule
+    esdt (EarthScienceDataType) : ESDT of granule
+
+  Keyword arguments:
+    remote (object) : Remote dataset already opened (e.g., prefetched);
+      returned as is, without a metadata cache
+    cache (bool,MetadataCache) : Metadata cache to use; see downloader()
+    backend (str) : 'pydap' or 'https'; see downloader()
+    maxRequestBytes (int) : See downloader()
+    **kwargs : Passed to pydapData.PyDAPDataset
+
+  Returns:
+    tuple : Remote dataset and MetadataCache, or None if not used
+
+  """
+
+  if remote is not None:                                                        # Remote given, so metadata cache not needed
+    return remote, None
+  if cache is True:                                                             # If cache flag set, initialize cache for collection
+    cache = MetadataCache( esdt.shortName, exclude = (esdt.timeVar,) )          # Time units change from granule to granule, so never cache time
+  elif cache is False:
+    cache = None
+
+  if backend == 'https':                                                        # Read HDF5 chunks directly
+    from ..utils.httpsGranule import HTTPSGranule
+    remote = HTTPSGranule( URL, cache=cache )
+  else:
+    remote = pydapData.PyDAPDataset( URL, cache=cache, maxRequestBytes=maxRequestBytes, **kwargs ) # Open remote file
+
+  if remote is None:
+    raise Exception( f'Failed to open remote file : {URL}' )
+  return remote, cache
+
+def granuleCoords( remote, esdt ):
+  """
+  Download full coordinates of granule
+
+  Arguments:
+    remote (PyDAPDataset) : Remote data object
+    esdt (EarthScienceDataType) : ESDT of granule
+
+  Returns:
+    tuple : Coordinate values keyed by dimension name, and attributes
+      of time, whose units change from granule to granule
+
+  """
+
+  coords = {}
+  names  = (esdt.lonVar, esdt.latVar) if esdt.is2D else (esdt.lonVar, esdt.latVar, esdt.levVar)
+  for name in names:
+    coords[name], _ = remote.getVar( name )
+  coords[esdt.timeVar], timeAtts = remote.getVar( esdt.timeVar )
+  return coords, timeAtts
+
+def coordKeywords( esdt, coords ):
+  """Coordinate keywords for MERRA2Variable slice and stride methods"""
+
+  kwargs = {'lonData'  : coords[esdt.lonVar],
+            'latData'  : coords[esdt.latVar],
+            'timeData' : coords[esdt.timeVar]}
+  if not esdt.is2D:
+    kwargs['levData'] = coords[esdt.levVar]
+  return kwargs
+
+def gridInterpolator( esdt, coords, strides, block, dLon=None, dLat=None ):
+  """
+  Interpolator from the downloaded grid to the output grid
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT of granule
+    coords (dict) : Full coordinates of granule; see granuleCoords()
+    strides (dict) : Strides of coarse fetch; empty if not used
+    block (int) : Size of lat/lon boxes averaged; see blockMean()
+
+  Keyword arguments:
+    dLon (float) : Longitude resolution of output; None to keep
+    dLat (float) : Latitude resolution of output; None to keep
+
+  Returns:
+    InterpLonLat
+
+  """
+
+  lon    = coords[esdt.lonVar]
+  lat    = coords[esdt.latVar]
+  interp = InterpLonLat( blockCoords( lon[::strides.get('lonStride', 1)], block ),
+                         blockCoords( lat[::strides.get('latStride', 1)], block ),
+                         lon0 = lon.min() )
+  interp.setLonLatRes( dLon, dLat )
+  return interp
+
+def variableSlices( esdt, variables, names, coords, strides ):
+  """
+  Remote selection of each variable
+
+  Arguments:
+    esdt (EarthScienceDataType) : ESDT of granule
+    variables (list) : MERRA2Variable instances
+    names (list) : Local names of variables; see outputNames()
+    coords (dict) : Full coordinates of granule; see granuleCoords()
+    strides (dict) : Strides of coarse fetch; empty if not used
+
+  Returns:
+    tuple : List of (name, variable, slices) tuples, and dict of pieces
+      (see getStitched()) for selections that are not a single
+      hyperslab, keyed by name. For those, slices are those of the
+      first piece
+
+  """
+
+  kwargs    = dict( coordKeywords( esdt, coords ), **strides )
+  varSlices = []
+  stitched  = {}                                                                # Pieces for selections that are not a single hyperslab
+  for name, var in zip( names, variables ):                                     # Iterate over variables to determine slices
+    if esdt.is2D:                                                               # If 2D data
+      pieces = var.get2DPieces( **kwargs )
+    else:
+      pieces = var.get3DPieces( **kwargs )
+    if pieces is not None:                                                      # Selection crosses dateline or has several ranges/boxes
+      stitched[name] = pieces
+      slices = [remoteSlices for remoteSlices, _ in pieces[0]]
+    elif esdt.is2D:                                                             # If 2D data
+      slices = var.get2DSlices( **kwargs )                                      # Get slices for 2D data
+    else:                                                                       # Else
+      slices = var.get3DSlices( **kwargs )                                      # Slices for 3d
+    varSlices.append( (name, var, slices) )
+  return varSlices, stitched
+
+class PlannedRequests():
+  """
+  Remote requests for the selections of a granule
+
+  Selections are grouped with planRequests() so that each remote
+  variable is fetched once where possible. The data of each covering
+  request is downloaded once, split into the selections it contains,
+  and released once all of them have been taken.
+
+  """
+
+  def __init__(self, selections):
+    """
+    Arguments:
+      selections (list) : (name, varName, slices) tuples, where name is
+        the local name of the selection and varName the remote variable
+
+    """
+
+    self.log       = logging.getLogger(__name__)
+    self.fetches   = planRequests( [(varName, slices) for _, varName, slices in selections] )
+    self.members   = {}                                                         # Request and local slices for each local name
+    for i, (_, _, fetchMembers) in enumerate( self.fetches ):
+      for j, localSlices in fetchMembers:
+        self.members[ selections[j][0] ] = (i, localSlices)
+    self.remaining = [len(fetchMembers) for _, _, fetchMembers in self.fetches] # Used to release covering data once all its members are taken
+    self.covers    = {}                                                         # Downloaded data for requests, keyed by index in fetches
+
+  def fetchCombined(self, remote):
+    """Try to download data for all variables in a single request"""
+
+    if len(self.fetches) == 0:
+      return
+    index   = combinable( self.fetches )
+    fetched = remote.getValuesCombined( [self.fetches[i][:2] for i in index] )
+    if fetched is None:
+      self.log.warning( 'Combined request failed, falling back to per-variable requests' )
+      return
+    for i, (values, coords) in zip( index, fetched ):
+      atts = remote.getVarAtts( self.fetches[i][0] )
+      if atts is not None:
+        self.covers[i] = (values, atts, coords)
+
+  def get(self, remote, name):
+    """
+    Get data for selection, downloading its covering request if needed
+
+    Arguments:
+      remote (PyDAPDataset) : Remote data object
+      name (str) : Local name of selection
+
+    Returns:
+      tuple : Values, attributes, and coordinates of selection; see
+        splitCover(). All None if download failed
+
+    """
+
+    i, localSlices = self.members[name]
+    if i not in self.covers:                                                    # Not in combined request, so download the data
+      values, atts = remote.getVar( self.fetches[i][0], slices=self.fetches[i][1] )
+      if values is not None: self.covers[i] = (values, atts, None)
+    values, atts, coords = self.covers.get( i, (None, None, None) )
+    self.remaining[i] -= 1
+    if self.remaining[i] == 0: self.covers.pop( i, None )
+    if values is None:
+      return None, None, None
+    return splitCover( values, atts, coords, localSlices )
+
+def evaluateDerived( derived, held, atts, coords, slices, fullCoords, levVar ):
+  """
+  Compute derived variable from its inputs
+
+  Arguments:
+    derived (DerivedVariable) : Variable to compute
+    held (dict) : Processed inputs, as (values, fill, atts) tuples keyed
+      by name; inputs of derived are removed
+    atts (dict) : Attributes, with dimensions, of the last input
+    coords (dict) : Coordinates of the last input; may be None
+    slices (list) : Remote slices of the last input
+    fullCoords (dict) : Full coordinates of granule
+    levVar (str) : Name of level dimension
+
+  Returns:
+    tuple : Outputs, as (name, values, fill, atts) tuples, and slices
+      without the level dimension
+
+  """
+
+  levAxis = atts['dimensions'].index( levVar )
+  levels  = coords[levVar] if coords and levVar in coords else fullCoords[levVar][ slices[levAxis] ]
+  outputs = derived.evaluate( held, levVar, levels )
+  for var in derived.inputs.values():
+    held.pop( var.name )
+  return outputs, [s for i, s in enumerate( slices ) if i != levAxis]
+
+def reduceOutputs( outputs, reduce, slices, time, timeVar, dimkwargs ):
+  """
+  Temporal reductions of outputs
+
+  Arguments:
+    outputs (list) : (name, values, fill, atts) tuples
+    reduce (tuple) : Reductions to compute; see reductions.reductionOps
+    slices (list) : Remote slices of outputs
+    time (numpy.ndarray) : Full time coordinate of granule
+    timeVar (str) : Name of time dimension
+    dimkwargs (dict) : Dimension data overrides; see addDimensions()
+
+  Returns:
+    tuple : Reduced outputs, and dimkwargs with time set to the first
+      time of the granule, which labels the reduced values
+
+  """
+
+  axis    = outputs[0][3]['dimensions'].index( timeVar )
+  outputs = [reduced for output in outputs
+               for reduced in reduceVariable( *output, axis, reduce, timeVar )]
+  return outputs, dict( dimkwargs, **{timeVar : time[ slices[axis] ][:1]} )
+
+def writeOutputs( remote, local, outputs, slices, coords=None, fullCoords=None, keepDims=(), 
+        dimkwargs=None, **kwargs ):
+  """
+  Write processed variables to local file
+
+  Arguments:
+    remote (PyDAPDataset) : Remote data object
+    local (Dataset) : Local netCDF4.dataset object
+    outputs (list) : (name, values, fill, atts) tuples
+    slices (list) : Remote slices of outputs
+
+  Keyword arguments:
+    coords, fullCoords, keepDims : See addDimensions()
+    dimkwargs (dict) : Dimension data overrides; see addDimensions()
+    **kwargs : Passed to netCDF4.Dataset.createVariable
+
+  Returns:
+    None.
+
+  """
+
+  for outName, values, fill, atts in outputs:
+    squeeze = tuple( i for i, (n, dimName) in enumerate( zip(values.shape, atts['dimensions']) )
+                      if n == 1 and dimName not in keepDims )
+    atts['dimensions'] = addDimensions(remote, local, values.shape, slices, atts, coords=coords,
+                                       fullCoords=fullCoords, keepDims=keepDims, **(dimkwargs or {}))
+    values = values.squeeze( axis=squeeze )                                     # Squeeze data to remove any dimensions that are only one (1) element wide
+
+    vid    = createLocalVariable( local, outName, values.dtype, atts, fill, **kwargs )
+    vid[:] = values                                                             # Write the data
+
+def splitCover( values, atts, coords, localSlices ):
+  """
+  Extract one selection from data downloaded for a covering request
+
+  Arguments:
+    values (numpy.ndarray) : Data for the covering hyperslab
+    atts (dict) : Variable attributes, including dimensions
+    coords (dict) : Coordinate values for the covering hyperslab, keyed
+      by dimension name; may be None
+    localSlices (tuple) : Location of selection in covering hyperslab
+
+  Returns:
+    tuple : Values, copy of attributes, and coordinates of selection
+
+  """
+
+  if coords is not None:
+    coords = {dimName : coords[dimName][s]
+                for dimName, s in zip( atts['dimensions'], localSlices ) if dimName in coords}
+  return values[ localSlices ], dict( atts ), coords
+
+def unwrapLon( lon ):
+  """Add 360 to longitudes after each dateline crossing so they increase"""
+
+  shift = np.concatenate( ([0], np.cumsum( np.diff(lon) < 0 )) ) * 360.0
+  return lon + shift
+
+def getStitched( remote, varName, pieces, index, fullCoords, lonVar=None ):
+  """
+  Download selection in pieces and stitch them together
+
+  Each piece is downloaded as its own hyperslab and written into its
+  location in the stitched array. Points not covered by any piece (e.g.,
+  between disjoint boxes) are set to the fill value.
+
+  Arguments:
+    remote (PyDAPDataset) : Remote data object
+    varName (str) : Name of variable to download
+    pieces (list) : List of (remoteSlices, localSlices) tuples from
+      MERRA2Variable.get2DPieces/get3DPieces
+    index (tuple) : Index arrays into the remote coordinates for each
+      dimension of the stitched array
+    fullCoords (dict) : Full remote coordinate values keyed by name
+
+  Keyword arguments:
+    lonVar (str) : Name of longitude dimension; longitudes are made to
+      increase across the dateline
+
+  Returns:
+    tuple : Stitched values, attributes, and coordinate values keyed by
+      dimension name. Values are None if download failed
+
+  """
+
+  atts = remote.getVarAtts( varName )
+  if atts is None:
+    return None, None, None
+  atts   = dict( atts )
+  fill   = atts.get('_FillValue', None)
+  values = None
+  for remoteSlices, localSlices in pieces:
+    piece, _ = remote.getVar( varName, slices=remoteSlices )
+    if piece is None:
+      return None, None, None
+    if values is None:                                                          # Allocate once dtype of data is known
+      if fill is None:
+        values = np.full( [idx.size for idx in index], np.nan,
+                          dtype = np.result_type( piece.dtype, np.float32 ) )
+      else:
+        values = np.full( [idx.size for idx in index], fill, dtype = piece.dtype )
+    if isinstance(piece, np.ma.core.MaskedArray):
+      piece = piece.filled( np.nan if fill is None else fill )
+    values[ localSlices ] = piece
+
+  coords = {}
+  for dimName, idx in zip( atts['dimensions'], index ):
+    if dimName not in fullCoords: continue
+    coords[dimName] = fullCoords[dimName][idx]
+    if dimName == lonVar:
+      coords[dimName] = unwrapLon( coords[dimName] )
+  return values, atts, coords
+
+def openPartial( tmpfile, journal, **kwargs ):
+  """
+  Open partial local file, resuming a previous download if possible
+
+  If both the partial file and journal from a previous, interrupted,
+  run exist, the partial file is opened for appending and the list of
+  variables already completed is read from the journal. Otherwise, a
+  new partial file is created.
+
+  Arguments:
+    tmpfile (str) : Path to partial local file
+    journal (str) : Path to journal file
+
+  Keyword arguments:
+    **kwargs : Passed to netCDF4.Dataset
+
+  Returns:
+    tuple : netCDF4.Dataset and list of completed variable names
+
+  """
+
+  from netCDF4 import Dataset
+
+  log = logging.getLogger(__name__)
+  if os.path.isfile( tmpfile ) and os.path.isfile( journal ):
+    try:
+      with open(journal, 'r') as fid:
+        done = json.load( fid )['variables']
+      local = Dataset(tmpfile, 'a', **kwargs)
+    except Exception as err:
+      log.warning( f'Failed to resume partial file, starting over : {err}' )
+    else:
+      log.info( 'Resuming partial file : {}'.format( tmpfile ) )
+      return local, done
+
+  log.info( 'Initializing new local file...' );
+  local = Dataset(tmpfile, 'w', **kwargs)
+  with open(journal, 'w') as fid:
+    json.dump( {'variables' : []}, fid )
+  return local, []
+
+def markComplete( local, journal, done, varName ):
+  """
+  Record variable as complete in journal
+
+  The local file is synced to disk before the journal is updated so
+  that the journal never lists data that has not been written.
+
+  Arguments:
+    local (Dataset) : Local netCDF4.dataset object
+    journal (str) : Path to journal file
+    done (list) : Names of completed variables; updated in place
+    varName (str) : Name of variable that was completed
+
+  Returns:
+    None.
+
+  """
+
+  local.sync()
+  done.append( varName )
+  tmp = journal + '.tmp'
+  with open(tmp, 'w') as fid:
+    json.dump( {'variables' : done}, fid )
+  os.replace( tmp, journal )
+
+def prepareValues( values, fill, interp, buffers=None, block=1 ):
+  """
+  Process/interpolate data so is correct size for writing
+
+  Because we use the shape of this data to define the size of variable
+  Dimensions, values muse be final shape of data before dimensions are
+  defined.
+
+  Fill values, NaN handling, and the longitude padding required for
+  interpolation are done in place or in reusable work buffers, so no
+  full-size temporary arrays are allocated. When no interpolation is
+  done, fill values are never converted to NaN and back; only existing
+  NaN values are replaced by fill, in a single pass.
+
+  Note that the returned array may be a view into a work buffer (or the
+  input array, modified in place), so it must be written out before
+  prepareValues is called again.
+
+  Arguments:
+    values (numpy.ndarray) : Data downloaded from remote
+    fill (int,float) : Fill value of the data; None if no fill
+    interp (InterpLonLat) : Interpolator for data
+
+  Keyword arguments:
+    buffers (BufferPool) : Pool of work buffers to use. Default is a
+      pool shared by all calls in the process
+    block (int) : If greater than one (1), non-overlapping block x block
+      lat/lon boxes are averaged before interpolation; see blockMean
+
+  Returns:
+    tuple : Processed data and fill value
+
+  """
+
+  if buffers is None: buffers = BUFFERS
+  if block > 1:
+    values, fill = blockMean( values, fill, block )
+  mask = None
+  if isinstance(values, np.ma.core.MaskedArray):                                # If data are masked array  
+    fill   = values.fill_value                                                  # Ensure fill is set
+    if values.mask is not np.ma.nomask: mask = values.mask
+    values = values.data
+  elif fill is None:                                                            # Nothing to replace, so only interpolate
+    return interp.interpolate( values ), fill
+
+  dtype = values.dtype if values.dtype.kind == 'f' else np.dtype('float32')     # Ensure data is float type
+
+  if interp.dLon is None and interp.dLat is None:                               # No interpolation, so fill stays as fill
+    if values.dtype == dtype and values.flags.writeable:                        # Work in place if possible
+      out = values
+    else:
+      out = buffers.get( 'values', values.shape, dtype )
+      np.copyto( out, values, casting='unsafe' )
+    if mask is not None:
+      np.copyto( out, fill, where=mask, casting='unsafe' )
+    isnan = buffers.get( 'mask', out.shape, bool )
+    np.isnan( out, out=isnan )                                                  # Replace any nan values with fill value
+    np.copyto( out, fill, where=isnan, casting='unsafe' )
+    return out, fill
+
+  shape  = values.shape[:-1] + (values.shape[-1]+2,)                            # Padded in longitude for wrapping
+  padded = buffers.get( 'values', shape, dtype )
+  inner  = padded[..., 1:-1]
+  np.copyto( inner, values, casting='unsafe' )                                  # Single copy into padded work buffer
+  if mask is None:
+    mask = buffers.get( 'mask', values.shape, bool )
+    np.equal( inner, fill, out=mask )
+  np.copyto( inner, np.nan, where=mask )                                        # Fill with NaN
+  padded[...,  0] = inner[..., -1]                                              # Wrap longitude
+  padded[..., -1] = inner[...,  0]
+
+  values = interp.interpolate( padded, padded=True )                            # Interpolate data
+  isnan  = buffers.get( 'mask', values.shape, bool )
+  np.isnan( values, out=isnan )
+  np.copyto( values, fill, where=isnan, casting='unsafe' )                      # Replace any nan values with original fill value
+  return values, fill
+
+def coarseResolution( coarse=False, dLon=None, dLat=None, dLev=None, dTime=None, block=None ):
+  """
+  Resolution keywords for a coarse fetch
+
+  Arguments:
+    None.
+
+  Keyword arguments:
+    See downloader()
+
+  Returns:
+    dict : Keywords for MERRA2Variable.getStrides(); empty if coarse
+      fetch is not enabled
+
+  """
+
+  if not coarse:
+    return {}
+  if block is not None and block > 1 and (dLon is None or dLat is None):
+    logging.getLogger(__name__).warning( 'Block averaging requires dLon and dLat, ignoring' )
+    block = None
+  return {'dLon' : dLon, 'dLat' : dLat, 'dLev' : dLev, 'dTime' : dTime,
+          'block' : block if block and block > 1 else None}
+
+def requestOptions( coarse=False, dLon=None, dLat=None, dLev=None, dTime=None, block=None, reduce=None ):
+  """
+  Options, other than variables and resolution, that change the output
+
+  Used to identify the request in the manifest; see coarseResolution()
+  for arguments.
+
+  Returns:
+    dict : Coarse fetch resolution and, if set, reductions
+
+  """
+
+  options = coarseResolution( coarse, dLon, dLat, dLev, dTime, block )
+  if reduce:
+    options['reduce'] = list( reduce )
+  return options
+
+def blockCoords( data, block ):
+  """Coordinates of block x block boxes averaged by blockMean"""
+
+  if block < 2:
+    return data
+  n = data.size // block * block
+  return data[:n].reshape( -1, block ).mean( axis=1 )
+
+def blockMean( values, fill, block ):
+  """
+  Average non-overlapping lat/lon boxes
+
+  Boxes of block x block points in the last two dimensions are averaged,
+  ignoring missing values, to reduce aliasing of data subsampled on the
+  server. Points left over at the end of either dimension are dropped.
+
+  Arguments:
+    values (numpy.ndarray) : Data downloaded from remote
+    fill (int,float) : Fill value of the data; None if no fill
+    block (int) : Number of points along each of lat/lon to average
+
+  Returns:
+    tuple : Averaged data, with fill where a box had no valid data, and
+      fill value
+
+  """
+
+  dtype = values.dtype if values.dtype.kind == 'f' else np.dtype('float32')
+  ny    = values.shape[-2] // block * block
+  nx    = values.shape[-1] // block * block
+  if isinstance(values, np.ma.core.MaskedArray):
+    fill   = values.fill_value
+    values = values[..., :ny, :nx].astype( dtype ).filled( np.nan )
+  else:
+    values = values[..., :ny, :nx].astype( dtype )
+    if fill is not None:
+      np.copyto( values, np.nan, where=values == fill )
+
+  shape = values.shape[:-2] + (ny // block, block, nx // block, block)
+  with warnings.catch_warnings():                                               # Boxes with no valid data give NaN
+    warnings.simplefilter( 'ignore', RuntimeWarning )
+    values = np.nanmean( values.reshape( shape ), axis=(-3, -1) )
+  if fill is not None:
+    np.copyto( values, fill, where=np.isnan(values), casting='unsafe' )
+  return values, fill
+
+def createLocalVariable( local, varName, dtype, atts, fill, **kwargs ):
+  """
+  Create variable in local file and copy attributes
+
+  If the variable already exists (e.g., partially written before a
+  download was interrupted), the existing variable is returned.
+
+  Arguments:
+    local (Dataset) : Local netCDF4.dataset object
+    varName (str) : Name of variable to create
+    dtype (numpy.dtype) : Data type of variable
+    atts (dict) : Variable attributes; must include dimensions
+    fill (int,float) : Fill value for variable
+
+  Keyword arguments:
+    **kwargs : Passed to netCDF4.Dataset.createVariable
+
+  Returns:
+    netCDF4.Variable : The new variable
+
+  """
+
+  if varName in local.variables:                                                # Variable exists from interrupted run, so reuse it
+    return local.variables[varName]
+  vid  = local.createVariable( varName, dtype, atts['dimensions'],
+              fill_value = fill, **kwargs )                                     # Create variable in local file
+  for attName, attVal in atts.items():                                          # Iterate over attributes
+    if attName != 'dimensions':                                                 # If not the dimensions attribute
+      vid.setncattr( attName, attVal )                                          # Copy the attribute
+  return vid
+
+def tileSlices( slices, planeBytes, maxBytes ):
+  """
+  Split hyperslab into tiles that fit within a memory limit
+
+  The last two dimensions (latitude, longitude) are never split. Tiles
+  are taken along the first dimension (time) and, if a single time
+  step is still too large, along the second dimension (level).
+
+  Arguments:
+    slices (tuple) : Slices defining full hyperslab on remote
+    planeBytes (int) : Bytes required to hold/process one lat/lon plane
+    maxBytes (int) : Maximum bytes to use for a tile
+
+  Returns:
+    list : List of (remoteSlices, localSlices) tuples where remoteSlices
+      are the slices for the tile on the remote and localSlices are the
+      indices of the tile within the full hyperslab
+
+  """
+
+  counts  = [sliceLen(s) for s in slices[:-2]]
+  nPlanes = max( 1, int(maxBytes // planeBytes) )                               # Number of lat/lon planes that fit in memory
+  return list( _tiles( slices[:-2], counts, nPlanes, slices[-2:] ) )
+
+def _tiles( lead, counts, nPlanes, tail, remote=(), local=() ):
+  """Recursively generate tiles for tileSlices"""
+
+  allTail = (slice(None),) * len(tail)
+  if len(lead) == 0:
+    yield remote + tail, local + allTail
+    return
+
+  inner = int( np.prod( counts[1:] ) )                                          # Number of planes per index along this axis
+  step  = lead[0].step or 1
+  n     = max( 1, nPlanes // inner )
+  for i in range( 0, counts[0], n ):
+    j  = min( i+n, counts[0] )
+    rs = slice( lead[0].start + i*step, lead[0].start + (j-1)*step + 1, lead[0].step )
+    ls = slice( i, j )
+    if inner <= nPlanes:                                                        # All inner axes fit, so take all of them
+      yield (remote + (rs,) + tuple(lead[1:]) + tail,
+             local  + (ls,) + (slice(None),) * (len(lead)-1) + allTail)
+    else:                                                                       # Split next axis too
+      yield from _tiles( lead[1:], counts[1:], nPlanes, tail, remote + (rs,), local + (ls,) )
+
+def writeTiled( remote, local, varName, slices, interp, maxMemory, dimkwargs, block=1, outName=None, 
+        keepDims=(), fullCoords=None, **kwargs ):
+  """
+  Download and write variable in tiles of bounded size
+
+  The local variable is created when the first tile arrives and each
+  tile is then written directly into it, so that the full hyperslab
+  is never held in memory.
+
+  Arguments:
+    remote (PyDAPDataset) : Remote data object
+    local (Dataset) : Local netCDF4.dataset object
+    varName (str) : Name of variable to download
+    slices (tuple) : Slices defining hyperslab to download
+    interp (InterpLonLat) : Interpolator for data
+    maxMemory (int) : Approximate maximum bytes to use per tile
+    dimkwargs (dict) : Passed to addDimensions as keywords
+
+  Keyword arguments:
+    block (int) : Size of lat/lon boxes to average; see prepareValues
+    outName (str) : Name of variable in local file; default is varName
+    keepDims (tuple) : Names of dimensions to keep even if length one (1)
+    fullCoords (dict) : Full remote coordinates; see addDimensions
+    **kwargs : Passed to netCDF4.Dataset.createVariable
+
+  Returns:
+    bool : True if success, False otherwise
+
+  """
+
+  log  = logging.getLogger(__name__)
+  atts = remote.getVarAtts( varName )
+  if atts is None:
     return False
+  atts = dict( atts )
+  fill = atts.pop('_FillValue', None)
+
+  nPlane     = max( sliceLen(slices[-2]) * sliceLen(slices[-1]),
+                    interp.newLat.size * interp.newLon.size )
+  planeBytes = nPlane * np.dtype('float64').itemsize * TILECOPIES
+  tiles      = tileSlices( slices, planeBytes, maxMemory )
+  log.debug( f'Downloading {varName} in {len(tiles)} tile(s)' )
+
+  vid = None
+  for remoteSlices, localSlices in tiles:
+    values, _ = remote.getVar( varName, slices=remoteSlices )
+    if values is None:
+      return False
+    values, fill = prepareValues( values, fill, interp, block=block )
+    if vid is None:                                                             # On first tile, create dimensions and variable
+      shape = tuple( sliceLen(s) for s in slices[:-2] ) + values.shape[-2:]
+      keep  = [i for i, n in enumerate(shape) 
+                if n != 1 or atts['dimensions'][i] in keepDims]                 # Dimensions of length one (1) are dropped in local file
+      atts['dimensions'] = addDimensions(remote, local, shape, slices, atts, fullCoords=fullCoords,
+                                         keepDims=keepDims, **dimkwargs)
+      vid   = createLocalVariable( local, outName or varName, values.dtype, atts, fill, **kwargs )
+    index  = tuple( localSlices[i] for i in keep )
+    vid[index] = values.reshape( [values.shape[i] for i in keep] )
+    del values
 
   return True
 
-def addDimensions(remote, local, shape, slices, atts, **kwargs):
+def matchDimension( local, dimName, size, values ):
+  """
+  Name of local dimension matching size and coordinate values
+
+  Variables requested with different subsets (e.g., RH at 850 hPa and
+  RH at 400-600 hPa) cannot share dimensions. The first existing
+  dimension among dimName, dimName_1, dimName_2, ... with the same size
+  and coordinate values is used; if there is none, the first unused
+  name is returned.
+
+  Arguments:
+    local (Dataset) : Local netCDF4.dataset object
+    dimName (str) : Name of dimension on remote
+    size (int) : Size of dimension
+    values (numpy.ndarray) : Coordinate values; may be None
+
+  Returns:
+    str : Name of dimension to use in local file
+
+  """
+
+  name = dimName
+  n    = 0
+  while name in local.dimensions:
+    if len( local.dimensions[name] ) == size:
+      if values is None or name not in local.variables:
+        return name
+      if np.array_equal( np.asarray( local.variables[name][:] ), np.asarray( values ) ):
+        return name
+    n   += 1
+    name = f'{dimName}_{n}'
+  return name
+
+def addDimensions(remote, local, shape, slices, atts, coords=None, fullCoords=None, keepDims=(), **kwargs):
   """
   Add missing dimensions to local data file
 
@@ -210,7 +1757,16 @@ def addDimensions(remote, local, shape, slices, atts, **kwargs):
     atts (dict) : Dictionary containing variable attributes
 
   Keywords:
-    None.
+    coords (dict) : Coordinate values for the slices, keyed by dimension
+      name; e.g., grid maps from a combined request. Dimensions in this
+      dict are not downloaded again.
+    fullCoords (dict) : Full remote coordinate values keyed by dimension
+      name, already downloaded for the granule; subset with slices when
+      not in coords. Coordinates in neither are only downloaded if a new
+      local dimension has to be written.
+    keepDims (tuple) : Names of dimensions to add even if length one (1)
+    **kwargs : Data to write for dimension of same name, overriding
+      downloaded/coords data
 
   Returns:
     tuple : Dimension names
@@ -219,18 +1775,33 @@ def addDimensions(remote, local, shape, slices, atts, **kwargs):
 
   dims = []
   for i, dimName in enumerate( atts['dimensions'] ):                            # Iterate over dimensions
-    if shape[i] == 1: continue                                                  # If dimension is only 1 element, skip it
-    dims.append( dimName )                                                      # Append dimension name to dims list
-    if dimName not in local.dimensions:                                         # If dimension not in local
-      did = local.createDimension( dimName, shape[i] )                          # Create dimension in local file
-      if dimName not in local.variables:                                        # If the dimension is not in local variables
-        dimVal, dimAtts = remote.getVar( dimName, slices[i] )                   # Download dimension variable
-        if dimVal is not None:                                                  # If download success
-          vid    = local.createVariable( dimName, dimVal.dtype, (dimName,) )    # Create local variable
+    if shape[i] == 1 and dimName not in keepDims: continue                      # If dimension is only 1 element, skip it
+    if dimName in kwargs:                                                       # Use data from keyword argument of same name as dimension if exists
+      dimVal = kwargs[dimName]
+    elif coords and dimName in coords:                                          # Else use coordinate values already available
+      dimVal = coords[dimName]
+    elif fullCoords and dimName in fullCoords:
+      dimVal = fullCoords[dimName][ slices[i] ]
+    else:
+      dimVal = None                                                             # Downloaded below, only if needed
+    if dimName in keepDims:                                                     # Kept dimensions are always shared
+      locName = dimName
+    else:
+      locName = matchDimension( local, dimName, shape[i], dimVal )              # Local name; differs from dimName if other variables use a different subset
+    dims.append( locName )                                                      # Append dimension name to dims list
+    if locName not in local.dimensions:                                         # If dimension not in local
+      did = local.createDimension( locName, shape[i] )                          # Create dimension in local file
+      if locName not in local.variables:                                        # If the dimension is not in local variables
+        if dimVal is None:
+          dimVal, dimAtts = remote.getVar( dimName, slices[i] )                 # Download dimension variable
+        else:
+          dimAtts = remote.getVarAtts( dimName )
+        if dimVal is not None and dimAtts is not None:                          # If download success
+          vid    = local.createVariable( locName, dimVal.dtype, (locName,) )    # Create local variable
           for attName, attVal in dimAtts.items():                               # Iterate over attributes for variable
             if attName != 'dimensions':                                         # If attribute is not dimensions
               vid.setncattr( attName, attVal )                                  # Write attribute to local file
-          vid[:] = kwargs.get(dimName, dimVal)                                  # Write data; use data from keyword argument of same name as dimension if exists, else use data downloaded
+          vid[:] = dimVal                                                       # Write data
   return tuple(dims)
 
 
@@ -0,0 +1,31 @@
+import logging
+
+def outputNames( variables ):
+  """
+  Unique local names for variables
+
+  The name of each variable (MERRA2Variable.name) is used for its
+  output. If the same name is used more than once, e.g., RH requested
+  at two different levels without setting names, a numeric suffix is
+  added to later ones.
+
+  Arguments:
+    variables (list) : MERRA2Variable instances
+
+  Returns:
+    list : Local variable names, in same order as variables
+
+  """
+
+  log   = logging.getLogger(__name__)
+  names = []
+  for var in variables:
+    name = var.name
+    n    = 0
+    while name in names:
+      n   += 1
+      name = f'{var.name}_{n}'
+    if name != var.name:
+      log.warning( f'Variable name {var.name} used more than once, writing as {name}' )
+    names.append( name )
+  return names
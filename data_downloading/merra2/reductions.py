@@ -0,0 +1,275 @@
+"""
+Streaming temporal reductions of MERRA-2 data
+
+Reductions are computed on each granule as it is downloaded, so only
+the reduced fields are written to disk. The count of valid values is
+always kept with the other reductions so that granule results can be
+combined exactly into, e.g., monthly means by running accumulators
+that hold only one time step of data per variable.
+
+"""
+import logging
+import os
+
+import numpy as np
+
+REDUCTIONS = ('mean', 'sum', 'min', 'max', 'count')
+COUNT      = 'count'
+
+def reductionOps( reduce ):
+  """
+  Check and normalize reductions to compute
+
+  Arguments:
+    reduce (str,list) : Name, or list of names, of reductions
+
+  Returns:
+    tuple : Reduction names, with count always last
+
+  """
+
+  if isinstance(reduce, str):
+    reduce = [reduce]
+  ops = []
+  for op in reduce:
+    if op not in REDUCTIONS:
+      raise ValueError( f'Unsupported reduction : {op}; must be one of {REDUCTIONS}' )
+    if op != COUNT and op not in ops:
+      ops.append( op )
+  return tuple( ops ) + (COUNT,)                                                # Count needed to combine reductions across granules
+
+def reducedName( name, op ):
+  """Name of local variable holding reduction of variable"""
+
+  return f'{name}_{op}'
+
+class Accumulator():
+  """
+  NaN-aware running reduction of one variable
+
+  Values equal to the fill value, or NaN, are ignored. The sum is
+  accumulated in double precision.
+
+  """
+
+  def __init__(self, ops):
+    """
+    Arguments:
+      ops (tuple) : Reductions to compute; see reductionOps()
+
+    """
+
+    self.ops   = ops
+    self.count = None
+    self.sum   = None
+    self.min   = None
+    self.max   = None
+
+  @property
+  def needSum(self):
+    return 'mean' in self.ops or 'sum' in self.ops
+
+  def add(self, values, axis = 0, fill = None):
+    """
+    Add values to the reduction
+
+    Arguments:
+      values (numpy.ndarray) : Values to add
+
+    Keyword arguments:
+      axis (int) : Axis to reduce over; kept with length one (1)
+      fill (float) : Fill value of values
+
+    Returns:
+      None.
+
+    """
+
+    if isinstance(values, np.ma.core.MaskedArray):
+      valid  = ~np.ma.getmaskarray( values )
+      values = values.data
+    else:
+      valid  = np.ones( values.shape, dtype = bool )
+    if values.dtype.kind == 'f':
+      valid &= ~np.isnan( values )
+    if fill is not None:
+      valid &= values != fill
+
+    count = valid.sum( axis = axis, keepdims = True, dtype = np.int32 )
+    parts = {'count' : count}
+    if self.needSum:
+      parts['sum'] = np.where( valid, values, 0 ).sum( axis = axis, keepdims = True, dtype = np.float64 )
+    if 'min' in self.ops:
+      parts['min'] = np.where( valid, values, np.inf ).min( axis = axis, keepdims = True )
+    if 'max' in self.ops:
+      parts['max'] = np.where( valid, values, -np.inf ).max( axis = axis, keepdims = True )
+    self.merge( **parts )
+
+  def merge(self, count, sum = None, min = None, max = None):
+    """
+    Combine partial reduction, e.g., read from a granule file
+
+    Arguments:
+      count (numpy.ndarray) : Number of valid values
+
+    Keyword arguments:
+      sum (numpy.ndarray) : Sum of valid values
+      min (numpy.ndarray) : Minimum of valid values; +inf or NaN where
+        there are none
+      max (numpy.ndarray) : Maximum of valid values; -inf or NaN where
+        there are none
+
+    Returns:
+      None.
+
+    """
+
+    count = np.asarray( count, dtype = np.int32 )
+    if self.count is None:
+      self.count = count.copy()
+    else:
+      self.count += count
+    if self.needSum:
+      sum = np.where( count > 0, sum, 0.0 )                                     # Partial sums may be NaN where no valid values
+      self.sum = sum if self.sum is None else self.sum + sum
+    if 'min' in self.ops:
+      self.min = min if self.min is None else np.fmin( self.min, min )          # fmin/fmax ignore NaN
+    if 'max' in self.ops:
+      self.max = max if self.max is None else np.fmax( self.max, max )
+
+  def mergeResults(self, results):
+    """Combine partial reduction given as dict of results; see results()"""
+
+    count = np.ma.filled( results[COUNT], 0 )
+    if 'sum' in results:
+      total = np.ma.filled( results['sum'].astype(np.float64), np.nan )
+    elif 'mean' in results:
+      total = np.ma.filled( results['mean'].astype(np.float64), np.nan ) * count
+    else:
+      total = None
+    self.merge( count,
+      sum = total,
+      min = np.ma.filled( results['min'].astype(np.float64), np.nan ) if 'min' in results else None,
+      max = np.ma.filled( results['max'].astype(np.float64), np.nan ) if 'max' in results else None )
+
+  def results(self, dtype = np.float32):
+    """
+    Reductions computed so far
+
+    Keyword arguments:
+      dtype (numpy.dtype) : Type of returned values, other than count
+
+    Returns:
+      dict : Reduced values keyed by reduction name; NaN where there
+        were no valid values
+
+    """
+
+    empty = self.count == 0
+    out   = {}
+    with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+      for op in self.ops:
+        if op == COUNT:
+          out[op] = self.count
+          continue
+        if op == 'mean':
+          val = self.sum / self.count
+        else:
+          val = getattr( self, op )
+        out[op] = np.where( empty, np.nan, val ).astype( dtype )
+    return out
+
+def reduceVariable( name, values, fill, atts, axis, ops, timeVar ):
+  """
+  Reduce variable over the time axis of one granule
+
+  Arguments:
+    name (str) : Local name of variable
+    values (numpy.ndarray) : Values of variable
+    fill (float) : Fill value of values; may be None
+    atts (dict) : Variable attributes, including dimensions
+    axis (int) : Index of time axis
+    ops (tuple) : Reductions to compute; see reductionOps()
+    timeVar (str) : Name of time coordinate; used in cell_methods
+
+  Returns:
+    list : (name, values, fill, atts) tuples, one per reduction, with
+      fill values in place of NaN
+
+  """
+
+  acc = Accumulator( ops )
+  acc.add( values, axis = axis, fill = fill )
+  dtype = values.dtype if values.dtype.kind == 'f' else np.float32
+  return reducedOutputs( name, acc.results( dtype ), fill, atts, timeVar )
+
+def reducedOutputs( name, results, fill, atts, timeVar ):
+  """Local variables, with attributes, for reductions of a variable"""
+
+  out = []
+  for op, values in results.items():
+    opAtts = dict( atts )
+    if op == COUNT:
+      opAtts.pop( 'units', None )
+      opAtts['long_name'] = f'number of valid values of {name}'
+      out.append( (reducedName(name, op), values, None, opAtts) )
+      continue
+    opAtts['cell_methods'] = f'{timeVar}: {op}'
+    if fill is not None:
+      values = np.where( np.isnan(values), fill, values ).astype( values.dtype )
+    out.append( (reducedName(name, op), values, fill, opAtts) )
+  return out
+
+def combineReduced( files, outfile, names, ops, timeVar ):
+  """
+  Combine reductions in granule files into one file for the period
+
+  Files are read one at a time and folded into running accumulators,
+  so memory use does not depend on the number of granules. Coordinates
+  are copied from the first file; the time coordinate is that of the
+  first granule.
+
+  Arguments:
+    files (list) : Granule files written with reductions, in date order
+    outfile (str) : Path of file to create
+    names (list) : Local names of reduced variables
+    ops (tuple) : Reductions in files; see reductionOps()
+    timeVar (str) : Name of time coordinate
+
+  Returns:
+    str : Path of file created
+
+  """
+
+  from netCDF4 import Dataset
+
+  log  = logging.getLogger(__name__)
+  accs = {name : Accumulator( ops ) for name in names}
+  for path in files:
+    with Dataset( path, 'r' ) as src:
+      for name, acc in accs.items():
+        acc.mergeResults( {op : src.variables[ reducedName(name, op) ][:] for op in ops} )
+
+  log.info( 'Writing {} granules to : {}'.format( len(files), outfile ) )
+  tmpfile = outfile + '.part'
+  with Dataset( files[0], 'r' ) as src, Dataset( tmpfile, 'w' ) as dst:
+    for dimName, dim in src.dimensions.items():
+      dst.createDimension( dimName, len(dim) )
+    for varName, var in src.variables.items():
+      if varName not in src.dimensions: continue                                # Only copy coordinates
+      vid = dst.createVariable( varName, var.dtype, var.dimensions )
+      vid.setncatts( {att : var.getncattr(att) for att in var.ncattrs()} )
+      vid[:] = var[:]
+    for name, acc in accs.items():
+      for op, values in acc.results().items():
+        var   = src.variables[ reducedName(name, op) ]
+        atts  = {att : var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'}
+        fill  = getattr( var, '_FillValue', None )
+        if op != COUNT and fill is not None:
+          values = np.where( np.isnan(values), fill, values )
+        vid   = dst.createVariable( reducedName(name, op), var.dtype, var.dimensions,
+                                    fill_value = fill )
+        vid.setncatts( atts )
+        vid[:] = values.astype( var.dtype )
+  os.replace( tmpfile, outfile )
+  return outfile
@@ -7,12 +7,9 @@ import certifi
 
 from urllib.request     import urlopen
 
-from .scaling import scaleFillData
+from ...utils.decode import nativeByteOrder, scaleFillData
 
 FAILEDFMT = 'Attempt {:2d} of {:2d} - Failed to get {}'
-LITTLEEND = sys.byteorder == 'little'
-NATIVE    = LITTLEEND and '<' or '>'
-SWAPPED   = LITTLEEND and '>' or '<'
 
 def urlJoin( *argv ):
   return '/'.join( [str(i) for i in argv] );
@@ -81,11 +78,9 @@ def downloadVariable( dataset, varName,
   if atts is not None:
     values = getValues( dataset, varName, slices = slices)
     if values is not None:
-      if values.dtype.byteorder == SWAPPED:
-        dt     = np.dtype( str(values.dtype).replace(SWAPPED, NATIVE)  )
-        values = values.astype( dt )
+      values = nativeByteOrder( values, inplace = True )
       if scaleandfill:
-        return scaleFillData(values, atts), atts
+        return scaleFillData(values, atts, inplace = True), atts
       else:
         return values, atts
   return None, None
@@ -2,13 +2,15 @@ import logging
 
 import os
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 from datetime import datetime, timedelta
 
 import numpy as np
 
 import idlpy
 
-from ..utils.dataScaler import DataScaler
+from ...utils.dataScaler import DataScaler
 
 SCALER  = DataScaler()
 
@@ -29,9 +31,190 @@ def copyAtts( src, dst, varName, *args ):
     dst[varName].setncattr( arg, src[varName].getncattr( arg ) )
   return
 
-def fileCombine( outfile, files ):
+def readSlabs( src, varNames, tUnits = None, rangeNames = () ):
+  """
+  Read all variables to combine from one input file
+
+  Arguments:
+    src (str, netCDF4.Dataset) : Path to, or open, input file
+    varNames (list) : Names of variables to read
+
+  Keyword arguments:
+    tUnits (str) : If set, time values are converted to these units
+      and returned
+    rangeNames (list) : Names of variables to get the range of, for
+      packing in two passes; see packSlabs()
+
+  Returns:
+    tuple : Number of times in file, time values (None if tUnits not
+      set), dict of data, with NaN for masked values, keyed by variable
+      name, and dict of (min, max) keyed by name for rangeNames
+
+  """
+
   from netCDF4 import Dataset, date2num, num2date
 
+  iid    = Dataset(src, 'r') if isinstance(src, str) else src                   # Open file if path given
+  nt     = iid.dimensions['time'].size                                          # Get size of time dimension
+  times  = None
+  if tUnits is not None:
+    tVar  = iid['time']                                                         # Read in time from file
+    times = date2num( num2date( tVar[:], tVar.units ), tUnits )                 # Rescale time based on units
+  slabs  = {varName : iid[varName][:].filled(np.nan) for varName in varNames}   # Write NaN to masked values
+  ranges = {varName : SCALER.dataRange( iid[varName][:] ) for varName in rangeNames}
+  if iid is not src: iid.close()                                                # Close file if opened here
+  return nt, times, slabs, ranges
+
+def packSlabs( src, packing ):
+  """
+  Read and pack variables from one input file with given packing
+
+  Arguments:
+    src (str, netCDF4.Dataset) : Path to, or open, input file
+    packing (dict) : (scale, offset) keyed by variable name; see
+      DataScaler.scaleFromRange()
+
+  Returns:
+    tuple : Number of times in file and dict of packed data keyed by
+      variable name
+
+  """
+
+  from netCDF4 import Dataset
+
+  iid    = Dataset(src, 'r') if isinstance(src, str) else src                   # Open file if path given
+  nt     = iid.dimensions['time'].size
+  packed = {varName : SCALER.packData( iid[varName][:].filled(np.nan), scale, offset )
+              for varName, (scale, offset) in packing.items()}
+  if iid is not src: iid.close()
+  return nt, packed
+
+def mapFiles( func, files, args, handle, pool = None, inflight = 1, first = None ):
+  """
+  Apply function to each input file and handle the results here
+
+  Arguments:
+    func (callable) : Called as func( file, *args ) for each file
+    files (list) : Input files
+    args (tuple) : Extra arguments to func
+    handle (callable) : Called as handle( index, result ) in this
+      process, for each file, in the order results are ready
+
+  Keyword arguments:
+    pool (Executor) : Pool to run func in; run here if None
+    inflight (int) : Maximum number of results held at once when using
+      pool
+    first (netCDF4.Dataset) : First file, already open; used instead of
+      opening the file again when func is run here
+
+  """
+
+  if pool is None:
+    for i, path in enumerate( files ):                                          # Iterate over all input files
+      src = first if i == 0 and first is not None and first.isopen() else path
+      handle( i, func( src, *args ) )
+    return
+  pending = {}
+  for i, path in enumerate( files ):                                            # Keep no more than inflight files in memory
+    if len(pending) >= inflight:
+      done, _ = wait( pending, return_when = FIRST_COMPLETED )
+      for future in done: handle( pending.pop(future), future.result() )
+    pending[ pool.submit( func, path, *args ) ] = i
+  for future, i in pending.items(): handle( i, future.result() )
+
+def batchVariables( shapes, itemsize, nFiles, inflight, maxMemory = None, streaming = None ):
+  """
+  Group variables so that each group can be combined within memory budget
+
+  Each group is combined in one pass over the input files; the full
+  output array for every variable in the group is held in memory, along
+  with the data of inflight input files. Variables that are streamed
+  are instead packed in two passes over the input files, holding only
+  the data of inflight files.
+
+  Arguments:
+    shapes (dict) : Output shape keyed by variable name
+    itemsize (int) : Bytes per value
+    nFiles (int) : Number of input files
+    inflight (int) : Number of input files read at once
+
+  Keyword arguments:
+    maxMemory (int) : Approximate maximum bytes to hold in memory; all
+      variables are in one group if None
+    streaming (bool) : If set, all variables are streamed; if None,
+      variables that do not fit in maxMemory on their own are
+
+  Returns:
+    tuple : Lists of variable names, one per group, and list of names
+      of variables to stream
+
+  """
+
+  log      = logging.getLogger(__name__)
+  if streaming:
+    return [[]], list(shapes)
+  if maxMemory is None:
+    return [list(shapes)], []
+  batches  = []
+  streamed = []
+  used     = 0
+  for varName, shape in shapes.items():
+    nbytes = int( np.prod( shape ) ) * itemsize
+    nbytes = nbytes + nbytes // nFiles * inflight                               # Output array plus slabs of files being read
+    if nbytes > maxMemory and streaming is None:
+      streamed.append( varName )
+      continue
+    if batches and used + nbytes <= maxMemory:
+      batches[-1].append( varName )
+      used += nbytes
+      continue
+    if nbytes > maxMemory:
+      log.warning( f'Variable {varName} needs about {nbytes} bytes; more than maxMemory' )
+    batches.append( [varName] )
+    used = nbytes
+  return batches or [[]], streamed                                              # One pass is still needed for time
+
+def filesInFlight( slabBytes, workers, maxMemory = None, held = 0 ):
+  """Number of input files to read at once within memory budget"""
+
+  inflight = max( 1, workers or 1 )
+  if maxMemory is not None and slabBytes > 0:
+    inflight = min( inflight, max( 1, (maxMemory - held) // slabBytes ) )
+  return inflight
+
+def fileCombine( outfile, files, workers = None, maxMemory = None, streaming = None ):
+  """
+  Combine input files along time and pack data into integers
+
+  Each input file is opened once per group of variables (see
+  batchVariables()), and all variables of the group are read from it;
+  with enough memory there is one group, so each file is opened once.
+
+  Variables too large to hold for the whole time span are packed in two
+  passes instead: the range of each file is found on the first pass
+  (along with the first group), and each file is packed straight into
+  the output on the second, with scale_factor and add_offset fixed from
+  the overall range. Memory is then bounded by the size of the input
+  files, and the output is the same as packing all data at once.
+
+  Arguments:
+    outfile (str) : Path of output file
+    files (list) : Input files, in time order; all must have the same
+      number of times. They are removed once combined.
+
+  Keyword arguments:
+    workers (int) : Number of processes to read input files with. If
+      None, files are read one at a time in this process
+    maxMemory (int) : Approximate maximum bytes of data to hold in
+      memory. Variables are combined in groups that fit, and fewer
+      files are read at once if needed.
+    streaming (bool) : If set, all variables are packed in two passes;
+      if False, none are. If None (default), only variables that do not
+      fit in maxMemory are.
+
+  """
+  from netCDF4 import Dataset
+
   log = logging.getLogger(__name__)
 
   log.info( 'Combining data files for ITCZ' )
@@ -43,6 +226,7 @@ def fileCombine( outfile, files ):
   oid.set_auto_maskandscale( False )                                             # Disable auto scaling in output file
 
   iid    = Dataset(files[0], 'r')                                               # Open first input file for reading
+  nt     = iid.dimensions['time'].size                                          # Number of times per file
 
   log.debug( 'Defining dimensions' )
   for dimName in iid.dimensions:                                                # Iterate over all dimensions in input file
@@ -68,6 +252,7 @@ def fileCombine( outfile, files ):
 
 
   log.debug( 'Creating data variables' )
+  dtypes = {}
   for varName in varNames:
     atts  = parseAtts( iid[varName] )
     vid   = oid.createVariable( varName, SCALER.dtype,
@@ -76,42 +261,70 @@ def fileCombine( outfile, files ):
             fill_value = SCALER._FillValue)
     vid.set_auto_maskandscale( False )                                          # Disable auto scaling in output file
     copyAtts( iid, oid, varName, *atts )
+    dtypes[varName] = iid[varName].dtype
   
-  iid.close()                                                                   # Close in the input file
-
-  processTime = True
-  for varName in varNames:                                                      # Iterate over variable names for files to combine
-    log.debug('Working on : {}'.format(varName) )
-    data = np.empty( oid[varName].shape, 
-            dtype = iid[varName].dtype )                                        # Initialize large array to read all data into
-    tSlice = None
-    for i in range( len(files) ):                                               # Iterate over all input files
-      iid = Dataset(files[i], 'r')                                              # Open file for reading
-      nt  = iid.dimensions['time'].size                                         # Get size of time dimension
-      if tSlice is None:                                                        # If no slice is defined
-        tSlice = slice(0, nt)                                                   # Initialize slize
-      else:                                                                     # Else
-        tSlice = slice( tSlice.stop, tSlice.stop + nt )                         # Update the slice
-
-      if processTime:                                                           # If processTime set
-        tVar  = iid['time']                                                     # Read in time from file
-        dates = num2date( tVar[:], tVar.units )                                 # Scale the time based on units 
-        oid['time'][tSlice] = date2num( dates, tUnits )                         # Rescale time and write to output file
-
-
-      tmp = iid[varName][:]                                                     # Read in variable data
-      if data.ndim == 3:                                                        # If 3D
-        data[tSlice,:,:] = tmp.filled(np.nan)                                   # Write NaN to masked values and store in data array
-      else:                                                                     # Else 4d
-        data[tSlice,:,:,:] = tmp.filled(np.nan)
-
-      iid.close()                                                               # Close the input file
-    processTime = False                                                         # Set processTime to False; only want to copy data on first run through of varName iteration
-
-    data, scale, offset = SCALER.scaleData( data )                              # Scale the data
-    oid[varName].scale_factor = scale                                           # Set scale_factor attribute
-    oid[varName].add_offset   = offset                                          # Set add_offset attribute
-    oid[varName][:] = data                                                      # Write data to file
+  itemsize = max( [dtype.itemsize for dtype in dtypes.values()], default = 4 )
+  fileSize = {varName : int( np.prod( oid[varName].shape ) ) // nFiles * itemsize for varName in varNames} # Bytes of each variable per input file
+  batches, streamed = batchVariables( {varName : oid[varName].shape for varName in varNames},
+                                      itemsize, nFiles, max( 1, workers or 1 ), maxMemory, streaming )
+  pool     = ProcessPoolExecutor( max_workers = workers ) if workers and workers > 1 and nFiles > 1 else None
+  ranges   = {varName : [] for varName in streamed}                             # Range of each input file for variables packed in two passes
+
+  def checkTimes( i, n ):
+    if n != nt:
+      raise Exception( f'Number of times in {files[i]} ({n}) differs from first file ({nt})' )
+    return slice( i * nt, (i+1) * nt )
+
+  try:
+    for iBatch, batch in enumerate( batches ):                                  # Iterate over groups of variables to combine in one pass
+      log.debug( 'Working on : {}'.format( ', '.join(batch) ) )
+      data  = {varName : np.empty( oid[varName].shape, dtype = dtypes[varName] )
+                 for varName in batch}                                          # Initialize large arrays to read all data into
+      first = iBatch == 0                                                       # Only want to process time, and ranges, on first pass
+      args  = (batch, tUnits, streamed) if first else (batch,)
+
+      def store( i, result ):                                                   # Place data of file i in output arrays
+        n, times, slabs, fileRanges = result
+        tSlice = checkTimes( i, n )
+        if times is not None:
+          oid['time'][tSlice] = times                                           # Write rescaled time to output file
+        for varName, slab in slabs.items():
+          data[varName][tSlice] = slab
+        for varName, dataRange in fileRanges.items():
+          ranges[varName].append( dataRange )
+
+      held     = sum( v.nbytes for v in data.values() )
+      inflight = filesInFlight( sum( fileSize[v] for v in batch + (streamed if first else []) ),
+                                workers, maxMemory, held )
+      mapFiles( readSlabs, files, args, store, pool, inflight, iid )
+
+      for varName in batch:
+        values, scale, offset = SCALER.scaleData( data.pop(varName) )           # Scale the data
+        oid[varName].scale_factor = scale                                       # Set scale_factor attribute
+        oid[varName].add_offset   = offset                                      # Set add_offset attribute
+        oid[varName][:] = values                                                # Write data to file
+
+    if streamed:                                                                # Second pass for variables packed from their overall range
+      log.debug( 'Packing in two passes : {}'.format( ', '.join(streamed) ) )
+      packing = {}
+      for varName in streamed:
+        dataMin, dataMax  = SCALER.mergeRanges( ranges[varName] )
+        packing[varName]  = SCALER.scaleFromRange( dataMin, dataMax )
+        dtype             = dtypes[varName].type
+        oid[varName].scale_factor = dtype( packing[varName][0] )                # Set attributes as scaleData() does
+        oid[varName].add_offset   = dtype( packing[varName][1] )
+
+      def write( i, result ):                                                   # Write packed data of file i
+        n, packed = result
+        tSlice = checkTimes( i, n )
+        for varName, values in packed.items():
+          oid[varName][tSlice] = values
+
+      inflight = filesInFlight( sum( fileSize[v] for v in streamed ), workers, maxMemory )
+      mapFiles( packSlabs, files, (packing,), write, pool, inflight, iid )
+  finally:
+    if pool is not None: pool.shutdown()
+    if iid.isopen(): iid.close()
 
   oid.close()                                                                   # Close output file
  
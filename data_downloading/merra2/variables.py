@@ -1,39 +1,303 @@
+import itertools
+
 import numpy as np
 
+def strideFor( data, res ):
+  """
+  Stride that subsamples coordinate data to about the given resolution
+
+  Arguments:
+    data (ndarray) : Coordinate values; assumed evenly spaced
+    res (float) : Desired resolution in units of the coordinate
+
+  Returns:
+    int : Stride; one (1) if res is None or finer than the data
+
+  """
+
+  if res is None or data is None or data.size < 2:
+    return 1
+  return max( 1, int( round( abs(res) / abs(data[1] - data[0]) ) ) )
+
+def lonIndices( ref, data ):
+  """
+  Indices of longitudes in a range that may cross the dateline
+
+  Longitudes are taken eastward from ref.start to ref.stop, so that
+  slice(150, -120) (or, equivalently, slice(150, 240)) selects 150E
+  through 120W.
+
+  Arguments:
+    ref (slice) : Longitude range
+    data (ndarray) : Longitude values of remote data
+
+  Returns:
+    ndarray : Indices into data, in eastward order from ref.start
+
+  """
+
+  if ref.stop - ref.start >= 360.0:
+    return np.arange( data.size )
+  width  = (ref.stop - ref.start) % 360.0
+  offset = (data - ref.start) % 360.0
+  xx     = np.where( offset <= width )[0]
+  return xx[ np.argsort( offset[xx], kind='stable' ) ]
+
+def uniqueIndices( index ):
+  """Unique values of index array, keeping order of first occurrence"""
+
+  _, first = np.unique( index, return_index=True )
+  return index[ np.sort(first) ]
+
+def indexRuns( index, position ):
+  """
+  Split index array into runs that are single hyperslabs
+
+  A run is contiguous, with a constant step, in the remote index and
+  contiguous in position within the stitched output.
+
+  Arguments:
+    index (ndarray) : Indices into remote data
+    position (ndarray) : Positions of index values in stitched output
+
+  Returns:
+    list : List of (remote, local) slice tuples
+
+  """
+
+  diff = np.diff( index )
+  step = int( np.bincount( diff[diff > 0] ).argmax() ) if np.any(diff > 0) else 1
+  cut  = np.where( (diff != step) | (np.diff(position) != 1) )[0] + 1
+  runs = []
+  for idx, pos in zip( np.split(index, cut), np.split(position, cut) ):
+    runs.append( (slice( int(idx[0]), int(idx[-1])+1, step if step > 1 else None ),
+                  slice( int(pos[0]), int(pos[-1])+1 )) )
+  return runs
+
 class MERRA2Variable():
-  def __init__(self, varname, longitude=None, latitude=None, level=None, time=None):
+  def __init__(self, varname, longitude=None, latitude=None, level=None, time=None, boxes=None, name=None):
+    """
+    Arguments:
+      varname (str) : Name of variable on remote
+
+    Keyword arguments:
+      longitude (float,slice,list) : Longitude(s) to download. A slice
+        with start > stop (e.g., slice(150, -120)) crosses the dateline.
+        A list of values/slices selects several disjoint ranges.
+      latitude (float,slice,list) : Latitude(s) to download
+      level (float,slice,list) : Level(s) to download
+      time (float,slice,list) : Time(s) to download
+      boxes (list) : List of (longitude, latitude) pairs selecting
+        disjoint regions; overrides longitude and latitude. Regions are
+        stitched onto the union of their longitudes and latitudes, with
+        points outside all regions set to missing.
+      name (str) : Name of variable in local file. Default is varname.
+        Use to request the same remote variable more than once; e.g.,
+        RH at 850 hPa and RH at 400-600 hPa.
+
+    """
+
     self.varname   = varname
     self.longitude = longitude
     self.latitude  = latitude
     self.level     = level
     self.time      = time
+    self.boxes     = boxes
+    self.name      = varname if name is None else name
 
   def __repr__(self):
+    if self.name != self.varname:
+      return f'< {self.__class__.__name__} : {self.varname} as {self.name} >'
     return f'< {self.__class__.__name__} : {self.varname} >'
 
-  def _countOffset(self, ref, data):
+  def spec(self):
+    """Dictionary describing the variable selection"""
+
+    spec = {'varname'   : self.varname,
+            'longitude' : self.longitude,
+            'latitude'  : self.latitude,
+            'level'     : self.level,
+            'time'      : self.time}
+    if self.boxes is not None:
+      spec['boxes'] = self.boxes
+    if self.name != self.varname:
+      spec['name'] = self.name
+    return spec
+
+  def _countOffset(self, ref, data, stride=None):
+    if stride == 1: stride = None
     if ref is None or data is None:
-      return slice(0, data.shape[0])
+      return slice(0, data.shape[0], stride)
     elif isinstance(ref, slice):
       if ref.step is not None:                                                  # If the step is set, assume user forced the step
         return ref                                                              # Just return
       xx = np.where( (data >= ref.start) & (data <= ref.stop) )[0]
-      return slice( xx.min(), xx.max()+1 )
+      return slice( xx.min(), xx.max()+1, stride )
     else:
       xx = np.abs( data - ref ).argmin()
       return slice(xx, xx+1)
 
-  def getLonCountOffset(self, lonData=None):
-    return self._countOffset( self.longitude, lonData )
+  def _indices(self, ref, data, stride=None, wrap=False):
+    """
+    Indices of remote data selected by ref
+
+    Like _countOffset, but lists of values/ranges are allowed and, if
+    wrap is set, slices may cross the dateline.
+
+    """
+
+    if ref is None:
+      idx = np.arange( data.shape[0] )
+    elif isinstance(ref, (list, tuple)):
+      idx = uniqueIndices( np.concatenate(
+                [self._indices(r, data, wrap=wrap) for r in ref] ) )
+    elif isinstance(ref, slice):
+      if ref.step is not None:                                                  # User forced the step
+        return np.arange( data.shape[0] )[ref]
+      if wrap:
+        idx = lonIndices( ref, data )
+      else:
+        idx = np.where( (data >= ref.start) & (data <= ref.stop) )[0]
+    else:
+      idx = np.array( [np.abs( data - ref ).argmin()] )
+    if stride is not None and stride > 1:
+      idx = idx[::stride]
+    return idx
+
+  def _isHyperslab(self, lonData):
+    """Check if selection is a single hyperslab for get2DSlices/get3DSlices"""
+
+    if self.boxes is not None:
+      return False
+    for ref in (self.longitude, self.latitude, self.level, self.time):
+      if isinstance(ref, (list, tuple)):
+        return False
+    ref = self.longitude
+    if isinstance(ref, slice) and ref.step is None and lonData is not None:     # Check if range crosses the dateline
+      plain = np.where( (lonData >= ref.start) & (lonData <= ref.stop) )[0]
+      if not np.array_equal( plain, lonIndices( ref, lonData ) ):
+        return False
+    return True
+
+  def _getPieces(self, is3D, **kwargs):
+    lonData = kwargs.get('lonData', None)
+    if self._isHyperslab( lonData ):
+      return None
+
+    boxes = self.boxes or [(self.longitude, self.latitude)]
+    lead  = [self._indices( self.time, kwargs['timeData'], kwargs.get('timeStride', None) )]
+    if is3D:
+      lead.append( self._indices( self.level, kwargs['levData'], kwargs.get('levStride', None) ) )
+    lons  = [self._indices( lon, lonData, kwargs.get('lonStride', None), wrap=True ) for lon, _ in boxes]
+    lats  = [self._indices( lat, kwargs['latData'], kwargs.get('latStride', None) ) for _, lat in boxes]
+
+    lonIndex = uniqueIndices( np.concatenate( lons ) )                          # Longitudes in order given, so dateline crossing stays contiguous
+    latIndex = np.unique( np.concatenate( lats ) )
+    lonPos   = {int(x) : i for i, x in enumerate(lonIndex)}
+    latPos   = {int(x) : i for i, x in enumerate(latIndex)}
 
-  def getLatCountOffset(self, latData=None):
-    return self._countOffset( self.latitude, latData )
+    leadRuns = [indexRuns( idx, np.arange(idx.size) ) for idx in lead]
+    pieces   = []
+    for lon, lat in zip( lons, lats ):
+      latRuns = indexRuns( lat, np.array( [latPos[int(x)] for x in lat] ) )
+      lonRuns = indexRuns( lon, np.array( [lonPos[int(x)] for x in lon] ) )
+      for runs in itertools.product( *leadRuns, latRuns, lonRuns ):
+        pieces.append( (tuple(r for r, _ in runs), tuple(l for _, l in runs)) )
+    return pieces, tuple(lead) + (latIndex, lonIndex)
 
-  def getLevCountOffset(self, levData=None):
-    return self._countOffset( self.level, levData )
+  def get2DPieces(self, **kwargs):
+    """
+    Hyperslabs for a selection that is not a single hyperslab
+
+    Selections that cross the dateline, have lists of ranges, or have
+    several boxes cannot be requested as a single hyperslab. Instead,
+    they are requested as several pieces that are stitched together
+    locally.
+
+    Arguments:
+      None.
+
+    Keyword arguments:
+      Same as get2DSlices
+
+    Returns:
+      tuple : List of (remoteSlices, localSlices) pieces, where
+        localSlices give the location of the piece in the stitched
+        array, and tuple of index arrays into the remote coordinates
+        for each dimension of the stitched array. None if the
+        selection is a single hyperslab; use get2DSlices instead.
+
+    """
+
+    return self._getPieces( False, **kwargs )
+
+  def get3DPieces(self, **kwargs):
+    """
+    Hyperslabs for a selection that is not a single hyperslab
+
+    Arguments:
+      None.
+
+    Keyword arguments:
+      Same as get3DSlices
+
+    Returns:
+      tuple : See get2DPieces
+
+    """
+
+    return self._getPieces( True, **kwargs )
+
+  def getLonCountOffset(self, lonData=None, stride=None):
+    return self._countOffset( self.longitude, lonData, stride )
+
+  def getLatCountOffset(self, latData=None, stride=None):
+    return self._countOffset( self.latitude, latData, stride )
+
+  def getLevCountOffset(self, levData=None, stride=None):
+    return self._countOffset( self.level, levData, stride )
+
+  def getTimeCountOffset(self, timeData=None, stride=None):
+    return self._countOffset( self.time, timeData, stride )
+
+  def getStrides(self, lonData=None, latData=None, levData=None, timeData=None,
+        dLon=None, dLat=None, dLev=None, dTime=None, block=None):
+    """
+    Strides to apply in the remote request for a coarse fetch
+
+    Strides are chosen so that data are subsampled on the server to
+    about the requested resolution, rather than downloaded at full
+    resolution and coarsened locally. Dimensions without a resolution
+    set, or where the variable selects a single value, have a stride
+    of one (1).
+
+    Arguments:
+      None.
+
+    Keyword arguments:
+      lonData (ndarray) : Longitude values of remote data
+      latData (ndarray) : Latitude values of remote data
+      levData (ndarray) : Level values of remote data
+      timeData (ndarray) : Time values of remote data
+      dLon (float) : Desired longitude resolution
+      dLat (float) : Desired latitude resolution
+      dLev (float) : Desired level spacing, in units of levData
+      dTime (float) : Desired time spacing, in units of timeData
+      block (int) : If set, longitude and latitude strides are reduced
+        by this factor so that block x block boxes of the fetched data
+        can be averaged locally to the requested resolution
+
+    Returns:
+      dict : Strides keyed by lonStride, latStride, levStride, and
+        timeStride; may be passed directly to get2DSlices/get3DSlices
+
+    """
 
-  def getTimeCountOffset(self, timeData=None):
-    return self._countOffset( self.time, timeData )
+    block = block or 1
+    return {'lonStride'  : max( 1, strideFor( lonData, dLon ) // block ),
+            'latStride'  : max( 1, strideFor( latData, dLat ) // block ),
+            'levStride'  : strideFor( levData,  dLev  ),
+            'timeStride' : strideFor( timeData, dTime )}
 
   def get2DSlices(self, **kwargs):
     """
@@ -49,15 +313,18 @@ class MERRA2Variable():
         data downloading
       timeData (ndarray) : Array of time values to use to get slice for
         data downloading
+      lonStride (int) : Stride for longitude; see getStrides()
+      latStride (int) : Stride for latitude
+      timeStride (int) : Stride for time
 
     Returns:
       tuple : Tuple with four (4) slices for downloading
 
     """
 
-    return ( self.getTimeCountOffset( kwargs.get('timeData', None) ),
-             self.getLatCountOffset(  kwargs.get('latData',  None) ),
-             self.getLonCountOffset(  kwargs.get('lonData',  None) )
+    return ( self.getTimeCountOffset( kwargs.get('timeData', None), kwargs.get('timeStride', None) ),
+             self.getLatCountOffset(  kwargs.get('latData',  None), kwargs.get('latStride',  None) ),
+             self.getLonCountOffset(  kwargs.get('lonData',  None), kwargs.get('lonStride',  None) )
              )
 
   def get3DSlices(self, **kwargs):
@@ -74,14 +341,18 @@ class MERRA2Variable():
         data downloading
       timeData (ndarray) : Array of time values to use to get slice for
         data downloading
+      lonStride (int) : Stride for longitude; see getStrides()
+      latStride (int) : Stride for latitude
+      levStride (int) : Stride for level
+      timeStride (int) : Stride for time
 
     Returns:
       tuple : Tuple with four (4) slices for downloading
 
     """
 
-    return ( self.getTimeCountOffset( kwargs.get('timeData', None) ),
-             self.getLevCountOffset(  kwargs.get('levData',  None) ),
-             self.getLatCountOffset(  kwargs.get('latData',  None) ),
-             self.getLonCountOffset(  kwargs.get('lonData',  None) )
+    return ( self.getTimeCountOffset( kwargs.get('timeData', None), kwargs.get('timeStride', None) ),
+             self.getLevCountOffset(  kwargs.get('levData',  None), kwargs.get('levStride',  None) ),
+             self.getLatCountOffset(  kwargs.get('latData',  None), kwargs.get('latStride',  None) ),
+             self.getLonCountOffset(  kwargs.get('lonData',  None), kwargs.get('lonStride',  None) )
              )
@@ -0,0 +1,565 @@
+"""
+Asynchronous DAP2 client
+
+Requests for DDS, DAS, and binary (.dods) responses are issued with
+aiohttp over a shared connection pool, so one process can keep many
+requests in flight. Binary responses are decoded from XDR directly into
+NumPy arrays without going through pydap.
+
+The event loop runs in a background thread so that the client can be
+used from regular (synchronous) code, such as merra2downloader.
+
+"""
+import logging
+import re
+import asyncio
+import threading
+
+from http.cookiejar import LWPCookieJar
+from urllib.parse import quote
+
+import numpy as np
+
+try:
+  import aiohttp
+  from yarl import URL
+except ImportError:
+  aiohttp = None
+
+from .decode import scaleFillData
+from .pydapData import USER, PASSWD, COOKIEJAR, getSession, saveCookies, hyperslab
+from .retry import AUTH, SERVER, TIMEOUT, CLIENT, RetryPolicy, classifyError, getBreaker
+from .metadataCache import MetadataCache
+from .requestPlan import planRequests, combinable
+
+DATAMARK  = b'\nData:\n'                                                        # Separates DDS header from XDR data in .dods responses
+
+XDRTYPES  = {'byte'    : '>u1',                                                 # DAP2 type to XDR/numpy type; note 16-bit ints are sent as 32-bit
+             'int16'   : '>i4',
+             'uint16'  : '>u4',
+             'int32'   : '>i4',
+             'uint32'  : '>u4',
+             'float32' : '>f4',
+             'float64' : '>f8'}
+
+DAPTYPES  = {'byte'    : 'u1',                                                  # DAP2 type to numpy type of decoded data
+             'int16'   : 'i2',
+             'uint16'  : 'u2',
+             'int32'   : 'i4',
+             'uint32'  : 'u4',
+             'float32' : 'f4',
+             'float64' : 'f8'}
+
+DDSTOKEN  = re.compile( r'[{}\[\];:=]|[^\s{}\[\];:=]+' )
+DASATT    = re.compile( r'^\s*(\w+)\s+(\S+)\s+(.*?);\s*$' )
+DASOPEN   = re.compile( r'^\s*(.+?)\s*\{\s*$' )
+DASSTR    = re.compile( r'"((?:[^"\\]|\\.)*)"' )
+
+class DAPVariable():
+  """Variable declared in a DDS"""
+
+  def __init__(self, name, dtype, dims, maps = None):
+    self.name  = name
+    self.dtype = dtype.lower()
+    self.dims  = dims                                                           # List of (name, size) tuples
+    self.maps  = maps or []                                                     # Map vectors if variable is a Grid
+
+  def __repr__(self):
+    return f'< {self.__class__.__name__} : {self.name} >'
+
+  @property
+  def dimensions(self):
+    return tuple( name for name, _ in self.dims )
+
+  @property
+  def shape(self):
+    return tuple( size for _, size in self.dims )
+
+def parseDDS( text ):
+  """
+  Parse a DAP2 Dataset Descriptor Structure
+
+  Only base types, arrays, and grids are supported, which is all that
+  is needed for gridded data such as MERRA-2.
+
+  Arguments:
+    text (str) : DDS text
+
+  Returns:
+    list : DAPVariable instances, in the order they are declared
+
+  """
+
+  tokens = DDSTOKEN.findall( text )
+  pos    = [0]
+
+  def take( expect = None ):
+    tok     = tokens[pos[0]]
+    pos[0] += 1
+    if expect is not None and tok.lower() != expect.lower():
+      raise Exception( f'Malformed DDS; expected {expect}, got {tok}' )
+    return tok
+
+  def peek():
+    return tokens[pos[0]]
+
+  def declaration():
+    dtype = take()
+    if dtype.lower() in ('grid', 'structure', 'dataset'):
+      take('{')
+      members = []
+      while peek() != '}':
+        if peek().lower() in ('array', 'maps'):                                 # Skip Grid section labels
+          take()
+          take(':')
+          continue
+        members.extend( declaration() )
+      take('}')
+      name = take()
+      take(';')
+      if dtype.lower() == 'grid':
+        array      = members[0]
+        array.maps = members[1:]
+        return [array]
+      return members
+
+    name = take()
+    dims = []
+    while peek() == '[':
+      take('[')
+      dimName = take()
+      if peek() == '=':
+        take('=')
+        size = take()
+      else:
+        dimName, size = name, dimName                                           # Anonymous dimension
+      take(']')
+      dims.append( (dimName, int(size)) )
+    take(';')
+    return [DAPVariable( name, dtype, dims )]
+
+  return declaration()
+
+def parseDAS( text ):
+  """
+  Parse a DAP2 Dataset Attribute Structure
+
+  Arguments:
+    text (str) : DAS text
+
+  Returns:
+    dict : Attributes keyed by variable name; values are dicts of
+      attribute name/value pairs, with numeric values converted to
+      numpy types
+
+  """
+
+  out   = {}
+  stack = []
+  for line in text.splitlines():
+    if line.strip() == '}':
+      if stack: stack.pop()
+      continue
+    match = DASOPEN.match( line )
+    if match:
+      name = match.group(1)
+      if name != 'Attributes':
+        stack.append( name )
+        if len(stack) == 1: out[name] = {}
+      continue
+    match = DASATT.match( line )
+    if not match or not stack: continue
+    dtype, attName, value = match.groups()
+    if dtype.lower() in ('string', 'url'):
+      values = [v.encode().decode('unicode_escape') for v in DASSTR.findall( value )]
+    else:
+      npType = DAPTYPES.get( dtype.lower(), 'f8' )
+      values = [np.array( v.strip() ).astype( npType )[()] for v in value.split(',')]
+    out[stack[0]][attName] = values[0] if len(values) == 1 else np.asarray( values )
+  return out
+
+def decodeXDR( dds, data ):
+  """
+  Decode XDR encoded data from .dods response
+
+  Arrays are read with numpy.frombuffer so that data are decoded
+  directly from the response buffer.
+
+  Arguments:
+    dds (list) : DAPVariable instances describing the data
+    data (bytes) : XDR encoded data
+
+  Returns:
+    list : List of (values, coords) tuples, one per variable in dds,
+      where values are in native byte order and coords is a dict of grid
+      map values keyed by dimension name
+
+  """
+
+  out    = []
+  offset = 0
+  for var in dds:
+    arrays = {}
+    for item in [var] + var.maps:
+      xdr  = np.dtype( XDRTYPES[item.dtype] )
+      if len(item.dims) == 0:                                                   # Scalars are not prefixed with length
+        n = 1
+      else:
+        n       = int( np.frombuffer(data, '>u4', 1, offset)[0] )
+        offset += 8                                                             # Length is sent twice for arrays
+      values  = np.frombuffer( data, xdr, n, offset )
+      offset += values.nbytes
+      if xdr.itemsize == 1:                                                     # Bytes are padded to 4-byte boundary
+        offset += (-n) % 4
+      values  = values.astype( DAPTYPES[item.dtype] )                           # Convert to native byte order (and 16-bit types to true size)
+      arrays[item.name] = values.reshape( item.shape )
+    values = arrays.pop( var.name ) if var.maps else arrays[var.name]
+    out.append( (values, arrays if var.maps else {}) )
+  return out
+
+class AsyncDAPClient():
+  """
+  Asynchronous DAP2 client with shared connection pool
+
+  A single aiohttp session, and so connection pool, is used for all
+  requests. Authentication uses the URS cookies persisted by
+  pydapData.getSession; on a 401, a new login is performed and the
+  request retried.
+
+  """
+
+  def __init__(self, limit = 32, limit_per_host = 8, timeout = 600.0,
+        retryPolicy = None, username = USER, password = PASSWD, cookiejar = COOKIEJAR):
+    """
+    Keyword arguments:
+      limit (int) : Maximum number of open connections
+      limit_per_host (int) : Maximum number of open connections per host
+      timeout (float) : Total timeout, in seconds, for a request
+      retryPolicy (RetryPolicy) : Backoff policy for failed requests
+      username (str) : Earthdata login user name
+      password (str) : Earthdata login password
+      cookiejar (str) : Path to persisted URS cookies
+
+    """
+
+    if aiohttp is None:
+      raise Exception( 'aiohttp is required for the asynchronous DAP client' )
+
+    self.log            = logging.getLogger(__name__)
+    self.limit          = limit
+    self.limit_per_host = limit_per_host
+    self.timeout        = timeout
+    self.policy         = retryPolicy or RetryPolicy()
+    self.username       = username
+    self.password       = password
+    self.cookiejar      = cookiejar
+
+    self._session       = None
+    self._loop          = None
+    self._thread        = None
+    self._described     = set()                                                 # Collections whose DDS has been recorded in metadata cache
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+
+  def start(self):
+    """Start event loop in background thread and open session"""
+
+    self._loop   = asyncio.new_event_loop()
+    self._thread = threading.Thread( target = self._loop.run_forever, daemon = True )
+    self._thread.start()
+    self.run( self._openSession() )
+
+  def stop(self):
+    """Close session and stop event loop"""
+
+    if self._loop is None: return
+    self.run( self._session.close() )
+    self._loop.call_soon_threadsafe( self._loop.stop )
+    self._thread.join()
+    self._loop.close()
+    self._loop = self._thread = self._session = None
+
+  def submit(self, coro):
+    """
+    Schedule coroutine on client event loop
+
+    Arguments:
+      coro (coroutine) : Coroutine to run
+
+    Returns:
+      concurrent.futures.Future
+
+    """
+
+    return asyncio.run_coroutine_threadsafe( coro, self._loop )
+
+  def run(self, coro):
+    """Run coroutine on client event loop and wait for result"""
+
+    return self.submit( coro ).result()
+
+  async def _openSession(self):
+    connector     = aiohttp.TCPConnector( limit = self.limit, limit_per_host = self.limit_per_host )
+    self._session = aiohttp.ClientSession(
+      connector  = connector,
+      timeout    = aiohttp.ClientTimeout( total = self.timeout ),
+      cookie_jar = aiohttp.CookieJar(),
+    )
+    self._loadCookies()
+
+  def _loadCookies(self):
+    """Load persisted URS cookies into aiohttp session"""
+
+    jar = LWPCookieJar( self.cookiejar )
+    try:
+      jar.load( ignore_discard = True )
+    except Exception as err:
+      self.log.debug( f'Failed to load cookies: {err}' )
+      return
+    for cookie in jar:
+      self._session.cookie_jar.update_cookies(
+        {cookie.name : cookie.value},
+        response_url = URL( f'https://{cookie.domain.lstrip(".")}/' ) )
+
+  async def _login(self, url):
+    """Perform new URS login, in executor, and reload cookies"""
+
+    def login():
+      session = getSession( url, self.username, self.password, refresh = True, cookiejar = self.cookiejar )
+      saveCookies( session, self.cookiejar )
+    await asyncio.get_running_loop().run_in_executor( None, login )
+    self._loadCookies()
+
+  async def get(self, url):
+    """
+    Get URL with retries
+
+    Arguments:
+      url (str) : URL to get
+
+    Returns:
+      bytes : Response body
+
+    """
+
+    breaker = getBreaker( url )
+    attempt = 0
+    while True:
+      attempt += 1
+      while breaker.isOpen():                                                   # Pause while circuit open for host
+        await asyncio.sleep( 5.0 )
+      try:
+        async with self._session.get( url ) as resp:
+          if resp.status == 401 or 'urs.earthdata' in resp.url.host:            # Redirected to login, so cookies are no good
+            raise aiohttp.ClientResponseError( resp.request_info, resp.history, status = 401 )
+          resp.raise_for_status()
+          body = await resp.read()
+      except Exception as err:
+        kind = classifyError( err )
+        self.log.warning( f'Attempt {attempt:2d} of {self.policy.retries:2d} - Failed to get {url} ({kind}) : {err}' )
+        if kind == CLIENT or attempt >= self.policy.retries:
+          raise
+        if kind == AUTH:
+          await self._login( url )
+          continue
+        if kind in (SERVER, TIMEOUT):
+          breaker.failure()
+        await asyncio.sleep( self.policy.delay( attempt ) )
+      else:
+        breaker.success()
+        return body
+
+  async def getDDS(self, url, ce = ''):
+    """Get and parse DDS for URL; optionally constrained"""
+
+    body = await self.get( f'{url}.dds?{quote(ce, safe=",:")}' if ce else f'{url}.dds' )
+    return parseDDS( body.decode() )
+
+  async def getDAS(self, url):
+    """Get and parse DAS for URL"""
+
+    body = await self.get( f'{url}.das' )
+    return parseDAS( body.decode() )
+
+  async def getData(self, url, request):
+    """
+    Get data for many variables in a single .dods request
+
+    Arguments:
+      url (str) : URL of remote dataset
+      request (list) : List of (varName, slices) tuples. If slices is
+        None, the full variable is requested.
+
+    Returns:
+      list : List of (values, coords) tuples, in same order as request,
+        where coords is a dict of grid map values keyed by dimension
+        name
+
+    Raises:
+      ValueError : If a variable is requested more than once
+
+    """
+
+    names = [name for name, _ in request]
+    if len(set(names)) != len(names):                                           # Response is keyed by name, so cannot request same variable twice
+      raise ValueError( 'Variable requested more than once : {}'.format( ', '.join(names) ) )
+    ce    = ','.join( name if slices is None else name + hyperslab(slices)
+                      for name, slices in request )
+    self.log.info( f'Getting data : {ce}' )
+    body  = await self.get( f'{url}.dods?{quote(ce, safe=",:")}' )
+    index = body.find( DATAMARK )
+    if index < 0:
+      raise Exception( f'Malformed DAP response : {url}' )
+    dds     = parseDDS( body[:index].decode() )
+    decoded = dict( zip( [var.name for var in dds],
+                         decodeXDR( dds, memoryview(body)[index + len(DATAMARK):] ) ) ) # Server sends variables in dataset order, not request order
+    missing = [name for name in names if name not in decoded]
+    if missing:
+      raise Exception( 'Variables missing from DAP response : {}'.format( ', '.join(missing) ) )
+    return [decoded[name] for name in names]
+
+  async def prefetch(self, esdt, date, variables, resolution=None):
+    """
+    Get metadata, coordinates, and data for a MERRA-2 granule
+
+    The DDS, DAS, and coordinate variables are requested concurrently.
+    Slices for each variable are then computed and all variables are
+    requested in a single .dods request.
+
+    Arguments:
+      esdt (EarthScienceDataType) : ESDT of granule
+      date (datetime) : Date of granule
+      variables (list) : MERRA2Variable instances to get
+
+    Keyword arguments:
+      resolution (dict) : Coarse fetch resolution, passed to
+        MERRA2Variable.getStrides(); see merra2downloader.downloader
+
+    Returns:
+      DAPGranule : Granule data with a PyDAPDataset compatible interface
+
+    """
+
+    url    = esdt.getFullURL( date )
+    coords = [esdt.lonVar, esdt.latVar, esdt.timeVar]
+    if not esdt.is2D: coords.insert( 2, esdt.levVar )
+    dds, das, crd = await asyncio.gather(
+      self.getDDS( url ),
+      self.getDAS( url ),
+      self.getData( url, [(name, None) for name in coords] ),
+    )
+    granule = DAPGranule( self, url, dds, das )
+    for name, (values, _) in zip( coords, crd ):
+      granule.values[(name, None)] = values
+    self._describe( esdt, granule )
+
+    kwargs = {'lonData'  : granule.values[(esdt.lonVar,  None)],
+              'latData'  : granule.values[(esdt.latVar,  None)],
+              'timeData' : granule.values[(esdt.timeVar, None)]}
+    if not esdt.is2D:
+      kwargs['levData'] = granule.values[(esdt.levVar, None)]
+    if resolution and len(variables) > 0:
+      kwargs.update( variables[0].getStrides( **kwargs, **resolution ) )
+    if not esdt.is2D:
+      variables = [var for var in variables if var.get3DPieces( **kwargs ) is None] # Stitched selections are requested in pieces by downloader
+      request   = [(var.varname, var.get3DSlices( **kwargs )) for var in variables]
+    else:
+      variables = [var for var in variables if var.get2DPieces( **kwargs ) is None]
+      request   = [(var.varname, var.get2DSlices( **kwargs )) for var in variables]
+
+    fetches = planRequests( request )                                           # Same plan as downloader, so the combined request matches
+    request = [fetches[i][:2] for i in combinable( fetches )]
+    if request:
+      granule.combined = (request, await self.getData( url, request ))
+    return granule
+
+  def _describe(self, esdt, granule):
+    """Record variables of collection in metadata cache, once per client"""
+
+    if esdt.shortName in self._described:
+      return
+    self._described.add( esdt.shortName )
+    cache = MetadataCache( esdt.shortName, exclude = (esdt.timeVar,) )
+    if cache.getDDS() is None:
+      cache.setDDS( {name : (var.dimensions, var.shape, DAPTYPES[var.dtype])
+                      for name, var in granule.dds.items()} )
+      for (name, _), values in granule.values.items():                          # Coordinates; time is excluded by cache
+        cache.setValues( name, values )
+      cache.save()
+
+class DAPGranule():
+  """
+  Prefetched remote granule
+
+  Provides the same interface as pydapData.PyDAPDataset so that it can
+  be passed to merra2downloader.downloader as the remote. Prefetched
+  data are returned directly; anything else is requested through the
+  client.
+
+  """
+
+  def __init__(self, client, url, dds, das):
+    self.log      = logging.getLogger(__name__)
+    self.client   = client
+    self.url      = url
+    self.dds      = {var.name : var for var in dds}
+    for var in dds:
+      for item in var.maps:
+        self.dds.setdefault( item.name, item )
+    self.das      = das
+    self.values   = {}                                                          # Prefetched values keyed by (name, slices)
+    self.combined = None                                                        # Prefetched (request, data) for combined request
+
+  def close(self):
+    """Release prefetched data"""
+
+    self.values   = {}
+    self.combined = None
+
+  def fullSlices(self, varName):
+    """Slices covering the full extent of a remote variable"""
+
+    return tuple( slice(0, n) for n in self.dds[varName].shape )
+
+  def getVarAtts(self, varName, retry = None):
+    if varName not in self.dds:
+      return None
+    atts = dict( self.das.get( varName, {} ) )
+    atts['dimensions'] = self.dds[varName].dimensions
+    return atts
+
+  def getValues(self, varName, slices = None, retry = None):
+    if slices is None and (varName, None) in self.values:
+      return self.values[(varName, None)]
+    if slices is not None and (varName, None) in self.values:
+      return self.values[(varName, None)][slices if isinstance(slices, slice) else tuple(slices)]
+    try:
+      return self.client.run( self.client.getData( self.url, [(varName, slices)] ) )[0][0]
+    except Exception as err:
+      self.log.error( f'Failed to get data : {err}' )
+      return None
+
+  def getValuesCombined(self, request):
+    if self.combined is not None and self.combined[0] == list(request):
+      data, self.combined = self.combined[1], None                              # Data are only used once, so release reference
+      return data
+    try:
+      return self.client.run( self.client.getData( self.url, request ) )
+    except Exception as err:
+      self.log.warning( f'Failed to get combined request : {err}' )
+      return None
+
+  def getVar(self, varName, slices = None, scaleandfill = False):
+    atts = self.getVarAtts( varName )
+    if atts is not None:
+      values = self.getValues( varName, slices = slices )
+      if values is not None:
+        if scaleandfill:
+          return scaleFillData( values, atts, inplace = True ), atts
+        return values, atts
+    return None, None
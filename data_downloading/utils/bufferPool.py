@@ -0,0 +1,58 @@
+import numpy as np
+
+class BufferPool():
+  """
+  Pool of reusable numpy work buffers
+
+  Buffers are stored by name as flat arrays that only grow, so that a
+  buffer can be reused for arrays of any shape that fit in it. This
+  avoids allocating new full-size arrays for every variable and granule
+  being processed.
+
+  Note that arrays returned by get() are views into the pool; they are
+  only valid until the next call to get() with the same name.
+
+  """
+
+  def __init__(self):
+    self._buffers = {}
+
+  def __len__(self):
+    return len(self._buffers)
+
+  @property
+  def nbytes(self):
+    """Total bytes held by the pool"""
+
+    return sum( buf.nbytes for buf in self._buffers.values() )
+
+  def get(self, name, shape, dtype):
+    """
+    Get work buffer
+
+    Arguments:
+      name (str) : Name of the buffer
+      shape (tuple) : Shape of the array to return
+      dtype (numpy.dtype) : Data type of the array to return
+
+    Returns:
+      numpy.ndarray : Uninitialized array of given shape and type
+
+    """
+
+    dtype = np.dtype( dtype )
+    size  = int( np.prod( shape ) ) * dtype.itemsize
+    buf   = self._buffers.get( name, None )
+    if buf is None or buf.size < size:                                          # Only allocate if no buffer or current is too small
+      buf = self._buffers[name] = np.empty( size, dtype = np.uint8 )
+    return buf[:size].view( dtype ).reshape( shape )
+
+  def owns(self, array):
+    """Check if array may be a view into a buffer of the pool"""
+
+    return any( np.may_share_memory( array, buf ) for buf in self._buffers.values() )
+
+  def clear(self):
+    """Release all buffers"""
+
+    self._buffers.clear()
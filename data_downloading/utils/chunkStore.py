@@ -0,0 +1,492 @@
+"""
+Appendable chunked array store
+
+Arrays are stored using the Zarr (version 2) directory layout: each
+array is a directory with .zarray/.zattrs JSON metadata and one zlib
+compressed file per chunk, and all metadata are consolidated into a
+.zmetadata file at the top level. Dimension names are stored in the
+_ARRAY_DIMENSIONS attribute so that the store can be opened lazily with
+zarr or xarray (e.g., xarray.open_zarr(path, consolidated=True)), but
+neither package is required to write it.
+
+"""
+import logging
+import os
+import json
+import zlib
+import itertools
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+  import fcntl
+except ImportError:                                                             # Not available on Windows; metadata updates are then not locked
+  fcntl = None
+
+ZGROUP    = '.zgroup'
+ZARRAY    = '.zarray'
+ZATTRS    = '.zattrs'
+ZMETADATA = '.zmetadata'
+LOCKFILE  = '.lock'
+DIMSATT   = '_ARRAY_DIMENSIONS'
+
+def jsonValue( val ):
+  """Convert attribute or fill value to JSON serializable type"""
+
+  if isinstance(val, np.ndarray):
+    return [jsonValue(v) for v in val.tolist()] if val.ndim > 0 else jsonValue( val.item() )
+  if isinstance(val, np.generic):
+    val = val.item()
+  if isinstance(val, (list, tuple)):
+    return [jsonValue(v) for v in val]
+  if isinstance(val, float) and not np.isfinite(val):                           # Zarr spec encodes these as strings
+    return 'NaN' if np.isnan(val) else ('Infinity' if val > 0 else '-Infinity')
+  if isinstance(val, bytes):
+    return val.decode()
+  return val
+
+class ChunkStore():
+  """
+  Chunked array store that can be appended to by many processes
+
+  Chunks are written directly to their own files, so writers working on
+  different chunks do not interfere. Changes to metadata (e.g., growing
+  an array) are made under a file lock.
+
+  """
+
+  def __init__(self, path, compression = 1):
+    """
+    Arguments:
+      path (str) : Path to store directory; created if not exist
+
+    Keyword arguments:
+      compression (int) : zlib compression level for chunks; zero (0)
+        to disable compression
+
+    """
+
+    self.log         = logging.getLogger(__name__)
+    self.path        = path
+    self.compression = compression
+    os.makedirs( path, exist_ok = True )
+    with self.lock():
+      if not os.path.isfile( self._key(ZGROUP) ):
+        self._writeJSON( ZGROUP, {'zarr_format' : 2} )
+        self._writeJSON( ZATTRS, {} )
+
+  def __contains__(self, name):
+    return os.path.isfile( self._key(name, ZARRAY) )
+
+  def _key(self, *args):
+    return os.path.join( self.path, *args )
+
+  def _readJSON(self, *args, default = None):
+    try:
+      with open(self._key(*args), 'r') as fid:
+        return json.load( fid )
+    except FileNotFoundError:
+      return default
+
+  def _writeJSON(self, *args):
+    *key, obj = args
+    path = self._key( *key )
+    tmp  = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as fid:
+      json.dump( obj, fid, indent = 2, sort_keys = True )
+    os.replace( tmp, path )
+
+  @contextmanager
+  def lock(self):
+    """Hold exclusive lock on store metadata"""
+
+    if fcntl is None:
+      yield
+      return
+    with open(self._key(LOCKFILE), 'a') as fid:
+      fcntl.flock( fid, fcntl.LOCK_EX )
+      try:
+        yield
+      finally:
+        fcntl.flock( fid, fcntl.LOCK_UN )
+
+  @property
+  def attrs(self):
+    """Attributes of the store"""
+
+    return self._readJSON( ZATTRS, default = {} )
+
+  def arrays(self):
+    """Names of arrays in the store"""
+
+    return sorted( name for name in os.listdir(self.path) if name in self )
+
+  def getAttrs(self, name):
+    """Attributes of array, without the dimension names"""
+
+    atts = self._readJSON( name, ZATTRS, default = {} )
+    atts.pop( DIMSATT, None )
+    return atts
+
+  def setAttrs(self, attrs, name = None):
+    """
+    Update attributes of store or array
+
+    Arguments:
+      attrs (dict) : Attributes to set
+
+    Keyword arguments:
+      name (str) : Name of array; if None, store attributes are set
+
+    """
+
+    key = (ZATTRS,) if name is None else (name, ZATTRS)
+    with self.lock():
+      atts = self._readJSON( *key, default = {} )
+      atts.update( {att : jsonValue(val) for att, val in attrs.items()} )
+      self._writeJSON( *key, atts )
+
+  def meta(self, name):
+    """Array metadata; shape, chunks, dtype, etc."""
+
+    meta = self._readJSON( name, ZARRAY )
+    if meta is None:
+      raise KeyError( f'No array named {name} in {self.path}' )
+    meta['dimensions'] = self._readJSON( name, ZATTRS, default = {} ).get( DIMSATT, [] )
+    return meta
+
+  def createArray(self, name, shape, dtype, chunks, dimensions, fill_value = None, attrs = None):
+    """
+    Create array in store if it does not exist
+
+    Arguments:
+      name (str) : Name of array
+      shape (tuple) : Initial shape of array
+      dtype (numpy.dtype) : Data type of array
+      chunks (tuple) : Shape of chunks
+      dimensions (tuple) : Dimension names
+
+    Keyword arguments:
+      fill_value : Value for elements that have not been written
+      attrs (dict) : Array attributes
+
+    Returns:
+      None.
+
+    """
+
+    with self.lock():
+      if name in self: return
+      os.makedirs( self._key(name), exist_ok = True )
+      compressor = None
+      if self.compression > 0:
+        compressor = {'id' : 'zlib', 'level' : self.compression}
+      self._writeJSON( name, ZARRAY, {
+        'zarr_format'         : 2,
+        'shape'               : [int(n) for n in shape],
+        'chunks'              : [int(n) for n in chunks],
+        'dtype'               : np.dtype(dtype).str,
+        'compressor'          : compressor,
+        'fill_value'          : jsonValue( fill_value ),
+        'filters'             : None,
+        'order'               : 'C',
+        'dimension_separator' : '.'} )
+      atts = {att : jsonValue(val) for att, val in (attrs or {}).items()}
+      atts[DIMSATT] = list( dimensions )
+      self._writeJSON( name, ZATTRS, atts )
+
+  def resize(self, name, shape):
+    """Grow array so it is at least the given shape"""
+
+    with self.lock():
+      meta  = self._readJSON( name, ZARRAY )
+      shape = [max(int(a), int(b)) for a, b in zip( meta['shape'], shape )]
+      if shape != meta['shape']:
+        meta['shape'] = shape
+        self._writeJSON( name, ZARRAY, meta )
+
+  def _fill(self, meta):
+    fill = meta['fill_value']
+    if isinstance(fill, str):
+      fill = float(fill.replace('Infinity', 'inf'))
+    return 0 if fill is None else fill
+
+  def _readChunk(self, name, meta, key):
+    path = self._key( name, '.'.join( map(str, key) ) )
+    if not os.path.isfile( path ):
+      return np.full( meta['chunks'], self._fill(meta), dtype = meta['dtype'] )
+    with open(path, 'rb') as fid:
+      data = fid.read()
+    if meta['compressor'] is not None:
+      data = zlib.decompress( data )
+    return np.frombuffer( data, dtype = meta['dtype'] ).reshape( meta['chunks'] ).copy()
+
+  def _writeChunk(self, name, meta, key, chunk):
+    path = self._key( name, '.'.join( map(str, key) ) )
+    data = np.ascontiguousarray( chunk, dtype = meta['dtype'] ).tobytes()
+    if meta['compressor'] is not None:
+      data = zlib.compress( data, meta['compressor'].get('level', 1) )
+    tmp  = f'{path}.{os.getpid()}'
+    with open(tmp, 'wb') as fid:
+      fid.write( data )
+    os.replace( tmp, path )
+
+  def _bounds(self, index, shape):
+    """Convert index to start/stop of each dimension"""
+
+    if index is None or index is Ellipsis:
+      index = ()
+    elif not isinstance(index, tuple):
+      index = (index,)
+    bounds = []
+    for i, n in enumerate( shape ):
+      s = index[i] if i < len(index) else slice(None)
+      if isinstance(s, slice):
+        if s.step not in (None, 1):
+          raise ValueError( 'Strided access is not supported' )
+        start = 0 if s.start is None else s.start
+        stop  = n if s.stop  is None else s.stop
+      else:
+        start, stop = int(s), int(s)+1
+      bounds.append( (start, stop) )
+    return bounds
+
+  def _chunkRanges(self, bounds, chunks):
+    return [range(start // c, (stop - 1) // c + 1) for (start, stop), c in zip(bounds, chunks)]
+
+  def write(self, name, index, values):
+    """
+    Write values to region of array
+
+    The array is grown if the region extends beyond its current shape.
+    Chunks only partly covered by the region are read and updated.
+
+    Arguments:
+      name (str) : Name of array
+      index (tuple) : Slices, or integers, giving region to write
+      values (numpy.ndarray) : Values to write; broadcast to region
+
+    Returns:
+      None.
+
+    """
+
+    meta   = self.meta( name )
+    bounds = self._bounds( index, meta['shape'] )
+    if any( stop > n for (_, stop), n in zip(bounds, meta['shape']) ):
+      self.resize( name, [stop for _, stop in bounds] )
+    shape  = [stop - start for start, stop in bounds]
+    values = np.asarray( values )
+    if values.size == np.prod( shape ):                                         # Allow dimensions of length one (1) to be dropped, as in netCDF4
+      values = values.reshape( shape )
+    values = np.broadcast_to( values, shape )
+    chunks = meta['chunks']
+    for key in itertools.product( *self._chunkRanges( bounds, chunks ) ):
+      src = []
+      dst = []
+      for k, (start, stop), c in zip( key, bounds, chunks ):
+        lo, hi = max(start, k*c), min(stop, (k+1)*c)
+        src.append( slice(lo - start, hi - start) )
+        dst.append( slice(lo - k*c,   hi - k*c) )
+      full = all( d.start == 0 and d.stop == c for d, c in zip(dst, chunks) )
+      if full:
+        chunk = values[ tuple(src) ]
+      else:
+        chunk = self._readChunk( name, meta, key )
+        chunk[ tuple(dst) ] = values[ tuple(src) ]
+      self._writeChunk( name, meta, key, chunk )
+
+  def read(self, name, index = None):
+    """
+    Read region of array
+
+    Arguments:
+      name (str) : Name of array
+
+    Keyword arguments:
+      index (tuple) : Slices, or integers, giving region to read
+
+    Returns:
+      numpy.ndarray : Values; integer indices are not dropped
+
+    """
+
+    meta   = self.meta( name )
+    bounds = self._bounds( index, meta['shape'] )
+    chunks = meta['chunks']
+    out    = np.empty( [stop - start for start, stop in bounds], dtype = meta['dtype'] )
+    for key in itertools.product( *self._chunkRanges( bounds, chunks ) ):
+      src = []
+      dst = []
+      for k, (start, stop), c in zip( key, bounds, chunks ):
+        lo, hi = max(start, k*c), min(stop, (k+1)*c)
+        dst.append( slice(lo - start, hi - start) )
+        src.append( slice(lo - k*c,   hi - k*c) )
+      out[ tuple(dst) ] = self._readChunk( name, meta, key )[ tuple(src) ]
+    return out
+
+  def consolidate(self):
+    """Write all metadata to a single .zmetadata file"""
+
+    with self.lock():
+      metadata = {ZGROUP : self._readJSON( ZGROUP ),
+                  ZATTRS : self._readJSON( ZATTRS, default = {} )}
+      for name in self.arrays():
+        metadata[f'{name}/{ZARRAY}'] = self._readJSON( name, ZARRAY )
+        metadata[f'{name}/{ZATTRS}'] = self._readJSON( name, ZATTRS, default = {} )
+      self._writeJSON( ZMETADATA, {'zarr_consolidated_format' : 1, 'metadata' : metadata} )
+
+class StoreDimension():
+  def __init__(self, name, size):
+    self.name = name
+    self.size = size
+
+  def __len__(self):
+    return self.size
+
+class StoreVariable():
+  """netCDF4.Variable-like view of array in a StoreGranule"""
+
+  def __init__(self, granule, name):
+    self._granule = granule
+    self._store   = granule.store
+    self.name     = name
+    meta          = self._store.meta( name )
+    self.dtype    = np.dtype( meta['dtype'] )
+    self.dimensions = tuple( meta['dimensions'] )
+
+  @property
+  def shape(self):
+    dims = self._granule.dimensions
+    return tuple( len(dims[d]) for d in self.dimensions )
+
+  def ncattrs(self):
+    return list( self._store.getAttrs( self.name ).keys() )
+
+  def getncattr(self, attName):
+    return self._store.getAttrs( self.name )[attName]
+
+  def setncattr(self, attName, attVal):
+    if self.name == self._granule.appendDim and attName == 'units':             # Granule units are only used to convert values to store units
+      self._granule.units[self.name] = attVal
+      return
+    self._store.setAttrs( {attName : attVal}, name = self.name )
+
+  def _storeIndex(self, index):
+    """Shift granule index to location of granule in store"""
+
+    bounds = self._store._bounds( index, self.shape )
+    out    = []
+    for dim, (start, stop) in zip( self.dimensions, bounds ):
+      if dim == self._granule.appendDim:
+        start += self._granule.offset
+        stop  += self._granule.offset
+      out.append( slice(start, stop) )
+    return tuple( out )
+
+  def __setitem__(self, index, values):
+    if self.name == self._granule.appendDim:                                    # Coordinate of append dimension
+      values = self._granule.convert( values, self._granule.units.get(self.name, None) )
+      self._granule.written[self.name] = np.asarray( values )
+    self._store.write( self.name, self._storeIndex( index ), values )
+
+  def __getitem__(self, index):
+    return self._store.read( self.name, self._storeIndex( index ) )
+
+class StoreGranule():
+  """
+  netCDF4.Dataset-like view of one granule of a ChunkStore
+
+  Allows code written to create a netCDF file for a granule to instead
+  write the granule into a store that holds the whole record. Arrays
+  along the append dimension (e.g., time) are written at the offset of
+  the granule in the store, with one chunk per granule, so granules can
+  be written in any order and by many processes.
+
+  """
+
+  def __init__(self, store, appendDim, offset, units = None, convert = None):
+    """
+    Arguments:
+      store (ChunkStore) : Store to write to
+      appendDim (str) : Name of dimension granules are appended along
+      offset (int) : Index of first element of granule along appendDim
+
+    Keyword arguments:
+      units (str) : Units of append coordinate in the store
+      convert (callable) : Function called as convert(values, units)
+        to convert append coordinate values, in the granule units, to
+        the store units
+
+    """
+
+    self.store     = store
+    self.appendDim = appendDim
+    self.offset    = offset
+    self.convert   = convert or (lambda values, units : values)
+    self.units     = {}                                                         # Units of append coordinate in granule
+    self.written   = {}                                                         # Append coordinate values, in store units, written by this granule
+    self._units    = units
+    self._created  = set()
+
+  @property
+  def dimensions(self):
+    dims = self.store.attrs.get( 'dimensions', {} )
+    return {name : StoreDimension(name, size) for name, size in dims.items()
+              if name != self.appendDim or name in self._created}                # Append dimension is only known once this granule creates it
+
+  @property
+  def variables(self):
+    out = {}
+    for name in self.store.arrays():
+      if name == self.appendDim and name not in self.written:                   # Append coordinate is only known once this granule writes it
+        continue
+      out[name] = StoreVariable( self, name )
+    return out
+
+  def createDimension(self, name, size):
+    with self.store.lock():
+      atts = self.store._readJSON( ZATTRS, default = {} )
+      dims = atts.setdefault( 'dimensions', {} )
+      dims.setdefault( name, int(size) )                                        # Size of append dimension is per granule
+      self.store._writeJSON( ZATTRS, atts )
+    self._created.add( name )
+    return StoreDimension( name, size )
+
+  def createVariable(self, name, dtype, dimensions, fill_value = None, **kwargs):
+    """
+    Create array in the store
+
+    Chunks span the full size of the last two dimensions and one
+    granule along the append dimension; any other dimensions (e.g.,
+    level) are chunked one element at a time.
+
+    """
+
+    dims   = self.dimensions
+    shape  = []
+    chunks = []
+    for i, dim in enumerate( dimensions ):
+      n = len( dims[dim] )
+      if dim == self.appendDim:
+        shape.append( self.offset + n )
+        chunks.append( n )
+      else:
+        shape.append( n )
+        chunks.append( n if (i >= len(dimensions) - 2 or len(dimensions) == 1) else 1 )
+    attrs = {}
+    if name == self.appendDim and self._units is not None:
+      attrs['units'] = self._units
+    self.store.createArray( name, shape, dtype, chunks, dimensions,
+                            fill_value = fill_value, attrs = attrs )
+    return StoreVariable( self, name )
+
+  def set_auto_maskandscale(self, flag):
+    pass
+
+  def sync(self):
+    pass
+
+  def close(self):
+    self.store.consolidate()
@@ -1,6 +1,19 @@
+import warnings
+
 import numpy as np
 
 class DataScaler():
+  """
+  Pack floating point data into integers with scale_factor and add_offset
+
+  Data that fit in memory are packed with scaleData(). Data too large to
+  hold at once can be packed in two passes over chunks of the data:
+  collect the range of each chunk with dataRange(), merge the ranges
+  with mergeRanges() and compute the packing with scaleFromRange(), then
+  pack each chunk with packData() using that packing. The result is the
+  same as scaleData() on the whole array.
+
+  """
 
   def __init__(self, nbytes = 2, signed=True):
     """
@@ -112,6 +125,60 @@ class DataScaler():
 
     return -(self._oMin*scale - dataMin)
 
+  def dataRange(self, data):
+    """
+    Range of data, ignoring missing values
+
+    Arguments:
+      data (numpy.ndarray, numpy.ma.MaskedArray) : Data, or chunk of
+        data, to pack
+
+    Returns:
+      tuple : Minimum and maximum of data; NaN if all values missing
+
+    """
+
+    if isinstance( data, np.ma.core.MaskedArray ):
+      data = data.filled( np.nan )
+    with warnings.catch_warnings():
+      warnings.simplefilter( 'ignore', RuntimeWarning )                         # All-NaN chunks are allowed
+      return np.nanmin(data), np.nanmax(data)
+
+  def mergeRanges(self, ranges):
+    """
+    Merge ranges of chunks of data
+
+    Arguments:
+      ranges (list) : (min, max) tuples from dataRange()
+
+    Returns:
+      tuple : Minimum and maximum over all chunks; NaN if all missing
+
+    """
+
+    ranges = [(dMin, dMax) for dMin, dMax in ranges if not np.isnan(dMin)]
+    if len(ranges) == 0:
+      return np.nan, np.nan
+    return min( r[0] for r in ranges ), max( r[1] for r in ranges )
+
+  def scaleFromRange(self, dataMin, dataMax):
+    """
+    Scale factor and add offset for data with given range
+
+    Arguments:
+      dataMin (int,float) : Minimum value of data to scale
+      dataMax (int,float) : Maximum value of data to scale
+
+    Returns:
+      tuple : Scale factor and add offset, for packData(); cast them to
+        the data type of the data for the file attributes
+
+    """
+
+    scale  = self.computeScale( dataMin, dataMax )
+    offset = self.computeOffset( dataMin, scale )
+    return scale, offset
+
   def packData(self, data, scale, offset):
     """
     Pack the data in the specified number of bytes
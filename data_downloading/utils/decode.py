@@ -0,0 +1,144 @@
+"""
+Decode raw variable values from remote granules
+
+Values arrive in big-endian order, possibly packed (scale_factor and
+add_offset) and with fill or missing values. The routines here convert
+them with as few full-size copies as possible: the byte swap is done in
+place when the array is writable, and masking, scaling, and offset are
+applied in one pass over the data in cache-sized blocks, writing into
+the input array or a caller-supplied buffer.
+
+"""
+import logging
+import sys
+
+import numpy as np
+
+LITTLEEND = sys.byteorder == 'little'
+NATIVE    = LITTLEEND and '<' or '>'
+SWAPPED   = LITTLEEND and '>' or '<'
+BLOCKSIZE = 2**16                                                               # Elements decoded at a time; scratch arrays of this size stay in cache
+
+def nativeByteOrder( values, inplace = False ):
+  """
+  Convert array to native byte order, if needed
+
+  Arguments:
+    values (numpy.ndarray) : Array to convert
+
+  Keyword arguments:
+    inplace (bool) : If set, and values are writable, bytes are swapped
+      in place and a view of values is returned; otherwise a converted
+      copy is returned
+
+  Returns:
+    numpy.ndarray
+
+  """
+
+  if values.dtype.byteorder != SWAPPED:
+    return values
+  dtype = values.dtype.newbyteorder( NATIVE )
+  if inplace and values.flags.writeable:
+    return values.byteswap( inplace = True ).view( dtype )
+  return values.astype( dtype )
+
+def missingValues( atts ):
+  """List of fill and missing values given in variable attributes"""
+
+  values = []
+  for key in ('_FillValue', 'missing_value'):
+    if key in atts:
+      values.extend( val for val in np.ravel( atts[key] ).tolist() if val not in values )
+  return values
+
+def hasMissing( data, missing, blockSize = BLOCKSIZE ):
+  """Check if any element of data is one of the missing values"""
+
+  flat = data.reshape(-1)
+  for start in range( 0, flat.size, blockSize ):
+    block = flat[start:start+blockSize]
+    if any( np.any( block == value ) for value in missing ):
+      return True
+  return False
+
+def decodedType( data, atts ):
+  """Data type of values after scaling"""
+
+  if 'scale_factor' in atts and 'add_offset' in atts:
+    return np.result_type( data.dtype, atts['scale_factor'], atts['add_offset'] )
+  return data.dtype
+
+def scaleFillData( data, atts, fillValue = None, out = None, inplace = False, blockSize = BLOCKSIZE ):
+  """
+  Scale packed values and replace fill and missing values
+
+  Values equal to the _FillValue or missing_value attributes are
+  replaced with fillValue; if scale_factor and add_offset are given,
+  other values are scaled. Integer data with missing values, but no
+  scaling, are converted to float32.
+
+  All steps are done in a single pass over the data, one block at a
+  time, so no full-size temporary arrays are made; the only full-size
+  array allocated is the output, when it is not given and data cannot
+  be decoded in place.
+
+  Arguments:
+    data (numpy.ndarray) : Raw values, in native byte order
+    atts (dict) : Variable attributes
+
+  Keyword arguments:
+    fillValue (float) : Value for missing data; NaN if None
+    out (numpy.ndarray) : C-contiguous array, with same shape as data,
+      to write decoded values to
+    inplace (bool) : If set, and out is None, data are decoded in place
+      when the data type does not change
+    blockSize (int) : Number of elements decoded at a time
+
+  Returns:
+    numpy.ndarray : Decoded values; out if given
+
+  """
+
+  log     = logging.getLogger(__name__)
+  missing = missingValues( atts )
+  scale   = 'scale_factor' in atts and 'add_offset' in atts
+  if out is None:
+    dtype = decodedType( data, atts )
+    if not missing and not scale:
+      return data
+    if missing and dtype.kind != 'f' and hasMissing( data, missing, blockSize ):
+      log.debug( 'Converting data to floating point array' )
+      dtype = np.dtype( np.float32 )
+    if inplace and dtype == data.dtype and data.flags.writeable:
+      out = data
+    else:
+      out = np.empty( data.shape, dtype = dtype )
+  elif out.shape != data.shape or not out.flags.c_contiguous:
+    raise ValueError( 'Output buffer must be C-contiguous with shape {}'.format( data.shape ) )
+
+  if not data.flags.c_contiguous:
+    data = np.ascontiguousarray( data )
+  src     = data.reshape(-1)
+  dst     = out.reshape(-1)
+  copy    = not np.shares_memory( src, dst )
+  value   = np.nan if fillValue is None else fillValue
+  bad     = np.empty( min(blockSize, src.size), dtype = bool )
+  tmp     = np.empty_like( bad ) if len(missing) > 1 else None
+  log.debug( 'Decoding {} values; {} missing values, scaling {}'.format( src.size, missing, scale ) )
+  for start in range( 0, src.size, blockSize ):
+    s = src[start:start+blockSize]
+    d = dst[start:start+blockSize]
+    if missing:                                                                 # Mask must be found before values are overwritten
+      b = bad[:s.size]
+      np.equal( s, missing[0], out = b )
+      for val in missing[1:]:
+        np.logical_or( b, np.equal( s, val, out = tmp[:s.size] ), out = b )
+    if scale:
+      np.multiply( s, atts['scale_factor'], out = d, casting = 'unsafe' )
+      np.add( d, atts['add_offset'], out = d, casting = 'unsafe' )
+    elif copy:
+      np.copyto( d, s, casting = 'unsafe' )
+    if missing and b.any():
+      np.copyto( d, value, where = b, casting = 'unsafe' )
+  return out
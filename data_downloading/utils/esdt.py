@@ -80,6 +80,12 @@ ESDT2COLL = {'M2C0NXASM' : 'const_2d_asm_Nx',
              'M2I3NVGAS' : 'inst3_3d_gas_Nv', 
              'M2I6NPANA' : 'inst6_3d_ana_Np', 
              'M2I6NVANA' : 'inst6_3d_ana_Nv', 
+             'M2IMNXASM' : 'instM_2d_asm_Nx', 
+             'M2IMNXGAS' : 'instM_2d_gas_Nx', 
+             'M2IMNXINT' : 'instM_2d_int_Nx', 
+             'M2IMNXLFO' : 'instM_2d_lfo_Nx', 
+             'M2IMNPANA' : 'instM_3d_ana_Np', 
+             'M2IMNPASM' : 'instM_3d_asm_Np', 
              'M2SDNXSLV' : 'statD_2d_slv_Nx', 
              'M2T1NXADG' : 'tavg1_2d_adg_Nx', 
              'M2T1NXAER' : 'tavg1_2d_aer_Nx', 
@@ -107,7 +113,27 @@ ESDT2COLL = {'M2C0NXASM' : 'const_2d_asm_Nx',
              'M2T3NPTDT' : 'tavg3_3d_tdt_Np', 
              'M2T3NETRB' : 'tavg3_3d_trb_Ne', 
              'M2T3NPTRB' : 'tavg3_3d_trb_Np', 
-             'M2T3NPUDT' : 'tavg3_3d_udt_Np'} 
+             'M2T3NPUDT' : 'tavg3_3d_udt_Np', 
+             'M2TMNXADG' : 'tavgM_2d_adg_Nx', 
+             'M2TMNXAER' : 'tavgM_2d_aer_Nx', 
+             'M2TMNXCHM' : 'tavgM_2d_chm_Nx', 
+             'M2TMNXCSP' : 'tavgM_2d_csp_Nx', 
+             'M2TMNXFLX' : 'tavgM_2d_flx_Nx', 
+             'M2TMNXGLC' : 'tavgM_2d_glc_Nx', 
+             'M2TMNXINT' : 'tavgM_2d_int_Nx', 
+             'M2TMNXLFO' : 'tavgM_2d_lfo_Nx', 
+             'M2TMNXLND' : 'tavgM_2d_lnd_Nx', 
+             'M2TMNXOCN' : 'tavgM_2d_ocn_Nx', 
+             'M2TMNXRAD' : 'tavgM_2d_rad_Nx', 
+             'M2TMNXSLV' : 'tavgM_2d_slv_Nx', 
+             'M2TMNPCLD' : 'tavgM_3d_cld_Np', 
+             'M2TMNPMST' : 'tavgM_3d_mst_Np', 
+             'M2TMNPODT' : 'tavgM_3d_odt_Np', 
+             'M2TMNPQDT' : 'tavgM_3d_qdt_Np', 
+             'M2TMNPRAD' : 'tavgM_3d_rad_Np', 
+             'M2TMNPTDT' : 'tavgM_3d_tdt_Np', 
+             'M2TMNPTRB' : 'tavgM_3d_trb_Np', 
+             'M2TMNPUDT' : 'tavgM_3d_udt_Np'} 
 
 TYPE2CODE = SWAPKEYVAL( CODE2TYPE )
 TIME2CODE = SWAPKEYVAL( CODE2TIME )
@@ -188,6 +214,14 @@ class EarthScienceDataType():
   def collection(self):
     return ESDT2COLL.get( str(self), None )
 
+  @property
+  def shortName(self):
+    """ESDT name with version; e.g., M2I3NPASM.5.12.4"""
+
+    if self._version:
+      return '{}.{}'.format(self, self._version)
+    return str(self)
+
   @property
   def is2D(self):
     return self._V == 'X' 
@@ -0,0 +1,239 @@
+import logging
+import os
+import json
+import socket
+import threading
+import time
+
+LOCKSUFFIX = '.lock'                                                            # Suffix of lock file next to granule being downloaded
+STALE      = 900.0                                                              # Seconds without heartbeat after which a lock is abandoned
+POLL       = 15.0                                                               # Seconds between checks while waiting for a lock
+
+WAIT       = 'wait'                                                             # Actions when granule is locked by another worker
+SKIP       = 'skip'
+
+def pidAlive( pid ):
+  """Check if process exists on this host"""
+
+  try:
+    os.kill( pid, 0 )
+  except ProcessLookupError:
+    return False
+  except Exception:                                                             # e.g., PermissionError; process exists
+    return True
+  return True
+
+class GranuleLock():
+  """
+  Advisory lock on a granule shared across processes and hosts
+
+  The lock is a file created exclusively (O_CREAT | O_EXCL) next to the
+  granule, holding the host name and process ID of the owner. Exclusive
+  create is atomic on local and network file systems, unlike flock(),
+  so workers on different hosts sharing the output directory see each
+  other's locks. While held, the modification time of the lock file is
+  updated by a background thread; a lock whose owner has died, or
+  whose heartbeat is older than stale seconds, is broken by the next
+  worker that wants it. Breaking renames the lock file out of the way,
+  which only one worker can do for a given file, and puts it back if it
+  turns out to be a new lock taken since it was found stale.
+
+  """
+
+  def __init__(self, path, stale = STALE, poll = POLL):
+    """
+    Arguments:
+      path (str) : Path of lock file
+
+    Keyword arguments:
+      stale (float) : Seconds without heartbeat after which lock is
+        considered abandoned
+      poll (float) : Seconds between attempts while waiting for lock
+
+    """
+
+    self.log    = logging.getLogger(__name__)
+    self.path   = path
+    self.stale  = stale
+    self.poll   = poll
+    self.owner  = {'host' : socket.gethostname(), 'pid' : os.getpid(),
+                   'thread' : threading.get_ident()}
+    self._held  = False
+    self._stop  = threading.Event()
+    self._beat  = None
+
+  def __repr__(self):
+    return f'< {self.__class__.__name__} : {self.path} >'
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.release()
+
+  @property
+  def held(self):
+    return self._held
+
+  def readOwner(self):
+    """Owner of lock; None if not locked or unreadable"""
+
+    try:
+      with open(self.path, 'r') as fid:
+        return json.load( fid )
+    except Exception:
+      return None
+
+  def staleStat(self):
+    """
+    Status of existing lock if it was abandoned by its owner
+
+    Returns:
+      os.stat_result : Status of the lock file when found stale; None if
+        there is no lock or it is not stale
+
+    """
+
+    try:
+      stat = os.stat( self.path )
+    except OSError:
+      return None                                                               # Lock just released
+    if time.time() - stat.st_mtime > self.stale:
+      return stat
+    owner = self.readOwner()
+    if owner is None:                                                           # Being written, or corrupt; rely on age
+      return None
+    if owner.get('host', None) == self.owner['host'] and not pidAlive( owner.get('pid', -1) ):
+      return stat
+    return None
+
+  def isStale(self):
+    """Check if existing lock was abandoned by its owner"""
+
+    return self.staleStat() is not None
+
+  def _breakStale(self, stat):
+    """
+    Remove stale lock without removing a lock taken since
+
+    Another worker may break the same stale lock and create a new one
+    between this worker finding the lock stale and removing it. So the
+    lock file is renamed to a name unique to this worker, which is
+    atomic, and the renamed file is only removed if it is still the file
+    found stale (same inode and modification time); otherwise it is put
+    back.
+
+    Arguments:
+      stat (os.stat_result) : Status of lock file when found stale
+
+    Returns:
+      bool : True if the stale lock was removed
+
+    """
+
+    tomb = '{}.stale.{}.{}.{}'.format( self.path, self.owner['host'], self.owner['pid'], self.owner['thread'] )
+    try:
+      os.rename( self.path, tomb )
+    except OSError:
+      return False                                                              # Already broken by another worker
+    try:
+      moved = os.stat( tomb )
+    except OSError:
+      return False
+    if (moved.st_ino, moved.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+      try:
+        os.remove( tomb )
+      except OSError:
+        pass
+      return True
+
+    self.log.debug( f'Lock was taken by another worker after found stale, restoring : {self.path}' )
+    try:
+      os.link( tomb, self.path )                                                # Fails, rather than replacing, if yet another lock was created
+    except FileExistsError:
+      self.log.warning( f'Lock broken and taken again while restoring : {self.path}' )
+    except OSError:                                                             # Hard links not supported
+      os.replace( tomb, self.path )
+      return False
+    try:
+      os.remove( tomb )
+    except OSError:
+      pass
+    return False
+
+  def _tryAcquire(self):
+    """Single attempt to create lock file"""
+
+    os.makedirs( os.path.dirname( os.path.abspath(self.path) ), exist_ok = True )
+    try:
+      fd = os.open( self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644 )
+    except FileExistsError:
+      stat = self.staleStat()
+      if stat is None:
+        return False
+      self.log.warning( 'Removing stale lock : {} (owner {})'.format( self.path, self.readOwner() ) )
+      self._breakStale( stat )
+      return False                                                              # Try again on next attempt; another worker may get it first
+    with os.fdopen( fd, 'w' ) as fid:
+      json.dump( dict( self.owner, time = time.time() ), fid )
+    return True
+
+  def acquire(self, blocking = True, timeout = None):
+    """
+    Acquire the lock
+
+    Keyword arguments:
+      blocking (bool) : If set, wait until the lock is free
+      timeout (float) : Maximum seconds to wait; wait forever if None
+
+    Returns:
+      bool : True if lock acquired, False otherwise
+
+    """
+
+    if self._held:
+      return True
+    t0     = time.time()
+    logged = False
+    while True:
+      if self._tryAcquire() or self._tryAcquire():                              # Second attempt right after a stale lock is removed
+        break
+      if not blocking or (timeout is not None and time.time() - t0 >= timeout):
+        return False
+      if not logged:
+        self.log.info( 'Waiting for lock held by {} : {}'.format( self.readOwner(), self.path ) )
+        logged = True
+      time.sleep( self.poll )
+
+    self._held = True
+    self._stop.clear()
+    self._beat = threading.Thread( target = self._heartbeat, daemon = True )
+    self._beat.start()
+    return True
+
+  def _heartbeat(self):
+    """Touch lock file so other workers know owner is alive"""
+
+    while not self._stop.wait( self.stale / 4.0 ):
+      try:
+        os.utime( self.path )
+      except OSError as err:
+        self.log.warning( f'Failed to refresh lock {self.path} : {err}' )
+
+  def release(self):
+    """Release the lock, if held"""
+
+    if not self._held:
+      return
+    self._held = False
+    self._stop.set()
+    if self._beat is not None:
+      self._beat.join()
+      self._beat = None
+    owner = self.readOwner()
+    if owner is not None and owner.get('pid', None) == self.owner['pid'] and \
+       owner.get('host', None) == self.owner['host']:                           # Do not remove a lock that was broken and taken by another worker
+      try:
+        os.remove( self.path )
+      except OSError:
+        pass
@@ -0,0 +1,522 @@
+"""
+Direct HTTPS access to granules with HDF5 chunk range reads
+
+MERRA-2 granules (.nc4) are HDF5 files with chunked, compressed
+variables. Rather than having the OPeNDAP server subset and encode the
+data, the chunks overlapping a selection are located in the file,
+downloaded as raw bytes with concurrent HTTP Range requests, and
+decompressed locally.
+
+The storage layout of each variable (data type, chunk shape, filters,
+attributes) is the same for every granule of a collection, so it is
+kept in the metadata cache. Only the byte locations of the chunks,
+which change with the compressed sizes, are looked up in each granule;
+file metadata are read through h5py over a block-cached range reader,
+so this takes a few small requests per granule.
+
+Requires h5py.
+
+"""
+import io
+import itertools
+import logging
+import re
+import time
+import zlib
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+  import h5py
+except ImportError:
+  h5py = None
+
+from .decode import nativeByteOrder, scaleFillData
+from .pydapData import USER, PASSWD, getSession
+from .retry import AUTH, CLIENT, SERVER, TIMEOUT, RetryPolicy, classifyError, getBreaker
+
+BLOCKSIZE      = 2**18                                                          # Bytes of file metadata read, and cached, at a time
+MAXBLOCKS      = 64                                                             # Blocks of file metadata kept in memory
+RANGEWORKERS   = 8                                                              # Range requests in flight per granule
+MAXGAP         = 2**16                                                          # Chunks closer than this, in bytes, are read in one request
+MAXRANGE       = 2**25                                                          # Maximum bytes in one merged request
+REQUESTTIMEOUT = 600.0                                                          # Seconds to wait for a range request
+
+DEFLATE        = 1                                                              # HDF5 filter identifiers that can be decoded
+SHUFFLE        = 2
+FLETCHER32     = 3
+NETCDFATTS     = ('DIMENSION_LIST', 'REFERENCE_LIST', 'CLASS', 'NAME',
+                  '_Netcdf4Dimid', '_Netcdf4Coordinates', '_nc3_strict')        # HDF5 attributes used internally by netCDF4
+
+CONTENTRANGE   = re.compile( r'bytes\s+(\d+)-(\d+)/(\d+|\*)' )
+
+def dataURL( url ):
+  """HTTPS data URL of granule given its OPeNDAP URL"""
+
+  return re.sub( r'/opendap/(hyrax/)?', '/data/', url, count = 1 )
+
+def attValue( value ):
+  """Convert HDF5 attribute value to the form returned by OPeNDAP"""
+
+  if isinstance(value, bytes):
+    return value.decode( 'utf-8', 'replace' )
+  if isinstance(value, np.ndarray):
+    if value.dtype.kind in 'SOU':
+      value = [attValue(v) for v in value.tolist()]
+      return value[0] if len(value) == 1 else value
+    return value[0] if value.size == 1 else value
+  return value
+
+def describeVariable( dset ):
+  """
+  Storage layout of an HDF5 dataset
+
+  Arguments:
+    dset (h5py.Dataset) : Dataset to describe
+
+  Returns:
+    dict : Dimension names, shape, data type, chunk shape (None if not
+      chunked), filters as (id, options) tuples in pipeline order, fill
+      value, and attributes
+
+  """
+
+  plist   = dset.id.get_create_plist()
+  filters = []
+  for i in range( plist.get_nfilters() ):
+    code, _, values, _ = plist.get_filter( i )
+    filters.append( (code, tuple(values)) )
+  dims = []
+  for i, dim in enumerate( dset.dims ):
+    dims.append( dim[0].name.split('/')[-1] if len(dim) > 0 else f'phony_dim_{i}' )
+  return {'dimensions' : tuple( dims ),
+          'shape'      : tuple( dset.shape ),
+          'dtype'      : dset.dtype.str,
+          'chunks'     : dset.chunks,
+          'filters'    : filters,
+          'fill'       : attValue( dset.fillvalue ) if dset.fillvalue is not None else 0,
+          'atts'       : {key : attValue( val ) for key, val in dset.attrs.items()
+                            if key not in NETCDFATTS}}
+
+def decodable( layout ):
+  """Check if chunks of variable can be decoded locally"""
+
+  return layout['chunks'] is not None and \
+         all( code in (DEFLATE, SHUFFLE, FLETCHER32) for code, _ in layout['filters'] )
+
+def decodeChunk( raw, layout, mask = 0 ):
+  """
+  Decode raw chunk read from file
+
+  Arguments:
+    raw (bytes) : Chunk as stored in file
+    layout (dict) : Storage layout of variable; see describeVariable()
+
+  Keyword arguments:
+    mask (int) : Filter mask of chunk; bit i set if filter i was not
+      applied to this chunk
+
+  Returns:
+    numpy.ndarray : Chunk values, with the full chunk shape
+
+  """
+
+  dtype = np.dtype( layout['dtype'] )
+  for i, (code, _) in reversed( list( enumerate( layout['filters'] ) ) ):       # Filters are undone in reverse order
+    if mask & (1 << i): continue
+    if code == DEFLATE:
+      raw = zlib.decompress( raw )
+    elif code == SHUFFLE:
+      raw = np.frombuffer( raw, np.uint8 ).reshape( dtype.itemsize, -1 ).T.tobytes()
+    elif code == FLETCHER32:
+      raw = raw[:-4]                                                            # Checksum is appended to chunk
+    else:
+      raise ValueError( f'Unsupported HDF5 filter : {code}' )
+  return np.frombuffer( raw, dtype ).reshape( layout['chunks'] )
+
+def chunkIndices( s, size ):
+  """Indices of chunks, along one dimension, holding points of slice"""
+
+  return np.unique( np.arange( s.start, s.stop, s.step ) // size ).tolist()
+
+def chunkSelection( slices, start, chunks ):
+  """
+  Selected points of a chunk
+
+  Arguments:
+    slices (tuple) : Normalized slices of selection
+    start (tuple) : Index of first point of chunk
+    chunks (tuple) : Chunk shape
+
+  Returns:
+    tuple : Slices of selected points within chunk, and their location
+      within the selection
+
+  """
+
+  inChunk = []
+  inOut   = []
+  for s, c0, n in zip( slices, start, chunks ):
+    k0    = -(-(max(c0, s.start) - s.start) // s.step)                          # First selected point in chunk
+    k1    = -(-(min(c0 + n, s.stop) - s.start) // s.step)                       # One past last selected point in chunk
+    first = s.start + k0 * s.step - c0
+    inChunk.append( slice( first, first + (k1 - k0 - 1) * s.step + 1, s.step ) )
+    inOut.append( slice( k0, k1 ) )
+  return tuple( inChunk ), tuple( inOut )
+
+def mergeRanges( chunks, maxGap = MAXGAP, maxRange = MAXRANGE ):
+  """
+  Group chunks into byte ranges to request
+
+  Chunks that are close together in the file are read in one request,
+  as long as the request does not get larger than maxRange.
+
+  Arguments:
+    chunks (list) : Tuples whose first two values are the byte offset
+      and size of a chunk
+
+  Returns:
+    list : (start, stop, chunks) tuples, one per request
+
+  """
+
+  groups = []
+  for chunk in sorted( chunks, key = lambda c: c[0] ):
+    offset, size = chunk[:2]
+    if groups:
+      start, stop, members = groups[-1]
+      if offset - stop <= maxGap and offset + size - start <= maxRange:
+        groups[-1] = (start, max(stop, offset + size), members + [chunk])
+        continue
+    groups.append( (offset, offset + size, [chunk]) )
+  return groups
+
+class RangeFile( io.RawIOBase ):
+  """
+  Read-only file object over HTTP Range requests
+
+  Reads are done in blocks that are kept in a small cache, since h5py
+  reads file metadata in many small pieces.
+
+  """
+
+  def __init__(self, fetch, size, first = None, blockSize = BLOCKSIZE, maxBlocks = MAXBLOCKS):
+    """
+    Arguments:
+      fetch (callable) : Function returning bytes [start, stop) of file
+      size (int) : Size of file in bytes
+
+    Keyword arguments:
+      first (bytes) : Data already read from start of file
+      blockSize (int) : Bytes per block
+      maxBlocks (int) : Maximum number of blocks cached
+
+    """
+
+    super().__init__()
+    self.fetch     = fetch
+    self.size      = size
+    self.blockSize = blockSize
+    self.maxBlocks = maxBlocks
+    self._pos      = 0
+    self._blocks   = OrderedDict()
+    if first is not None and len(first) >= min(blockSize, size):
+      self._blocks[0] = first[:blockSize]
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self._pos
+
+  def seek(self, offset, whence = io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self._pos
+    elif whence == io.SEEK_END:
+      offset += self.size
+    self._pos = offset
+    return offset
+
+  def _block(self, i):
+    if i in self._blocks:
+      self._blocks.move_to_end( i )
+      return self._blocks[i]
+    block = self.fetch( i * self.blockSize, min( (i+1) * self.blockSize, self.size ) )
+    self._blocks[i] = block
+    if len(self._blocks) > self.maxBlocks:
+      self._blocks.popitem( last = False )
+    return block
+
+  def readinto(self, buf):
+    view = memoryview( buf ).cast( 'B' )
+    n    = max( 0, min( len(view), self.size - self._pos ) )
+    done = 0
+    while done < n:
+      i, off = divmod( self._pos, self.blockSize )
+      block  = self._block( i )
+      k      = min( n - done, len(block) - off )
+      view[done:done+k] = block[off:off+k]
+      done      += k
+      self._pos += k
+    return n
+
+class HTTPSGranule():
+  """
+  Remote granule read with HDF5 chunk range requests
+
+  Provides the same interface as pydapData.PyDAPDataset so that it can
+  be used as the remote in merra2downloader.downloader.
+
+  """
+
+  def __init__(self, url, cache = None, workers = RANGEWORKERS, retryPolicy = None,
+        breaker = None, username = USER, password = PASSWD, **kwargs):
+    """
+    Arguments:
+      url (str) : OPeNDAP, or HTTPS, URL of granule
+
+    Keyword arguments:
+      cache (MetadataCache) : Cache for the collection
+      workers (int) : Number of range requests in flight at once
+      retryPolicy (RetryPolicy) : Backoff policy for failed requests
+      breaker (CircuitBreaker) : Circuit breaker for host
+      username (str) : Earthdata login user name
+      password (str) : Earthdata login password
+      **kwargs : Ignored
+
+    """
+
+    if h5py is None:
+      raise Exception( 'h5py is required for the HTTPS backend' )
+
+    self.log      = logging.getLogger(__name__)
+    self.url      = dataURL( url )
+    self.cache    = cache
+    self.workers  = workers
+    self.policy   = retryPolicy or RetryPolicy()
+    self.breaker  = breaker or getBreaker( self.url )
+    self.username = username
+    self.password = password
+    self.session  = getSession( self.url, username, password )
+    self.size     = None
+    self.requests = 0                                                           # Number of range requests made
+    self.nbytes   = 0                                                           # Bytes transferred
+
+    first       = self._getRange( 0, BLOCKSIZE )                                # Also gets size of file
+    self._file  = RangeFile( self._getRange, self.size, first = first )
+    self._h5    = h5py.File( self._file, 'r' )
+    self._layout = {}
+    if self.cache is not None and self.cache.getDDS() is None:                  # Record all variables once per collection; used for planning
+      dds = {}
+      for name, dset in self._h5.items():
+        if not isinstance(dset, h5py.Dataset): continue
+        layout = self.layout( name )
+        dds[name] = (layout['dimensions'], layout['shape'], layout['dtype'])
+      self.cache.setDDS( dds )
+
+  def __repr__(self):
+    return f'< {self.__class__.__name__} : {self.url} >'
+
+  def _getRange(self, start, stop):
+    """
+    Get bytes [start, stop) of remote file
+
+    Failed requests are retried with backoff; on a 401 error, a new
+    login is performed.
+
+    Returns:
+      bytes : Data
+
+    Raises:
+      Exception : If request fails after all retries
+
+    """
+
+    attempt = 0
+    while True:
+      attempt += 1
+      self.breaker.wait()
+      try:
+        resp = self.session.get( self.url, headers = {'Range' : f'bytes={start}-{stop-1}'},
+                                 timeout = REQUESTTIMEOUT )
+        resp.raise_for_status()
+        data  = resp.content
+        match = CONTENTRANGE.match( resp.headers.get('Content-Range', '') )
+        if resp.status_code != 206:                                             # Server ignored range, so sent whole file
+          self.size = len(data)
+          data      = data[start:stop]
+        elif self.size is None and match and match.group(3) != '*':
+          self.size = int( match.group(3) )
+      except Exception as err:
+        kind = classifyError( err )
+        self.log.warning( 'Attempt {:2d} of {:2d} - Failed to get bytes {}-{} ({}) : {}'.format(
+          attempt, self.policy.retries, start, stop, kind, err ) )
+        if kind == CLIENT or attempt >= self.policy.retries:
+          raise
+        if kind == AUTH:
+          self.session = getSession( self.url, self.username, self.password, refresh = True )
+          continue
+        if kind in (SERVER, TIMEOUT):
+          self.breaker.failure()
+        time.sleep( self.policy.delay( attempt ) )
+        continue
+      self.breaker.success()
+      self.requests += 1
+      self.nbytes   += len(data)
+      return data
+
+  def close(self):
+    """Close remote file; the session is returned to the pool"""
+
+    try:
+      self._h5.close()
+      self._file.close()
+    except:
+      pass
+
+  def layout(self, varName):
+    """Storage layout of variable, from cache if available; None if no such variable"""
+
+    if varName in self._layout:
+      return self._layout[varName]
+    layout = self.cache.getLayout( varName ) if self.cache is not None else None
+    if layout is None:
+      if varName not in self._h5:
+        return None
+      layout = describeVariable( self._h5[varName] )
+      if self.cache is not None:
+        self.cache.setLayout( varName, layout )
+    self._layout[varName] = layout
+    return layout
+
+  def fullSlices(self, varName):
+    """Slices covering the full extent of a remote variable"""
+
+    return tuple( slice(0, n) for n in self.layout( varName )['shape'] )
+
+  def getVarAtts(self, varName, retry = None):
+    layout = self.layout( varName )
+    if layout is None:
+      return None
+    atts = dict( layout['atts'] )
+    atts['dimensions'] = layout['dimensions']
+    return atts
+
+  def _normalize(self, varName, slices):
+    """Slices with explicit start, stop, and step"""
+
+    shape = self.layout( varName )['shape']
+    if slices is None:
+      slices = self.fullSlices( varName )
+    elif isinstance(slices, slice):
+      slices = (slices,)
+    return tuple( slice( *s.indices(n) ) for s, n in zip( slices, shape ) )
+
+  def _readChunks(self, request):
+    """
+    Read selections of chunked variables with concurrent range requests
+
+    Arguments:
+      request (list) : (varName, slices) tuples with normalized slices
+
+    Returns:
+      list : Values for each selection
+
+    """
+
+    outputs = []
+    chunks  = []                                                                # (offset, size, mask, output index, chunk start)
+    for varName, slices in request:
+      layout = self.layout( varName )
+      dtype  = np.dtype( layout['dtype'] ).newbyteorder( '=' )
+      counts = [len( range(s.start, s.stop, s.step) ) for s in slices]
+      outputs.append( (np.full( counts, layout['fill'], dtype = dtype ), slices, layout) )
+      dsid   = self._h5[varName].id
+      for index in itertools.product( *[chunkIndices( s, c ) for s, c in zip( slices, layout['chunks'] )] ):
+        start = tuple( i * c for i, c in zip( index, layout['chunks'] ) )
+        info  = dsid.get_chunk_info_by_coord( start )
+        if info.byte_offset is None: continue                                   # Chunk never written, so is all fill
+        chunks.append( (info.byte_offset, info.size, info.filter_mask, len(outputs)-1, start) )
+
+    def fetch( group ):                                                         # Read and decode chunks in worker thread; zlib releases the GIL
+      start, stop, members = group
+      data = self._getRange( start, stop )
+      out  = []
+      for offset, size, mask, i, chunkStart in members:
+        raw = data[offset - start:offset - start + size]
+        out.append( (i, chunkStart, decodeChunk( raw, outputs[i][2], mask )) )
+      return out
+
+    groups = mergeRanges( chunks )
+    self.log.debug( f'Reading {len(chunks)} chunks in {len(groups)} requests' )
+    with ThreadPoolExecutor( max( 1, min( self.workers, len(groups) ) ) ) as pool:
+      for decoded in pool.map( fetch, groups ):
+        for i, chunkStart, values in decoded:
+          out, slices, layout = outputs[i]
+          inChunk, inOut = chunkSelection( slices, chunkStart, layout['chunks'] )
+          out[inOut] = values[inChunk]
+    return [out for out, _, _ in outputs]
+
+  def getValues(self, varName, slices = None, retry = None):
+    layout = self.layout( varName )
+    if layout is None:
+      return None
+    slices = self._normalize( varName, slices )
+    try:
+      if not decodable( layout ):                                               # Contiguous (e.g., coordinates) or unknown filters; let h5py read it
+        values = self._h5[varName][slices]
+        return nativeByteOrder( values, inplace = True )
+      return self._readChunks( [(varName, slices)] )[0]
+    except Exception as err:
+      self.log.error( f'Failed to get data : {varName} : {err}' )
+      return None
+
+  def getValuesCombined(self, request):
+    """
+    Get data for many variables at once
+
+    Chunks for all variables are requested concurrently.
+
+    Arguments:
+      request (list) : List of (varName, slices) tuples. If slices is
+        None, the full variable is requested.
+
+    Returns:
+      list : List of (values, coords) tuples, in same order as request;
+        coords is always empty. None if request fails.
+
+    """
+
+    layouts = [self.layout( varName ) for varName, _ in request]
+    if any( layout is None or not decodable( layout ) for layout in layouts ):
+      return None
+    try:
+      values = self._readChunks( [(varName, self._normalize( varName, slices ))
+                                    for varName, slices in request] )
+    except Exception as err:
+      self.log.warning( f'Failed to get combined request : {err}' )
+      return None
+    return [(val, {}) for val in values]
+
+  def getVar(self, varName, slices = None, scaleandfill = False):
+    atts = self.getVarAtts( varName )
+    if atts is None:
+      return None, None
+    values = None
+    if self.cache is not None:
+      values = self.cache.getValues( varName, slices = slices )
+    if values is None:
+      values = self.getValues( varName, slices = slices )
+      if values is not None and self.cache is not None and slices is None:      # Only full variables are cached
+        self.cache.setValues( varName, values )
+    if values is None:
+      return None, None
+    if scaleandfill:
+      return scaleFillData( values, atts, inplace = True ), atts
+    return values, atts
@@ -3,7 +3,19 @@ import numpy as np
 from idlpy import interpolate
 
 class InterpLonLat():
-  def __init__(self, origLon, origLat):
+  def __init__(self, origLon, origLat, lon0=None):
+    """
+    Arguments:
+      origLon (ndarray) : Longitude values of data to interpolate
+      origLat (ndarray) : Latitude values of data to interpolate
+
+    Keyword arguments:
+      lon0 (float) : First longitude of output grid. Default is the
+        minimum of origLon
+
+    """
+
+    self.lon0    = lon0
     self.newLon  = None
     self.newLat  = None
     self.dLon    = None
@@ -58,7 +70,8 @@ class InterpLonLat():
     if dLon is None:
       self.newLon = self.origLon
     else:
-      self.newLon = np.arange( 360.0 / dLon ) * dLon + self.origLon.min()
+      lon0        = self.origLon.min() if self.lon0 is None else self.lon0
+      self.newLon = np.arange( 360.0 / dLon ) * dLon + lon0
     origLon     = self._origLonPad
     self._xint  = np.interp(self.newLon, origLon, np.arange(origLon.size))
 
@@ -107,7 +120,7 @@ class InterpLonLat():
     self.setLonRes( dLon )
     self.setLatRes( dLat )
 
-  def interpolate(self, data):
+  def interpolate(self, data, padded=False):
     """
     Interpolate data from original resolution to output resolution
 
@@ -122,6 +135,11 @@ class InterpLonLat():
     Arguments:
       data (numpy.ndarray) : Array of data to interpolate
 
+    Keyword arguments:
+      padded (bool) : If set, data are already padded with one wrapped
+        point on either end of the longitude dimension, so no copy is
+        made for padding
+
     Returns:
       numpy.ndarray : Interpolated data
 
@@ -135,16 +153,17 @@ class InterpLonLat():
     if self.dLon is None and self.dLat is None:                                 # If dLon and dLat are NOT set, then do NOT interpolate
       return data
  
-    pad_width = [ (1, 1) ]
-    for i in range( 1, data.ndim ):
-      pad_width.append( (0, 0) )
-    pad_width = pad_width[::-1]
-    data      = np.pad(data, pad_width, mode='wrap')
+    if not padded:
+      pad_width = [ (1, 1) ]
+      for i in range( 1, data.ndim ):
+        pad_width.append( (0, 0) )
+      pad_width = pad_width[::-1]
+      data      = np.pad(data, pad_width, mode='wrap')
 
     oldShape = None
     if data.ndim > 3:
       oldShape = data.shape
-      newShape = ( np.product(oldShape[:-2]), *oldShape[-2:] )
+      newShape = ( np.prod(oldShape[:-2]), *oldShape[-2:] )
       data     = data.reshape( newShape )
   
     zint = np.arange(data.shape[0])
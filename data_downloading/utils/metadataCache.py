@@ -0,0 +1,270 @@
+import logging
+import os
+import pickle
+import threading
+
+import numpy as np
+
+HOME     = os.path.expanduser('~')
+CACHEDIR = os.path.join( HOME, '.cache', 'data_downloading', 'metadata' )
+
+class MetadataCache():
+  """
+  Disk-backed cache of remote dataset metadata
+
+  Coordinate values, variable attributes, dimensions, and shapes are
+  identical for every granule of a given collection (e.g.,
+  M2I3NPASM.5.12.4), so they only need to be downloaded once. This class
+  stores that information on disk, keyed by collection name and version,
+  so that later granules (and later runs) can skip those requests.
+
+  Variables that change from granule to granule (e.g., time, whose
+  units contain the granule date) should be listed in exclude so they
+  are always fetched from the remote.
+
+  """
+
+  def __init__(self, key, cachedir = CACHEDIR, exclude = ()):
+    """
+    Arguments:
+      key (str) : Collection name with version; e.g., M2I3NPASM.5.12.4
+
+    Keyword arguments:
+      cachedir (str) : Directory to store cache files in
+      exclude (tuple) : Names of variables never to cache
+
+    """
+
+    self.log      = logging.getLogger(__name__)
+    self.key      = key
+    self.exclude  = tuple( exclude )
+    self.path     = os.path.join( cachedir, f'{key}.pickle' )
+    self._lock    = threading.Lock()
+    self._dirty   = False
+    self._data    = {'atts' : {}, 'values' : {}, 'shape' : {}, 'dds' : {}, 'layout' : {}, 'text' : {}}
+    self.load()
+
+  def __contains__(self, varName):
+    return varName in self._data['atts']
+
+  def _cacheable(self, varName):
+    return varName not in self.exclude
+
+  def load(self):
+    """Load cache from disk if it exists"""
+
+    if not os.path.isfile( self.path ):
+      return False
+    try:
+      with open(self.path, 'rb') as fid:
+        data = pickle.load( fid )
+    except Exception as err:
+      self.log.warning( f'Failed to load metadata cache, ignoring : {err}' )
+      return False
+    for key in self._data:
+      self._data[key].update( data.get(key, {}) )
+    self.log.debug( f'Loaded metadata cache : {self.path}' )
+    return True
+
+  def save(self):
+    """
+    Write cache to disk if anything has changed
+
+    Data are written to a temporary file and then renamed so that
+    other processes never read a partial cache.
+
+    """
+
+    with self._lock:
+      if not self._dirty:
+        return
+      os.makedirs( os.path.dirname(self.path), exist_ok = True )
+      tmp = f'{self.path}.{os.getpid()}'
+      with open(tmp, 'wb') as fid:
+        pickle.dump( self._data, fid )
+      os.replace( tmp, self.path )
+      self._dirty = False
+    self.log.debug( f'Saved metadata cache : {self.path}' )
+
+  def getAtts(self, varName):
+    """
+    Get cached attributes for variable
+
+    Arguments:
+      varName (str) : Name of variable
+
+    Returns:
+      dict : Copy of variable attributes, including dimensions; None if
+        not cached
+
+    """
+
+    atts = self._data['atts'].get( varName, None )
+    return None if atts is None else dict( atts )
+
+  def setAtts(self, varName, atts):
+    """
+    Store attributes for variable
+
+    Arguments:
+      varName (str) : Name of variable
+      atts (dict) : Variable attributes, including dimensions
+
+    """
+
+    if not self._cacheable( varName ): return
+    with self._lock:
+      self._data['atts'][varName] = dict( atts )
+      self._dirty = True
+
+  def getShape(self, varName):
+    """Get cached shape of full variable; None if not cached"""
+
+    return self._data['shape'].get( varName, None )
+
+  def setShape(self, varName, shape):
+    """Store shape of full variable"""
+
+    if not self._cacheable( varName ): return
+    with self._lock:
+      self._data['shape'][varName] = tuple( shape )
+      self._dirty = True
+
+  def getDDS(self):
+    """
+    Get cached description of all variables in the collection
+
+    Returns:
+      dict : (dimensions, shape, dtype) tuples keyed by variable name;
+        None if not cached
+
+    """
+
+    dds = self._data['dds']
+    return dict( dds ) if dds else None
+
+  def setDDS(self, dds):
+    """
+    Store description of all variables in the collection
+
+    Arguments:
+      dds (dict) : (dimensions, shape, dtype) tuples keyed by variable
+        name. Shapes of excluded variables (e.g., time) are still stored
+        as they are the same for all granules.
+
+    """
+
+    with self._lock:
+      self._data['dds'] = {name : (tuple(dims), tuple(shape), np.dtype(dtype).str)
+                            for name, (dims, shape, dtype) in dds.items()}
+      self._dirty = True
+
+  def getText(self, kind):
+    """
+    Get cached DDS or DAS response text
+
+    Arguments:
+      kind (str) : 'dds' or 'das'
+
+    Returns:
+      str : Response text; None if not cached
+
+    """
+
+    return self._data['text'].get( kind, None )
+
+  def setText(self, kind, text):
+    """
+    Store DDS or DAS response text
+
+    The responses are the same for every granule of a collection, except
+    for attributes of excluded variables and global attributes (e.g.,
+    file name), which must not be taken from the cached DAS.
+
+    Arguments:
+      kind (str) : 'dds' or 'das'
+      text (str) : Response text
+
+    """
+
+    with self._lock:
+      self._data['text'][kind] = text
+      self._dirty = True
+
+  def getLayout(self, varName):
+    """
+    Get cached HDF5 storage layout of variable
+
+    Returns:
+      dict : Layout, see httpsGranule.describeVariable(); None if not
+        cached, or if variable is excluded
+
+    """
+
+    if not self._cacheable( varName ): return None                              # Cache written with a different exclude may hold it
+    layout = self._data['layout'].get( varName, None )
+    return None if layout is None else dict( layout )
+
+  def setLayout(self, varName, layout):
+    """
+    Store HDF5 storage layout of variable
+
+    The layout (chunk shape, filters, data type) is the same for every
+    granule of a collection; only the locations of the chunks differ.
+    The layout includes the attributes of the variable, so layouts of
+    excluded variables (e.g., time, whose units change from granule to
+    granule) are not stored.
+
+    Arguments:
+      varName (str) : Name of variable
+      layout (dict) : Storage layout of variable
+
+    """
+
+    if not self._cacheable( varName ): return
+    with self._lock:
+      self._data['layout'][varName] = dict( layout )
+      self._dirty = True
+
+  def getValues(self, varName, slices = None):
+    """
+    Get cached values for variable
+
+    Only full variables are cached, so any subset is taken from the
+    cached array.
+
+    Arguments:
+      varName (str) : Name of variable
+
+    Keyword arguments:
+      slices (slice, tuple) : Subset of values to return
+
+    Returns:
+      numpy.ndarray : Copy of the values; None if not cached
+
+    """
+
+    values = self._data['values'].get( varName, None )
+    if values is None:
+      return None
+    if slices is not None:
+      values = values[ slices ]
+    return values.copy()
+
+  def setValues(self, varName, values):
+    """
+    Store full values for variable
+
+    Only one-dimensional (i.e., coordinate) variables are stored.
+
+    Arguments:
+      varName (str) : Name of variable
+      values (numpy.ndarray) : Full array of variable values
+
+    """
+
+    if not self._cacheable( varName ) or np.ndim( values ) != 1: return
+    with self._lock:
+      self._data['values'][varName] = np.array( values )
+      self._data['shape'][varName]  = np.shape( values )
+      self._dirty = True
@@ -1,13 +1,31 @@
 import logging
-import os, sys
+import os
 import json
 import time
+import threading
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from http.cookiejar import LWPCookieJar
+from urllib.parse import urlparse, quote
 
 import numpy as np
+import requests
 
-#from pydap.handlers.dap import DAPHandler
 from pydap.client import open_url#, Functions
+try:
+  from pydap.client import open_dods
+except ImportError:
+  from pydap.client import open_dods_url as open_dods
 from pydap.cas.urs import setup_session
+from pydap.handlers.dap import DAPHandler
+from pydap.lib import DEFAULT_TIMEOUT
+from pydap.parsers.das import add_attributes, parse_das
+from pydap.parsers.dds import dds_to_dataset
+
+from .decode import nativeByteOrder, scaleFillData
+from .retry import AUTH, SERVER, TIMEOUT, CLIENT, RetryPolicy, classifyError, errorStatus, getBreaker
 
 HOME = os.path.expanduser('~')
 info = os.path.join(HOME, '.earthdataloginrc')
@@ -20,10 +38,15 @@ else:
   USER   = None
   PASSWD = None
 
+COOKIEJAR = os.path.join(HOME, '.earthdatacookies')                            # File URS cookies are persisted to so that other processes/runs can skip login
+SESSIONS  = {}                                                                  # Pool of authenticated sessions keyed by host
+SESSLOCK  = threading.Lock()
+
 FAILEDFMT = 'Attempt {:2d} of {:2d} - Failed to get {}'
-LITTLEEND = sys.byteorder == 'little'
-NATIVE    = LITTLEEND and '<' or '>'
-SWAPPED   = LITTLEEND and '>' or '<'
+MAXREQUESTBYTES = 2**28                                                         # Requests larger than this, in bytes, are split into pieces
+SPLITWORKERS    = 4                                                             # Number of pieces of a split request fetched at once
+TOOLARGE        = ('too large', 'too big', 'exceeds', 'size limit')             # Phrases in server errors for responses over its size limit
+CACHEDHANDLER   = hasattr(DAPHandler, 'dataset_from_dap2')                      # Dataset can be built from given DDS/DAS; pydap >= 3.5
 
 
 """
@@ -54,45 +77,262 @@ class PyDAPDataset( DAPHandler ):
 """
 
 
-def scaleFillData(data, atts, fillValue = None):
-  log = logging.getLogger(__name__);
-  if '_FillValue' in atts:
-    log.debug( 'Searching for Fill Values in data' );
-    bad = (data == atts['_FillValue'])
-  else:
-    log.debug( "No '_FillValue' attribute" );
-    bad = None
-  if 'missing_value' in atts:
-    log.debug( 'Searching for missing values in data' );    
-    if bad is None:
-      bad = (data == atts['missing_value']);
-    else:
-      bad = ((data == atts['missing_value']) | bad);
+class CachedDAPHandler( DAPHandler ):
+  """
+  DAP2 handler that builds the dataset from given DDS and DAS text
+
+  pydap's DAPHandler (used by open_url) downloads the DDS and DAS of
+  every dataset it opens. Here they are given instead, e.g., from the
+  metadata cache, so opening a dataset makes no requests; data are
+  still requested from url.
+
+  """
+
+  def __init__(self, url, dds, das, session = None):
+    self.ddsText = dds
+    self.dasText = das
+    super().__init__( url, None, session, output_grid = False )                 # Same as open_url
+
+  def dataset_from_dap2(self):
+    self.dataset = dds_to_dataset( self.ddsText )
+
+  def attach_das(self):
+    add_attributes( self.dataset, parse_das( self.dasText ) )
+
+def isAuthError( err ):
+  """
+  Check if exception is the result of an authentication (401) error
+
+  Arguments:
+    err (Exception) : Exception raised while accessing remote data
+
+  Returns:
+    bool : True if error is HTTP 401, False otherwise
+
+  """
+
+  return classifyError( err ) == AUTH
+
+def loadCookies( session, cookiejar = COOKIEJAR ):
+  """
+  Load persisted URS cookies into a session
+
+  Arguments:
+    session (requests.Session) : Session to load cookies into
+
+  Keyword arguments:
+    cookiejar (str) : Path to cookie file
+
+  Returns:
+    bool : True if cookies loaded, False otherwise
+
+  """
+
+  if not os.path.isfile( cookiejar ):
+    return False
+  jar = LWPCookieJar( cookiejar )
+  try:
+    jar.load( ignore_discard = True )
+  except Exception as err:
+    logging.getLogger(__name__).debug( f'Failed to load cookies: {err}' )
+    return False
+  for cookie in jar:
+    session.cookies.set_cookie( cookie )
+  return len(jar) > 0
+
+def saveCookies( session, cookiejar = COOKIEJAR ):
+  """
+  Persist session cookies to disk
+
+  Cookies are written to a temporary file that is then renamed so that
+  concurrent processes never read a partially written jar.
+
+  Arguments:
+    session (requests.Session) : Session to save cookies from
+
+  Keyword arguments:
+    cookiejar (str) : Path to cookie file
+
+  Returns:
+    None.
+
+  """
+
+  tmp = f'{cookiejar}.{os.getpid()}'
+  jar = LWPCookieJar( tmp )
+  for cookie in session.cookies:
+    jar.set_cookie( cookie )
+  try:
+    jar.save( ignore_discard = True )
+    os.chmod( tmp, 0o600 )
+    os.replace( tmp, cookiejar )
+  except Exception as err:
+    logging.getLogger(__name__).debug( f'Failed to save cookies: {err}' )
+
+def getSession( url, username = None, password = None, refresh = False, cookiejar = COOKIEJAR ):
+  """
+  Get authenticated session for a remote host from the session pool
+
+  Sessions are shared by all PyDAPDataset instances accessing the same
+  host. If no session exists in the pool, one is created using cookies
+  persisted by a previous login; the URS login is only performed when
+  there are no persisted cookies or when refresh is set (e.g., after a
+  401 error).
+
+  Arguments:
+    url (str) : URL of remote data; host is used as pool key
+
+  Keyword arguments:
+    username (str) : Earthdata login user name
+    password (str) : Earthdata login password
+    refresh (bool) : If set, perform new login even if session exists
+    cookiejar (str) : Path to cookie file
+
+  Returns:
+    requests.Session : Authenticated session
+
+  """
+
+  log  = logging.getLogger(__name__)
+  host = urlparse( url ).netloc
+  with SESSLOCK:
+    session = None if refresh else SESSIONS.get( host, None )
+    if session is not None:
+      return session
+
+    if not refresh:
+      session = requests.Session()
+      session.auth = (username, password)
+      if loadCookies( session, cookiejar ):
+        log.debug( f'Using persisted cookies for : {host}' )
+        SESSIONS[host] = session
+        return session
+      session.close()
+
+    old = SESSIONS.pop( host, None )
+    if old is not None:
+      old.close()
+    log.debug( f'Logging in for : {host}' )
+    session = setup_session( username, password, check_url = url )
+    saveCookies( session, cookiejar )
+    SESSIONS[host] = session
+  return session
+
+def closeSessions():
+  """Close all pooled sessions"""
+
+  with SESSLOCK:
+    for session in SESSIONS.values():
+      try:
+        session.close()
+      except:
+        pass
+    SESSIONS.clear()
+
+def hyperslab( slices ):
+  """
+  Convert tuple of slice objects to DAP2 hyperslab constraint
+
+  Arguments:
+    slices (tuple) : Slice objects for each dimension; stop is exclusive
+
+  Returns:
+    str : Hyperslab constraint; e.g., [0:1:7][0:1:360]
+
+  """
+
+  out = []
+  for s in slices:
+    step = 1 if s.step is None else s.step
+    out.append( '[{}:{}:{}]'.format( s.start, step, s.stop-1 ) )                # DAP stop index is inclusive
+  return ''.join( out )
+
+def isTooLarge( err ):
+  """Check if request failed because response is over server size limit"""
+
+  if errorStatus( err ) == 413:
+    return True
+  msg = str(err).lower()
+  return any( phrase in msg for phrase in TOOLARGE )
+
+def splitHyperslab( slices, itemsize, maxBytes ):
+  """
+  Split hyperslab into pieces no larger than maxBytes
+
+  Pieces are taken along the first dimension (time) and, if a single
+  time step is still too large, along the second dimension (level).
+  The last two dimensions (latitude, longitude) are never split.
+
+  Arguments:
+    slices (tuple) : Slices, with explicit start and stop, defining
+      hyperslab on remote
+    itemsize (int) : Bytes per value
+    maxBytes (int) : Maximum bytes in a piece
+
+  Returns:
+    list : List of (remoteSlices, localSlices) tuples where localSlices
+      are the indices of the piece within the full hyperslab. A single
+      piece is returned if the hyperslab is small enough or cannot be
+      split.
+
+  """
+
+  if any( not isinstance(s, slice) or s.start is None or s.stop is None for s in slices ):
+    return [(tuple(slices), None)]
+  counts = [len( range(s.start, s.stop, s.step or 1) ) for s in slices]
+  if len(slices) < 3 or int( np.prod(counts) ) * itemsize <= maxBytes:
+    return [(tuple(slices), None)]
+
+  for axis in range( len(slices)-2 ):                                           # Find first axis where a piece of one index fits
+    inner = int( np.prod( counts[axis+1:] ) ) * itemsize
+    if inner <= maxBytes: break
+  n      = max( 1, maxBytes // inner )                                          # Indices per piece along split axis
+  pieces = []
+  for lead in itertools.product( *[range(c) for c in counts[:axis]] ):
+    for i in range( 0, counts[axis], n ):
+      bounds = [(j, j+1) for j in lead] + [(i, min(i+n, counts[axis]))] + [(0, c) for c in counts[axis+1:]]
+      remote = tuple( slice( s.start + a*(s.step or 1), s.start + (b-1)*(s.step or 1) + 1, s.step )
+                        for s, (a, b) in zip( slices, bounds ) )
+      pieces.append( (remote, tuple( slice(a, b) for a, b in bounds )) )
+  return pieces
+
+def dodsValues( var ):
+  """
+  Values, and coordinates if a grid, of variable from DODS response
+
+  Arguments:
+    var : pydap BaseType or GridType from open_dods
+
+  Returns:
+    tuple : Values, in native byte order, and dict of coordinate values
+      keyed by dimension name; empty if not a grid
+
+  """
+
+  if hasattr(var, 'maps'):                                                      # If is a grid, get coordinate data too
+    values = np.asarray( var.array.data )
+    coords = {key : nativeByteOrder( np.asarray(val.data), inplace = True ) for key, val in var.maps.items()}
   else:
-    log.debug( "No 'missing_value' attribute" );
-
-  if 'scale_factor' in atts and 'add_offset' in atts:
-    log.debug( "Scaling to data" );
-    data = data * atts['scale_factor'] + atts['add_offset']
-  if bad is not None:
-    if np.sum(bad) > 0:
-      log.debug( 'Replacing missing and fill values with NaN characters' );
-      if data.dtype.kind != 'f':
-        log.debug( 'Converting data to floating point array' );
-        data = data.astype(np.float32);
-  data[bad] = np.nan if fillValue is None else fillValue;
-  return data   
+    values = np.asarray( var.data )
+    coords = {}
+  return nativeByteOrder( values, inplace = True ), coords
 
 class PyDAPDataset():
 
   def __init__(self, url, **kwargs):
-    self._session = None
-    self._dataset = None
+    self._session  = None
+    self._dataset  = None
+    self._freshDAS = True                                                       # Attributes of dataset are those of this granule
 
     self.log      = logging.getLogger(__name__)
    
     self.url      = url
-    self.retry    = kwargs.get('retry', 3)
+    self.policy   = kwargs.pop('retryPolicy', None) or RetryPolicy()            # Backoff policy for failed requests
+    self.breaker  = kwargs.pop('breaker',     None) or getBreaker( url )        # Circuit breaker shared by all datasets/workers on host
+    self.retry    = kwargs.get('retry', self.policy.retries)
+    self.cache    = kwargs.pop('cache', None)                                   # MetadataCache instance for collection, if any
+    self.maxRequestBytes = kwargs.pop('maxRequestBytes', MAXREQUESTBYTES)      # Larger requests are split; see getValues()
+    self.splitWorkers    = kwargs.pop('splitWorkers',    SPLITWORKERS)
     self.kwargs   = kwargs
 
     self._initDataset()
@@ -107,26 +347,25 @@ class PyDAPDataset():
       return getattr(self._dataset, key, None)
     return None
 
-  def _initSession(self):
+  def _initSession(self, refresh = False):
     """
     Initiailze pydap session for loading data
 
-    Initialize a session for a data set given a username, password, and
-    URL for the data. Any previously open sessions are closed
+    Get a session for a data set from the session pool given a username,
+    password, and URL for the data. 
+
+    Keyword arguments:
+      refresh (bool) : If set, force new login for the session
 
     """
 
     self.log.debug( f'Initializing session : {self.url}' )
     try:
-      self._session.close()
-    except Exception as err:
-      self.log.debug( f'Failed to close previous session: {err}' )
-
-    try:
-      self._session  = setup_session(
+      self._session  = getSession(
+              self.url,
               self.kwargs.get('username', USER), 
               self.kwargs.get('password', PASSWD), 
-              check_url = self.url
+              refresh = refresh
       )
     except Exception as err:
       self.log.error( f'Failed to start session: {err}' )
@@ -134,8 +373,17 @@ class PyDAPDataset():
 
     return True
 
-  def _initDataset(self):
-    """Open pydap dataset for reading"""
+  def _initDataset(self, refresh = False):
+    """
+    Open pydap dataset for reading
+
+    If opening fails with an authentication error, the pooled session is
+    refreshed and the dataset opened again.
+
+    Keyword arguments:
+      refresh (bool) : If set, force new login for the session
+
+    """
     
     self.log.debug( f'Loading dataset : {self.url}' )
     try:
@@ -144,41 +392,109 @@ class PyDAPDataset():
       self.log.debug( f'Failed to close previous dataset: {err}' )
       pass
 
-    if not self._initSession():
+    if not self._initSession( refresh ):
       return False
 
     try:
-      self._dataset = open_url( self.url, session = self._session )
+      self._dataset = self._openDataset()
     except Exception as err:
+      if isAuthError( err ) and not refresh:
+        self.log.info( 'Authentication failed, refreshing session' )
+        return self._initDataset( refresh = True )
       self.log.error( f'Failed to open dataset: {err}' )
       return False
 
+    if self.cache is not None and self.cache.getDDS() is None:                  # Record all variables once per collection; used for planning
+      self.cache.setDDS( {name : (var.dimensions, var.shape, var.dtype)
+                            for name, var in self._dataset.items()} )
     return True
 
-  def _randomReload(self):
+  def _openDataset(self):
+    """
+    Open pydap dataset, from cached DDS and DAS if possible
+
+    With a metadata cache, the DDS and DAS are downloaded for the first
+    granule of the collection only; later granules are opened from the
+    cached text without any requests. Attributes that differ between
+    granules (variables excluded from the cache, e.g., time) are updated
+    from this granule's DAS when first requested; see getVarAtts().
+
+    Returns:
+      pydap DatasetType
+
     """
-    Reload dataset after random delay
-    
-    Close remote file, sleep random amount of time between 15 and 30 mintues,
-    then reopne remote dataset
 
+    if self.cache is None or not CACHEDHANDLER:
+      return open_url( self.url, session = self._session )
+
+    dds = self.cache.getText( 'dds' )
+    das = self.cache.getText( 'das' )
+    self._freshDAS = das is None
+    if dds is None:
+      dds = self._getText( 'dds' )
+      self.cache.setText( 'dds', dds )
+    if das is None:
+      das = self._getText( 'das' )
+      self.cache.setText( 'das', das )
+    if not self._freshDAS:
+      self.log.debug( f'Opening dataset from cached DDS and DAS : {self.url}' )
+    return CachedDAPHandler( self.url, dds, das, session = self._session ).dataset
+
+  def _getText(self, kind):
+    """Download DDS or DAS of dataset"""
+
+    resp = self._session.get( f'{self.url}.{kind}', timeout = DEFAULT_TIMEOUT )
+    resp.raise_for_status()
+    return resp.text
+
+  def _retry(self, err, attempt, retry, what):
     """
+    Handle failed request and determine if it should be retried
+
+    Authentication errors refresh the pooled session and are retried
+    right away. Server (5xx) and timeout errors are recorded with the
+    host circuit breaker and retried after an exponential backoff.
+    Other client (4xx) errors are not retried.
+
+    Arguments:
+      err (Exception) : Exception that caused the failure
+      attempt (int) : Number of the attempt that failed
+      retry (int) : Maximum number of attempts
+      what (str) : Description of what was being requested
+
+    Returns:
+      bool : True if request should be tried again, False otherwise
+
+    """
+
+    kind = classifyError( err )
+    self.log.warning( FAILEDFMT.format(attempt, retry, what) + f' ({kind}) : {err}' )
+    if kind == CLIENT or attempt >= retry:
+      return False
 
-    self.log.debug( f'Reloading dataset, closing : {self.url}' )
     self.close()
-    dt = float( np.random.random( 1 ) )
-    dt = (dt + 0.5) * 1800 
-    self.log.debug( 'Sleeping {:4.1f} mintues'.format( dt / 60.0 ) )
+    if kind == AUTH:
+      self._initDataset( refresh = True )
+      return True
+
+    if kind in (SERVER, TIMEOUT):
+      self.breaker.failure()
+    dt = self.policy.delay( attempt )
+    self.log.debug( 'Sleeping {:4.1f} seconds'.format( dt ) )
     time.sleep( dt )
+    self.breaker.wait()
     self._initDataset()
+    return True
 
   def close(self):
-    """Safely close remote dataset"""
+    """
+    Safely close remote dataset
+
+    The session is returned to the pool, not closed, so that it can be
+    reused by other datasets on the same host
+
+    """
 
-    try:
-      self._session.close()
-    except:
-      pass
     try:
       self._dataset.close()
     except:
@@ -187,6 +503,12 @@ class PyDAPDataset():
     self._dataset = None
 
   def getVarAtts( self, varName, retry = None ):
+    if self.cache is not None:
+      atts = self.cache.getAtts( varName )
+      if atts is not None:
+        self.log.debug( f'Using cached attributes : {varName}' )
+        return atts
+
     self.log.info( f'Getting attributes : {varName}' )
     if not isinstance(retry, int): retry = self.retry
 
@@ -194,47 +516,241 @@ class PyDAPDataset():
     while attempt < retry:
       attempt += 1
       try:
+        if not self._freshDAS and varName in self.cache.exclude:                # Cached DAS is from another granule, so get this granule's
+          add_attributes( self._dataset, parse_das( self._getText( 'das' ) ) )
+          self._freshDAS = True
         atts               = self._dataset[varName].attributes
         atts['dimensions'] = self._dataset[varName].dimensions
-      except:
-        self.log.warning( FAILEDFMT.format(attempt, retry, 'attributes') )
-        self._randomReload()
+      except Exception as err:
+        if not self._retry( err, attempt, retry, 'attributes' ): break
       else:
+        if self.cache is not None:
+          self.cache.setAtts( varName, atts )
+          self.cache.setShape( varName, self._dataset[varName].shape )
         return atts
     return None
 
   def getValues( self, varName, slices = None, retry = None ):
-    self.log.info( f'Getting data : {varName}' )
+    """
+    Get values of remote variable
+
+    Requests larger than maxRequestBytes are split along time or level
+    and the pieces are fetched concurrently; see getValuesSplit(). If
+    the server rejects a request as too large anyway, it is split in
+    half, and the smaller limit is used for later requests.
+
+    Arguments:
+      varName (str) : Name of variable to get
+
+    Keyword arguments:
+      slices (tuple) : Slices of hyperslab to get; full variable if None
+      retry (int) : Maximum number of attempts
+
+    Returns:
+      numpy.ndarray : Values; None if request failed
+
+    """
+
     if not isinstance(retry, int): retry = self.retry
-    attempt = 0
-    dims    = self._dataset[varName].shape
     if slices is None:
-      slices = []
-      for i in range( len(dims) ):
-        slices.append( slice(0, dims[i]) )
-      slices = tuple( slices )
-  
+      slices = self.fullSlices( varName )
+
+    itemsize = self.itemsize( varName )
+    if itemsize is not None:
+      pieces = splitHyperslab( slices, itemsize, self.maxRequestBytes )
+      if len(pieces) > 1:
+        return self.getValuesSplit( varName, slices, pieces, retry )
+
+    self.log.info( f'Getting data : {varName}' )
+    values, err = self._getValues( varName, slices, retry )
+    if values is None and itemsize is not None and err is not None and isTooLarge( err ):
+      nbytes = int( np.prod( [len( range(s.start, s.stop, s.step or 1) ) for s in slices] ) ) * itemsize
+      pieces = splitHyperslab( slices, itemsize, nbytes // 2 )
+      if len(pieces) > 1:
+        self.log.info( f'Request too large for server, splitting : {varName}' )
+        self.maxRequestBytes = min( self.maxRequestBytes, nbytes // 2 )
+        return self.getValuesSplit( varName, slices, pieces, retry )
+    return values
+
+  def _getValues( self, varName, slices, retry ):
+    """Get hyperslab in one request; returns values and last error"""
+
+    attempt = 0
+    err     = None
     while attempt < retry:
       attempt += 1
+      self.breaker.wait()
       try:
         values = self._dataset[varName].data[ slices ]
-      except:
-        self.log.warning(FAILEDFMT.format(attempt, retry, 'data') )
-        self._randomReload()
+      except Exception as exc:
+        err = exc
+        if not self._retry( err, attempt, retry, 'data' ): break
       else:
-        return values
-    return None     
+        self.breaker.success()
+        return values, None
+    return None, err
+
+  def _getPiece( self, varName, slices ):
+    """
+    Get one piece of a split request
+
+    The piece is requested directly, with the pooled session, so that
+    pieces can be requested from several threads at once. The request
+    is made only once; failed pieces are retried by getValuesSplit().
+
+    Returns:
+      numpy.ndarray : Values; None if request failed
+
+    """
+
+    ce  = varName + hyperslab( slices )
+    url = '{}.dods?{}'.format( self.url, quote(ce, safe=',:') )
+    self.breaker.wait()
+    try:
+      values, _ = dodsValues( open_dods( url, session = self._session )[varName] )
+    except Exception as err:
+      if classifyError( err ) in (SERVER, TIMEOUT):
+        self.breaker.failure()
+      self.log.warning( f'Failed to get piece {ce} : {err}' )
+      return None
+    self.breaker.success()
+    return values
+
+  def getValuesSplit( self, varName, slices, pieces, retry = None ):
+    """
+    Get hyperslab as several smaller requests
+
+    Pieces are fetched concurrently, with splitWorkers threads, into
+    one preallocated array. Pieces that fail are then retried one at a
+    time, each with the full retry policy, so one bad piece does not
+    cause the whole hyperslab to be downloaded again.
+
+    Arguments:
+      varName (str) : Name of variable to get
+      slices (tuple) : Slices of full hyperslab
+      pieces (list) : (remoteSlices, localSlices) pieces; see
+        splitHyperslab()
+
+    Keyword arguments:
+      retry (int) : Maximum number of attempts for a failed piece
+
+    Returns:
+      numpy.ndarray : Values; None if any piece failed
+
+    """
+
+    if not isinstance(retry, int): retry = self.retry
+    self.log.info( f'Getting data in {len(pieces)} pieces : {varName}' )
+    shape  = tuple( len( range(s.start, s.stop, s.step or 1) ) for s in slices )
+    values = None
+    failed = []
+    with ThreadPoolExecutor( max( 1, min(self.splitWorkers, len(pieces)) ) ) as pool:
+      futures = {pool.submit( self._getPiece, varName, remote ) : (remote, local)
+                   for remote, local in pieces}
+      for future in as_completed( futures ):
+        piece = future.result()
+        if piece is None:
+          failed.append( futures[future] )
+          continue
+        if values is None:
+          values = np.empty( shape, dtype = piece.dtype )
+        values[ futures[future][1] ] = piece
+
+    for remote, local in failed:
+      self.log.info( f'Retrying piece of {varName} : {hyperslab(remote)}' )
+      piece, _ = self._getValues( varName, remote, retry )
+      if piece is None:
+        return None
+      piece = nativeByteOrder( piece, inplace = True )
+      if values is None:
+        values = np.empty( shape, dtype = piece.dtype )
+      values[local] = piece
+    return values
+
+  def itemsize( self, varName ):
+    """Bytes per value of remote variable; None if not known"""
+
+    try:
+      return np.dtype( self._dataset[varName].dtype ).itemsize
+    except Exception:
+      return None
+
+  def fullSlices( self, varName ):
+    """Slices covering the full extent of a remote variable"""
+
+    shape = None
+    if self.cache is not None:
+      shape = self.cache.getShape( varName )
+    if shape is None:
+      shape = self._dataset[varName].shape
+    return tuple( slice(0, n) for n in shape )
+
+  def getValuesCombined( self, request ):
+    """
+    Get data for many variables in a single request
+
+    A single DAP constraint expression is built covering all requested
+    variables and hyperslabs so that all data are transferred in one
+    round trip. For variables that are grids, the map (coordinate)
+    vectors for the hyperslab are returned as well.
+
+    Arguments:
+      request (list) : List of (varName, slices) tuples. If slices is
+        None, the full variable is requested.
+
+    Returns:
+      list : List of (values, coords) tuples, in same order as request,
+        where coords is a dict of coordinate values keyed by dimension
+        name. None is returned if the request fails so that callers can
+        fall back to per-variable requests.
+
+    """
+
+    names = [varName for varName, _ in request]
+    if len(set(names)) != len(names):                                           # Response is keyed by name, so cannot request same variable twice
+      self.log.debug( 'Variable requested more than once, cannot combine' )
+      return None
+
+    ce = []
+    for varName, slices in request:
+      if slices is None: slices = self.fullSlices( varName )
+      ce.append( varName + hyperslab( slices ) )
+    ce  = ','.join( ce )
+    url = '{}.dods?{}'.format( self.url, quote(ce, safe=',:') )
+
+    self.log.info( f'Getting data : {ce}' )
+    self.breaker.wait()
+    try:
+      dataset = open_dods( url, session = self._session )
+    except Exception as err:
+      kind = classifyError( err )
+      if kind == AUTH:
+        self._initDataset( refresh = True )
+      elif kind in (SERVER, TIMEOUT):
+        self.breaker.failure()
+      self.log.warning( f'Failed to get combined request ({kind}) : {err}' )
+      return None
+    self.breaker.success()
+
+    return [dodsValues( dataset[varName] ) for varName in names]
 
   def getVar( self, varName, slices = None, scaleandfill = False):
     atts = self.getVarAtts( varName )
     if atts is not None:
-      values = self.getValues( varName, slices = slices)
+      values = None
+      if self.cache is not None:
+        values = self.cache.getValues( varName, slices = slices )
+      if values is None:
+        values = self.getValues( varName, slices = slices)
+        if values is not None:
+          values = nativeByteOrder( values, inplace = True )
+          if self.cache is not None and slices is None:                         # Only full variables are cached
+            self.cache.setValues( varName, values )
+      else:
+        self.log.debug( f'Using cached values : {varName}' )
       if values is not None:
-        if values.dtype.byteorder == SWAPPED:
-          dt     = np.dtype( str(values.dtype).replace(SWAPPED, NATIVE)  )
-          values = values.astype( dt )
         if scaleandfill:
-          return scaleFillData(values, atts), atts
+          return scaleFillData(values, atts, inplace = True), atts
         else:
           return values, atts
     return None, None
@@ -0,0 +1,126 @@
+"""
+Plan remote requests for hyperslab selections
+
+Helpers shared by the remote data clients and the MERRA-2 downloader:
+sizes of hyperslabs given as slices, and grouping of several selections
+of the same variables into as few requests as is worthwhile.
+
+"""
+import itertools
+
+import numpy as np
+
+REQUESTBYTES = 2**18                                                            # Approximate cost, in bytes transferred, of one extra remote request
+
+def sliceLen( s ):
+  """Number of elements selected by slice with explicit start/stop"""
+
+  return len( range(s.start, s.stop, s.step or 1) )
+
+def slabSize( slices ):
+  """Number of elements in hyperslab"""
+
+  return int( np.prod( [sliceLen(s) for s in slices] ) )
+
+def _mergeable( a, b ):
+  """Check if hyperslabs lie on the same strided grid along every dimension"""
+
+  for sa, sb in zip( a, b ):
+    step = sa.step or 1
+    if (sb.step or 1) != step or (sa.start - sb.start) % step != 0:
+      return False
+  return True
+
+def _bounding( a, b ):
+  """Smallest hyperslab containing both hyperslabs"""
+
+  out = []
+  for sa, sb in zip( a, b ):
+    step  = sa.step or 1
+    start = min( sa.start, sb.start )
+    last  = max( sa.start + (sliceLen(sa)-1) * step, sb.start + (sliceLen(sb)-1) * step )
+    out.append( slice( start, last+1, sa.step ) )
+  return tuple( out )
+
+def _localSlices( cover, slices ):
+  """Location of hyperslab within the covering hyperslab"""
+
+  out = []
+  for c, s in zip( cover, slices ):
+    i = (s.start - c.start) // (c.step or 1)
+    out.append( slice( i, i + sliceLen(s) ) )
+  return tuple( out )
+
+def planRequests( selections, itemsize = 4, requestBytes = REQUESTBYTES ):
+  """
+  Plan remote requests for several selections
+
+  Selections of the same variable are grouped, and overlapping or
+  nearby hyperslabs are merged into their bounding hyperslab whenever
+  the extra data downloaded costs less than making another request.
+  Each covering hyperslab is then downloaded once and split locally
+  into the selections it contains.
+
+  Arguments:
+    selections (list) : List of (varName, slices) tuples
+
+  Keyword arguments:
+    itemsize (int) : Bytes per value; used to compare cost of extra data
+      with the cost of a request
+    requestBytes (int) : Cost of one request, in bytes
+
+  Returns:
+    list : List of (varName, coverSlices, members) tuples, one per
+      request to make, where members is a list of (index, localSlices)
+      tuples giving the index of each selection in selections and the
+      slices that extract it from the covering hyperslab
+
+  """
+
+  groups = {}
+  for i, (varName, slices) in enumerate( selections ):
+    groups.setdefault( varName, [] ).append( i )
+
+  fetches = []
+  for varName, index in groups.items():                                         # dict keeps order of first appearance
+    covers = [(tuple(selections[i][1]), [i]) for i in index]
+    while len(covers) > 1:
+      best = None
+      for a, b in itertools.combinations( range(len(covers)), 2 ):
+        if not _mergeable( covers[a][0], covers[b][0] ): continue
+        box    = _bounding( covers[a][0], covers[b][0] )
+        saving = (slabSize( covers[a][0] ) + slabSize( covers[b][0] ) - slabSize( box )) * itemsize + requestBytes
+        if saving >= 0 and (best is None or saving > best[0]):
+          best = (saving, a, b, box)
+      if best is None: break
+      _, a, b, box = best
+      covers[a] = (box, covers[a][1] + covers[b][1])
+      covers.pop( b )
+
+    for cover, members in covers:
+      fetches.append( (varName, cover,
+                       [(i, _localSlices( cover, selections[i][1] )) for i in sorted(members)]) )
+  return fetches
+
+def combinable( fetches ):
+  """
+  Requests that can be made together in a single combined request
+
+  A combined response is keyed by variable name, so only the first
+  request for each variable is included.
+
+  Arguments:
+    fetches (list) : Requests from planRequests
+
+  Returns:
+    list : Indices into fetches
+
+  """
+
+  seen  = set()
+  index = []
+  for i, (varName, _, _) in enumerate( fetches ):
+    if varName in seen: continue
+    seen.add( varName )
+    index.append( i )
+  return index
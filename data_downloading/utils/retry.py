@@ -0,0 +1,254 @@
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+from urllib.parse import urlparse
+
+import numpy as np
+
+HOME       = os.path.expanduser('~')
+BREAKERDIR = os.path.join( HOME, '.cache', 'data_downloading', 'breakers' )   # Circuit breaker state is stored here so all worker processes share it
+
+AUTH       = 'auth'                                                            # Error classes returned by classifyError
+SERVER     = 'server'
+TIMEOUT    = 'timeout'
+CLIENT     = 'client'
+OTHER      = 'other'
+
+STATUSRE   = re.compile( r'\bHTTP(?:\s+Error)?(?:\s+occurred)?:?\s+([1-5]\d\d)\b', re.IGNORECASE )
+
+BREAKERS   = {}                                                                 # Pool of circuit breakers keyed by host
+BREAKLOCK  = threading.Lock()
+
+def networkErrors():
+  """Exception types raised for timeouts and failed or dropped connections"""
+
+  errors = (socket.timeout, TimeoutError, ConnectionError)
+  try:
+    import requests
+    errors += (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+  except ImportError:
+    pass
+  try:
+    import aiohttp
+    errors += (aiohttp.ClientConnectionError,)
+  except ImportError:
+    pass
+  return errors
+
+def attributeStatus( obj ):
+  """HTTP status code from status attribute of exception or response"""
+
+  for attr in ('status_code', 'status', 'code'):
+    code = getattr(obj, attr, None)
+    if code is None or isinstance(code, bool): continue
+    try:
+      code = int( str(code)[:3] )                                               # Some responses give status as, e.g., '404 Not Found'
+    except:
+      continue
+    if 100 <= code < 600:
+      return code
+  return None
+
+def errorStatus( err ):
+  """
+  Get HTTP status code from exception, if any
+
+  The status is taken from the exception, or the response attached to
+  it, and then from the exceptions it was raised from (pydap wraps the
+  requests error). Failing that, the message is searched for an explicit
+  HTTP status (e.g., 'HTTP Error 503'); bare three-digit numbers are
+  not used as they are often port numbers (e.g., port=443).
+
+  Arguments:
+    err (Exception) : Exception raised while accessing remote data
+
+  Returns:
+    int : HTTP status code; None if could not be determined
+
+  """
+
+  seen = set()
+  exc  = err
+  while exc is not None and id(exc) not in seen:
+    seen.add( id(exc) )
+    for obj in (exc, getattr(exc, 'response', None)):
+      if obj is None: continue
+      code = attributeStatus( obj )
+      if code is not None:
+        return code
+    exc = exc.__cause__
+
+  match = STATUSRE.search( str(err) )
+  return int( match.group(1) ) if match else None
+
+def classifyError( err ):
+  """
+  Classify exception so that appropriate retry action can be taken
+
+  Timeouts and connection failures are recognized by type first, so
+  that their messages are never mistaken for an HTTP status.
+
+  Arguments:
+    err (Exception) : Exception raised while accessing remote data
+
+  Returns:
+    str : One of AUTH (401), SERVER (5xx), TIMEOUT (timeout or
+      connection failure), CLIENT (other 4xx), or OTHER
+
+  """
+
+  if isinstance(err, networkErrors()):
+    return TIMEOUT
+
+  status = errorStatus( err )
+  if status == 401:
+    return AUTH
+  elif status is not None and status >= 500:
+    return SERVER
+  elif status is not None and status >= 400:
+    return CLIENT
+
+  if 'timed out' in str(err).lower():
+    return TIMEOUT
+  return OTHER
+
+class RetryPolicy():
+  """
+  Exponential backoff with jitter for remote requests
+
+  The delay before retry n is base * factor**(n-1), capped at maxDelay,
+  and multiplied by a random factor in [1-jitter, 1+jitter] so that
+  many workers do not retry in lock step.
+
+  """
+
+  def __init__(self, retries = 5, base = 2.0, factor = 2.0, maxDelay = 120.0, jitter = 0.5):
+    """
+    Keyword arguments:
+      retries (int) : Maximum number of attempts for a request
+      base (float) : Delay, in seconds, before first retry
+      factor (float) : Multiplicative increase of delay per retry
+      maxDelay (float) : Maximum delay, in seconds, between attempts
+      jitter (float) : Fractional random variation of delay
+
+    """
+
+    self.retries  = retries
+    self.base     = base
+    self.factor   = factor
+    self.maxDelay = maxDelay
+    self.jitter   = jitter
+
+  def delay(self, attempt):
+    """
+    Compute delay before next attempt
+
+    Arguments:
+      attempt (int) : Number of the attempt that just failed; starts at 1
+
+    Returns:
+      float : Seconds to wait before next attempt
+
+    """
+
+    dt = min( self.base * self.factor**(attempt-1), self.maxDelay )
+    return dt * (1.0 + self.jitter * (2.0 * np.random.random() - 1.0))
+
+class CircuitBreaker():
+  """
+  Per-host circuit breaker shared by all workers
+
+  After threshold consecutive server or timeout failures for a host,
+  the breaker opens and all requests to that host, from any process
+  using the same state directory, are paused for cooldown seconds.
+  This way, when a server is genuinely down, everything waits once
+  rather than each worker backing off on its own.
+
+  """
+
+  def __init__(self, host, threshold = 5, cooldown = 300.0, statedir = BREAKERDIR):
+    """
+    Arguments:
+      host (str) : Remote host name
+
+    Keyword arguments:
+      threshold (int) : Consecutive failures before breaker opens
+      cooldown (float) : Seconds breaker stays open
+      statedir (str) : Directory to store breaker state in
+
+    """
+
+    self.log       = logging.getLogger(__name__)
+    self.host      = host
+    self.threshold = threshold
+    self.cooldown  = cooldown
+    self.path      = os.path.join( statedir, host )
+    self._count    = 0
+    self._lock     = threading.Lock()
+
+  def openUntil(self):
+    """Time (seconds since epoch) breaker is open until; zero if closed"""
+
+    try:
+      with open(self.path, 'r') as fid:
+        return float( fid.read() )
+    except:
+      return 0.0
+
+  def isOpen(self):
+    return self.openUntil() > time.time()
+
+  def wait(self):
+    """Block until the breaker is closed"""
+
+    dt = self.openUntil() - time.time()
+    if dt > 0:
+      self.log.warning( 'Circuit open for {}, pausing {:.0f} s'.format(self.host, dt) )
+      time.sleep( dt )
+
+  def success(self):
+    """Record successful request"""
+
+    with self._lock:
+      self._count = 0
+
+  def failure(self):
+    """Record failed request; opens breaker if threshold is reached"""
+
+    with self._lock:
+      self._count += 1
+      if self._count < self.threshold: return
+      self._count = 0
+
+    if self.isOpen(): return                                                    # Another worker already opened it
+    self.log.error( 'Too many failures for {}, opening circuit for {:.0f} s'.format(self.host, self.cooldown) )
+    os.makedirs( os.path.dirname(self.path), exist_ok = True )
+    tmp = f'{self.path}.{os.getpid()}'
+    with open(tmp, 'w') as fid:
+      fid.write( str( time.time() + self.cooldown ) )
+    os.replace( tmp, self.path )
+
+def getBreaker( url, **kwargs ):
+  """
+  Get circuit breaker for host of URL from the pool
+
+  Arguments:
+    url (str) : URL of remote data
+
+  Keyword arguments:
+    **kwargs : Passed to CircuitBreaker if a new one is created
+
+  Returns:
+    CircuitBreaker
+
+  """
+
+  host = urlparse( url ).netloc
+  with BREAKLOCK:
+    if host not in BREAKERS:
+      BREAKERS[host] = CircuitBreaker( host, **kwargs )
+    return BREAKERS[host]
@@ -0,0 +1,57 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip( 'aiohttp' )
+
+from data_downloading.utils.asyncDAP import DATAMARK, AsyncDAPClient
+
+DDS = '''Dataset {
+    Float64 lon[lon = 3];
+    Int32 time[time = 2];
+    Grid {
+     Array:
+        Float32 T[time = 2][lon = 3];
+     Maps:
+        Int32 time[time = 2];
+        Float64 lon[lon = 3];
+    } T;
+} test.nc4;'''
+
+LON  = np.array( [0.0, 120.0, 240.0] )
+TIME = np.array( [0, 180], dtype = 'i4' )
+T    = np.arange( 6, dtype = 'f4' ).reshape( 2, 3 )
+
+def xdr( values, dtype ):
+  values = np.asarray( values, dtype = dtype )
+  return np.array( [values.size] * 2, dtype = '>u4' ).tobytes() + values.tobytes()
+
+def dodsResponse():
+  """Response with variables in dataset order, as Hyrax sends them"""
+
+  data = xdr( LON, '>f8' ) + xdr( TIME, '>i4' ) + xdr( T, '>f4' ) + xdr( TIME, '>i4' ) + xdr( LON, '>f8' )
+  return DDS.encode() + DATAMARK + data
+
+class FakeClient( AsyncDAPClient ):
+  async def get(self, url):
+    return dodsResponse()
+
+def getData( request ):
+  return asyncio.run( FakeClient().getData( 'http://test/test.nc4', request ) )
+
+def test_getData_returns_request_order():
+  out = getData( [('T', None), ('time', None), ('lon', None)] )
+  np.testing.assert_array_equal( out[0][0], T )
+  np.testing.assert_array_equal( out[0][1]['lon'], LON )
+  np.testing.assert_array_equal( out[1][0], TIME )
+  np.testing.assert_array_equal( out[2][0], LON )
+  assert out[1][1] == {} and out[2][1] == {}
+
+def test_getData_rejects_repeated_variable():
+  with pytest.raises( ValueError ):
+    getData( [('T', None), ('T', None)] )
+
+def test_getData_missing_variable():
+  with pytest.raises( Exception, match = 'missing' ):
+    getData( [('U', None)] )
@@ -0,0 +1,30 @@
+import numpy as np
+
+from data_downloading.utils.dataScaler import DataScaler
+
+def test_mergeRanges_matches_range_of_all_data():
+  scaler = DataScaler()
+  data   = np.random.default_rng( 0 ).normal( size = (4, 5, 6) ).astype( 'f4' )
+  data[1, 2, 3] = np.nan
+  ranges = [scaler.dataRange( chunk ) for chunk in data]
+  assert scaler.mergeRanges( ranges ) == scaler.dataRange( data )
+
+def test_mergeRanges_ignores_all_missing_chunks():
+  scaler = DataScaler()
+  ranges = [(np.nan, np.nan), (1.0, 2.0), (-3.0, 0.5)]
+  assert scaler.mergeRanges( ranges ) == (-3.0, 2.0)
+  assert all( np.isnan( scaler.mergeRanges( [(np.nan, np.nan)] ) ) )
+
+def test_scaleFromRange_matches_scaleData():
+  scaler = DataScaler()
+  data   = np.random.default_rng( 1 ).normal( 280.0, 10.0, size = (3, 50) ).astype( 'f4' )
+  data[0, :5] = np.nan
+  packed, scale, offset = scaler.scaleData( data.copy() )
+
+  dataMin, dataMax = scaler.mergeRanges( [scaler.dataRange( chunk ) for chunk in data] )
+  scale2, offset2  = scaler.scaleFromRange( dataMin, dataMax )
+  assert data.dtype.type( scale2 )  == scale
+  assert data.dtype.type( offset2 ) == offset
+  chunks = [scaler.packData( chunk, scale2, offset2 ) for chunk in data]
+  np.testing.assert_array_equal( np.stack( chunks ), packed )
+  assert np.all( packed[0, :5] == scaler.missing_value )
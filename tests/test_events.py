@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import pytest
+
+from data_downloading.merra2.events import DownloadEvents
+
+def failing( date, path ):
+  raise RuntimeError( 'hook failed' )
+
+def test_hook_error_raised_by_wait():
+  events = DownloadEvents( onGranule = failing, workers = 1, processes = False )
+  events.granuleDone( datetime(2000, 1, 1), 'a.nc4' )
+  with pytest.raises( RuntimeError, match = 'hook failed' ):
+    events.wait()
+
+def test_hook_error_does_not_replace_download_error():
+  events = DownloadEvents( onGranule = failing, workers = 1, processes = False )
+  with pytest.raises( ValueError, match = 'download failed' ):
+    with events:
+      events.granuleDone( datetime(2000, 1, 1), 'a.nc4' )
+      raise ValueError( 'download failed' )
+
+def test_period_completed_by_last_granule():
+  done   = []
+  events = DownloadEvents( onPeriod = lambda start, files: done.append( (start, files) ) )
+  dates  = [datetime(2000, 1, 30), datetime(2000, 1, 31), datetime(2000, 2, 1)]
+  events.expect( [(date, f'{date:%Y%m%d}') for date in dates], [(date, None) for date in dates] )
+  for date in dates[:2]:
+    for start, files in events.granuleDone( date, None ):
+      events.periodDone( start, files )
+  assert done == [(datetime(2000, 1, 1), ['20000130', '20000131'])]
+  assert events.remaining() == [(datetime(2000, 2, 1), ['20000201'])]
@@ -0,0 +1,64 @@
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip( 'idlpy' )
+netCDF4 = pytest.importorskip( 'netCDF4' )
+
+from data_downloading.merra2.utils.fileCombine import fileCombine
+
+def writeGranule( path, day, rng ):
+  with netCDF4.Dataset( path, 'w' ) as oid:
+    oid.createDimension( 'time', 2 )
+    oid.createDimension( 'lat',  3 )
+    oid.createDimension( 'lon',  4 )
+    vid       = oid.createVariable( 'time', 'f8', ('time',) )
+    vid.units = f'minutes since 2010-01-{day:02d} 00:00:00'
+    vid[:]    = [0, 720]
+    oid.createVariable( 'lat', 'f4', ('lat',) )[:] = [-1, 0, 1]
+    oid.createVariable( 'lon', 'f4', ('lon',) )[:] = [0, 90, 180, 270]
+    for name, mean in (('T', 280.0), ('RH', 0.5)):
+      vid       = oid.createVariable( name, 'f4', ('time', 'lat', 'lon'), fill_value = 1.0e15 )
+      vid.units = 'K' if name == 'T' else '1'
+      values    = rng.normal( mean, day, size = (2, 3, 4) )
+      values[0, 0, day % 4] = 1.0e15                                            # Missing value
+      vid[:]    = values
+
+@pytest.fixture
+def granules( tmp_path ):
+  rng   = np.random.default_rng( 0 )
+  files = []
+  for day in range( 1, 4 ):                                                     # Each day has a different range
+    path = str( tmp_path / f'granule.{day}.nc4' )
+    writeGranule( path, day, rng )
+    files.append( path )
+  return files
+
+def combine( tmp_path, granules, name, **kwargs ):
+  files = []
+  for path in granules:                                                         # Input files are removed once combined
+    copy = path.replace( 'granule', name )
+    shutil.copy( path, copy )
+    files.append( copy )
+  outfile = str( tmp_path / 'out' / f'{name}.nc4' )
+  fileCombine( outfile, files, **kwargs )
+  out = {}
+  with netCDF4.Dataset( outfile, 'r' ) as iid:
+    iid.set_auto_maskandscale( False )
+    for varName in ('T', 'RH', 'time'):
+      var = iid[varName]
+      out[varName] = (var[:], {att : var.getncattr(att) for att in var.ncattrs()})
+  return out
+
+@pytest.mark.parametrize( 'kwargs', [{'streaming' : True}, {'streaming' : True, 'workers' : 2}] )
+def test_two_pass_packing_matches_single_pass( tmp_path, granules, kwargs ):
+  single = combine( tmp_path, granules, 'single', streaming = False )
+  double = combine( tmp_path, granules, 'double', **kwargs )
+  for varName in ('T', 'RH', 'time'):
+    np.testing.assert_array_equal( double[varName][0], single[varName][0] )
+    assert double[varName][1].keys() == single[varName][1].keys()
+    for att, value in single[varName][1].items():
+      assert double[varName][1][att] == value
+  assert single['T'][0].dtype == np.int16
+  assert np.count_nonzero( single['T'][0] == single['T'][1]['_FillValue'] ) == 3
@@ -0,0 +1,82 @@
+import json
+import multiprocessing as mp
+import os
+import time
+
+from data_downloading.utils.granuleLock import GranuleLock
+
+def writeStale( path, age = 3600.0 ):
+  """Lock left by a worker on another host that stopped updating it"""
+
+  with open(path, 'w') as fid:
+    json.dump( {'host' : 'otherhost', 'pid' : 5}, fid )
+  t = time.time() - age
+  os.utime( path, (t, t) )
+
+def contender( path, barrier, holders, most, results ):
+  lock = GranuleLock( path, stale = 60.0, poll = 0.01 )
+  barrier.wait()
+  got = lock.acquire( blocking = False )
+  if got:
+    with holders.get_lock():
+      holders.value += 1
+      most.value     = max( most.value, holders.value )
+    time.sleep( 0.2 )
+    with holders.get_lock():
+      holders.value -= 1
+    lock.release()
+  results.put( got )
+
+def test_stale_lock_broken( tmp_path ):
+  path = str( tmp_path / 'granule.nc4.lock' )
+  writeStale( path )
+  lock = GranuleLock( path, stale = 60.0 )
+  assert lock.isStale()
+  assert lock.acquire( blocking = False )
+  assert lock.readOwner()['pid'] == os.getpid()
+  lock.release()
+  assert not os.path.exists( path )
+
+def test_fresh_lock_not_broken( tmp_path ):
+  path  = str( tmp_path / 'granule.nc4.lock' )
+  owner = GranuleLock( path, stale = 60.0 )
+  assert owner.acquire( blocking = False )
+  other = GranuleLock( path, stale = 60.0 )
+  other.owner['host'] = 'otherhost'
+  assert not other.acquire( blocking = False )
+  owner.release()
+
+def test_break_after_lock_retaken( tmp_path ):
+  """Worker B found the lock stale, but A broke it and took it first"""
+
+  path = str( tmp_path / 'granule.nc4.lock' )
+  writeStale( path )
+  a    = GranuleLock( path, stale = 60.0 )
+  b    = GranuleLock( path, stale = 60.0 )
+  b.owner['pid'] += 1
+  stat = b.staleStat()
+  assert stat is not None
+  assert a.acquire( blocking = False )
+  assert not b._breakStale( stat )                                              # Must put A's lock back
+  assert a.readOwner()['pid'] == a.owner['pid']
+  assert not b.acquire( blocking = False )
+  a.release()
+  assert [name for name in os.listdir( tmp_path )] == []
+
+def test_stale_lock_two_processes( tmp_path ):
+  ctx = mp.get_context( 'fork' )
+  for i in range( 10 ):
+    path    = str( tmp_path / f'granule{i}.nc4.lock' )
+    writeStale( path )
+    nProc   = 4
+    barrier = ctx.Barrier( nProc )
+    holders = ctx.Value( 'i', 0 )
+    most    = ctx.Value( 'i', 0 )
+    results = ctx.Queue()
+    procs   = [ctx.Process( target = contender, args = (path, barrier, holders, most, results) )
+                 for _ in range( nProc )]
+    for proc in procs: proc.start()
+    got = [results.get( timeout = 30 ) for _ in procs]
+    for proc in procs: proc.join()
+    assert any( got )
+    assert most.value == 1
@@ -0,0 +1,75 @@
+import itertools
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from data_downloading.utils.httpsGranule import (DEFLATE, FLETCHER32, SHUFFLE,
+                                                 chunkSelection, decodeChunk, mergeRanges)
+
+def chunkStarts( shape, chunks ):
+  return itertools.product( *[range(0, n, c) for n, c in zip(shape, chunks)] )
+
+@pytest.mark.parametrize( 'slices', [
+  (slice(0, 10, 1), slice(0, 7, 1)),
+  (slice(1, 10, 3), slice(2, 7, 2)),
+  (slice(3, 4, 1),  slice(0, 7, 5)),
+  (slice(2, 9, 4),  slice(6, 7, 1)),
+] )
+def test_chunkSelection_assembles_selection( slices ):
+  data   = np.arange( 70 ).reshape( 10, 7 )
+  chunks = (4, 3)
+  out    = np.full( [len(range(s.start, s.stop, s.step)) for s in slices], -1 )
+  for start in chunkStarts( data.shape, chunks ):
+    chunk   = data[ tuple( slice(c0, c0 + n) for c0, n in zip(start, chunks) ) ]
+    inChunk, inOut = chunkSelection( slices, start, chunks )
+    if any( s.stop <= s.start for s in inOut ):                                 # Chunk holds none of the selection
+      continue
+    out[inOut] = chunk[inChunk]
+  np.testing.assert_array_equal( out, data[slices] )
+
+def test_mergeRanges_groups_nearby_chunks():
+  chunks = [(300, 50, 'c'), (0, 100, 'a'), (120, 30, 'b'), (1000, 10, 'd')]
+  groups = mergeRanges( chunks, maxGap = 100, maxRange = 400 )
+  assert [(start, stop) for start, stop, _ in groups] == [(0, 150), (300, 350), (1000, 1010)]
+  assert [chunk[2] for chunk in groups[0][2]] == ['a', 'b']
+
+def test_mergeRanges_respects_maxRange():
+  chunks = [(i * 100, 100) for i in range(5)]
+  groups = mergeRanges( chunks, maxGap = 0, maxRange = 250 )
+  assert [(start, stop) for start, stop, _ in groups] == [(0, 200), (200, 400), (400, 500)]
+  assert sum( len(members) for _, _, members in groups ) == len(chunks)
+
+def fletcher32( raw ):
+  return raw + struct.pack( '<I', zlib.crc32( raw ) )                           # Checksum value is not checked when decoding
+
+def test_decodeChunk_undoes_filters_in_reverse():
+  values  = np.arange( 24, dtype = '>f4' ).reshape( 2, 3, 4 ) * 1.5
+  layout  = {'dtype'   : values.dtype.str, 'chunks' : values.shape,
+             'filters' : [(SHUFFLE, ()), (DEFLATE, (4,)), (FLETCHER32, ())]}
+  raw     = values.tobytes()
+  raw     = np.frombuffer( raw, np.uint8 ).reshape( -1, values.itemsize ).T.tobytes()
+  raw     = fletcher32( zlib.compress( raw ) )
+  np.testing.assert_array_equal( decodeChunk( raw, layout ), values )
+
+def test_decodeChunk_skips_masked_filters():
+  values  = np.arange( 6, dtype = '<i2' ).reshape( 2, 3 )
+  layout  = {'dtype'   : values.dtype.str, 'chunks' : values.shape,
+             'filters' : [(SHUFFLE, ()), (DEFLATE, (4,))]}
+  raw     = zlib.compress( values.tobytes() )                                   # Shuffle not applied to this chunk
+  np.testing.assert_array_equal( decodeChunk( raw, layout, mask = 1 ), values )
+
+def test_decodeChunk_reads_hdf5_chunks( tmp_path ):
+  h5py   = pytest.importorskip( 'h5py' )
+  from data_downloading.utils.httpsGranule import describeVariable
+
+  values = np.random.default_rng( 0 ).random( (6, 8) ).astype( 'f4' )
+  with h5py.File( tmp_path / 'test.h5', 'w' ) as fid:
+    dset   = fid.create_dataset( 'T', data = values, chunks = (3, 4), shuffle = True,
+                                 compression = 'gzip', fletcher32 = True )
+    layout = describeVariable( dset )
+    for start in chunkStarts( values.shape, layout['chunks'] ):
+      mask, raw = dset.id.read_direct_chunk( start )
+      chunk     = values[ tuple( slice(c0, c0 + n) for c0, n in zip(start, layout['chunks']) ) ]
+      np.testing.assert_array_equal( decodeChunk( raw, layout, mask ), chunk )
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+
+from datetime import datetime
+from types import SimpleNamespace
+
+from data_downloading.merra2.manifest import DownloadManifest, requestSignature
+
+ESDT = SimpleNamespace( shortName = 'M2I3NPASM' )
+URL  = 'https://goldsmr5.gesdisc.eosdis.nasa.gov/opendap/MERRA2/M2I3NPASM.5.12.4/2010/01/MERRA2_300.inst3_3d_asm_Np.20100101.nc4'
+DATE = datetime( 2010, 1, 1 )
+
+class Variable():
+  def __init__(self, name):
+    self.name = name
+  def spec(self):
+    return {'name' : self.name}
+
+def granule( tmp_path, name ):
+  path = tmp_path / name / 'granule.nc4'
+  path.parent.mkdir()
+  path.write_bytes( b'data' )
+  return str( path )
+
+def test_jobs_sharing_manifest_keep_own_rows( tmp_path ):
+  pathT  = granule( tmp_path, 'T' )
+  pathRH = granule( tmp_path, 'RH' )
+  with DownloadManifest( str(tmp_path / 'manifest.db') ) as db:
+    db.record( ESDT, DATE, URL, pathT,  [Variable('T')] )
+    db.record( ESDT, DATE, URL, pathRH, [Variable('RH')] )
+    done, stale = db.completed( ESDT, DATE, DATE, requestSignature( [Variable('T')] ) )
+  assert done  == {(URL, pathT)}
+  assert stale == {(URL, pathRH)}
+
+def test_same_request_other_path_is_not_done( tmp_path ):
+  path = granule( tmp_path, 'a' )
+  with DownloadManifest( str(tmp_path / 'manifest.db') ) as db:
+    db.record( ESDT, DATE, URL, path, [Variable('T')] )
+    done, _ = db.completed( ESDT, DATE, DATE, requestSignature( [Variable('T')] ) )
+  assert (URL, str(tmp_path / 'b' / 'granule.nc4')) not in done
+
+def test_paths_are_absolute( tmp_path, monkeypatch ):
+  granule( tmp_path, 'a' )
+  monkeypatch.chdir( tmp_path )
+  with DownloadManifest( 'manifest.db' ) as db:
+    db.record( ESDT, DATE, URL, os.path.join( 'a', 'granule.nc4' ), [Variable('T')] )
+    done, _ = db.completed( ESDT, DATE, DATE, requestSignature( [Variable('T')] ) )
+  assert done == {(URL, str(tmp_path / 'a' / 'granule.nc4'))}
+
+def test_url_keyed_manifest_is_migrated( tmp_path ):
+  path = str( tmp_path / 'manifest.db' )
+  conn = sqlite3.connect( path )
+  conn.executescript( """
+    CREATE TABLE granules ( url TEXT PRIMARY KEY, collection TEXT, date TEXT, path TEXT,
+      signature TEXT, variables TEXT, slices TEXT, dlon REAL, dlat REAL, size INTEGER,
+      checksum TEXT, status TEXT, updated REAL );
+    CREATE INDEX granules_date ON granules (collection, date);
+  """ )
+  conn.execute( 'INSERT INTO granules VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+    (URL, ESDT.shortName, DATE.isoformat(), '/data/T/granule.nc4', requestSignature( [Variable('T')] ),
+     '[]', 'null', None, None, 4, None, 'complete', 0.0) )
+  conn.commit()
+  conn.close()
+
+  pathRH = granule( tmp_path, 'RH' )
+  with DownloadManifest( path ) as db:
+    db.record( ESDT, DATE, URL, pathRH, [Variable('RH')] )
+    done, stale = db.completed( ESDT, DATE, DATE, requestSignature( [Variable('T')] ) )
+  assert done  == {(URL, '/data/T/granule.nc4')}
+  assert stale == {(URL, pathRH)}
@@ -0,0 +1,24 @@
+from data_downloading.utils.metadataCache import MetadataCache
+
+LAYOUT = {'dimensions' : ('time',), 'shape' : (8,), 'dtype' : '<i4', 'chunks' : None,
+          'filters' : [], 'fill' : 0, 'atts' : {'units' : 'minutes since 2020-01-01 00:30:00'}}
+
+def test_layout_of_excluded_variable_is_not_cached( tmp_path ):
+  cache = MetadataCache( 'TEST', cachedir = str(tmp_path), exclude = ('time',) )
+  cache.setLayout( 'time', LAYOUT )
+  cache.setLayout( 'lat',  LAYOUT )
+  assert cache.getLayout( 'time' ) is None
+  assert cache.getLayout( 'lat' ) == LAYOUT
+  cache.save()
+
+  cache = MetadataCache( 'TEST', cachedir = str(tmp_path), exclude = ('time',) )
+  assert cache.getLayout( 'time' ) is None
+  assert cache.getLayout( 'lat' ) == LAYOUT
+
+def test_excluded_layout_in_existing_cache_is_ignored( tmp_path ):
+  cache = MetadataCache( 'TEST', cachedir = str(tmp_path) )                     # e.g., cache written before time was excluded
+  cache.setLayout( 'time', LAYOUT )
+  cache.save()
+
+  cache = MetadataCache( 'TEST', cachedir = str(tmp_path), exclude = ('time',) )
+  assert cache.getLayout( 'time' ) is None
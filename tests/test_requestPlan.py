@@ -0,0 +1,53 @@
+import numpy as np
+
+from data_downloading.utils.requestPlan import combinable, planRequests, slabSize
+
+def check( selections, fetches, data ):
+  """Every selection is requested once and extracted correctly from its request"""
+
+  seen = []
+  for varName, cover, members in fetches:
+    for i, localSlices in members:
+      assert selections[i][0] == varName
+      np.testing.assert_array_equal( data[cover][localSlices], data[selections[i][1]] )
+      seen.append( i )
+  assert sorted( seen ) == list( range( len(selections) ) )
+
+def test_overlapping_selections_are_merged():
+  data       = np.arange( 8 * 10 ).reshape( 8, 10 )
+  selections = [('T', (slice(0, 8, 1), slice(0, 6, 1))),
+                ('T', (slice(0, 8, 1), slice(4, 10, 1)))]
+  fetches    = planRequests( selections )
+  assert len(fetches) == 1
+  assert fetches[0][1] == (slice(0, 8, 1), slice(0, 10, 1))
+  check( selections, fetches, data )
+
+def test_distant_selections_are_not_merged():
+  data       = np.arange( 1000 * 10 ).reshape( 1000, 10 )
+  selections = [('T', (slice(0, 2, 1),     slice(0, 10, 1))),
+                ('T', (slice(998, 1000, 1), slice(0, 10, 1)))]
+  fetches    = planRequests( selections, itemsize = 4, requestBytes = 100 )
+  assert len(fetches) == 2
+  assert sum( slabSize( cover ) for _, cover, _ in fetches ) == 40
+  check( selections, fetches, data )
+
+def test_variables_are_planned_separately():
+  data       = np.arange( 4 * 6 ).reshape( 4, 6 )
+  selections = [('T',  (slice(0, 4, 1), slice(0, 3, 1))),
+                ('RH', (slice(0, 4, 1), slice(0, 3, 1))),
+                ('T',  (slice(0, 4, 1), slice(2, 6, 1)))]
+  fetches    = planRequests( selections )
+  assert [varName for varName, _, _ in fetches] == ['T', 'RH']
+  check( selections, fetches, data )
+
+def test_strided_selections_keep_step():
+  data       = np.arange( 20 )
+  selections = [('T', (slice(0, 9, 2),)), ('T', (slice(6, 15, 2),))]
+  fetches    = planRequests( selections )
+  assert len(fetches) == 1
+  assert fetches[0][1] == (slice(0, 15, 2),)
+  check( selections, fetches, data )
+
+def test_combinable_takes_first_request_per_variable():
+  fetches = [('T', None, []), ('RH', None, []), ('T', None, []), ('U', None, [])]
+  assert combinable( fetches ) == [0, 1, 3]
@@ -0,0 +1,66 @@
+import socket
+
+import aiohttp
+import pytest
+import requests
+
+from data_downloading.utils.retry import (AUTH, CLIENT, OTHER, SERVER, TIMEOUT,
+                                          classifyError, errorStatus)
+
+URL = 'https://goldsmr4.gesdisc.eosdis.nasa.gov:443/opendap/MERRA2/M2I3NPASM.5.12.4/2010/01/MERRA2_300.inst3_3d_asm_Np.20100101.nc4'
+
+def httpError( status ):
+  resp             = requests.Response()
+  resp.status_code = status
+  resp.url         = URL
+  resp.reason      = 'Error'
+  try:
+    resp.raise_for_status()
+  except requests.exceptions.HTTPError as err:
+    return err
+
+def test_read_timeout_on_port_443():
+  err = requests.exceptions.ReadTimeout(
+    "HTTPSConnectionPool(host='goldsmr4.gesdisc.eosdis.nasa.gov', port=443): "
+    "Read timed out. (read timeout=600.0)" )
+  assert errorStatus( err ) is None
+  assert classifyError( err ) == TIMEOUT
+
+def test_connection_error_on_port_443():
+  err = requests.exceptions.ConnectionError(
+    "HTTPSConnectionPool(host='goldsmr4.gesdisc.eosdis.nasa.gov', port=443): "
+    f"Max retries exceeded with url: {URL}.dods "
+    "(Caused by NewConnectionError('Failed to establish a new connection: [Errno 111] Connection refused'))" )
+  assert classifyError( err ) == TIMEOUT
+
+def test_network_error_types():
+  assert classifyError( socket.timeout( 'timed out' ) ) == TIMEOUT
+  assert classifyError( ConnectionResetError( 104, 'Connection reset by peer' ) ) == TIMEOUT
+  assert classifyError( aiohttp.ServerDisconnectedError() ) == TIMEOUT
+
+@pytest.mark.parametrize( 'status, kind', [(401, AUTH), (404, CLIENT), (413, CLIENT), (503, SERVER)] )
+def test_requests_http_error( status, kind ):
+  err = httpError( status )
+  assert errorStatus( err ) == status
+  assert classifyError( err ) == kind
+
+def test_wrapped_http_error():
+  """pydap raises a new HTTPError from the requests error"""
+
+  try:
+    try:
+      raise httpError( 503 )
+    except requests.exceptions.HTTPError as http_err:
+      raise requests.exceptions.HTTPError( f'HTTP Error occurred {http_err} - Failed to fetch data' ) from http_err
+  except requests.exceptions.HTTPError as err:
+    assert errorStatus( err ) == 503
+    assert classifyError( err ) == SERVER
+
+def test_aiohttp_status():
+  err = aiohttp.ClientResponseError( None, (), status = 502, message = 'Bad Gateway' )
+  assert classifyError( err ) == SERVER
+
+def test_status_in_message():
+  assert errorStatus( Exception( 'HTTP Error 404: Not Found' ) ) == 404
+  assert errorStatus( Exception( 'Connection to host:443 failed' ) ) is None
+  assert classifyError( Exception( 'failed at port=443' ) ) == OTHER